@@ -0,0 +1,73 @@
+"""
+Benchmark the lookups in the index of blacklisted domains used by
+SpamModerator, django_comments_xtd.blacklist.DomainIndex, with up to
+1M domains.
+
+Run it from the root of the repository::
+
+    $ python benchmarks/blacklist.py
+
+No database is required, the domains are made up in memory. Looked up
+domains are a mix of blacklisted domains, subdomains of blacklisted domains
+and domains not blacklisted. The time per lookup must stay roughly constant
+as the number of domains grows.
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "django_comments_xtd.tests.settings")
+
+import django  # noqa: E402
+django.setup()
+
+from django_comments_xtd.blacklist import DomainIndex  # noqa: E402
+
+
+SIZES = (1000, 100000, 1000000)
+LOOKUPS = 200000
+TLDS = ("com", "net", "org", "info", "ru", "cn", "co.uk")
+
+
+def make_domain(rnd):
+    name = ''.join(rnd.choice(string.ascii_lowercase)
+                   for _ in range(rnd.randint(5, 15)))
+    return "%s.%s" % (name, rnd.choice(TLDS))
+
+
+def build_lookups(domains, rnd):
+    lookups = []
+    for _ in range(LOOKUPS):
+        kind = rnd.random()
+        if kind < 0.2:
+            lookups.append(rnd.choice(domains))
+        elif kind < 0.4:
+            lookups.append("mail.%s" % rnd.choice(domains))
+        else:
+            lookups.append(make_domain(rnd))
+    return lookups
+
+
+def main():
+    rnd = random.Random(0)
+    print("%10s %12s %14s %10s" % ("domains", "load (s)", "usec/lookup",
+                                   "matches"))
+    for size in SIZES:
+        domains = [make_domain(rnd) for _ in range(size)]
+        start = time.perf_counter()
+        index = DomainIndex(domains)
+        load_time = time.perf_counter() - start
+        lookups = build_lookups(domains, rnd)
+        start = time.perf_counter()
+        matches = sum(1 for domain in lookups if domain in index)
+        elapsed = time.perf_counter() - start
+        print("%10d %12.2f %14.3f %10d" %
+              (size, load_time, elapsed * 1e6 / LOOKUPS, matches))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark the size and the time to make the keys of the confirmation and
+mute URLs, made with django_comments_xtd.tokens, against the legacy keys
+that pickle the comment with django_comments_xtd.signed.
+
+Run it from the root of the repository::
+
+    $ python benchmarks/tokens.py
+
+No database is required, the comments are built in memory with comment
+texts of growing length.
+"""
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "django_comments_xtd.tests.settings")
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.contenttypes.models import ContentType  # noqa: E402
+
+from django_comments_xtd import signed, tokens  # noqa: E402
+from django_comments_xtd.conf import settings  # noqa: E402
+from django_comments_xtd.models import TmpXtdComment  # noqa: E402
+
+
+TEXT_LENGTHS = (50, 500, 3000)
+ROUNDS = 2000
+
+
+def build_comment(text_length, seed=0):
+    rnd = random.Random(seed)
+    text = ''.join(rnd.choice(string.ascii_letters + ' ')
+                   for _ in range(text_length))
+    return TmpXtdComment({
+        'content_type': ContentType(app_label="tests", model="article"),
+        'object_pk': "1234", 'site_id': 1,
+        'user_name': "Bob", 'user_email': "bob@example.com",
+        'user_url': "https://example.com/bob", 'comment': text,
+        'submit_date': datetime(2022, 10, 26, 12, 30, 15, 123456),
+        'ip_address': "192.168.100.200", 'is_public': True,
+        'is_removed': False, 'thread_id': 0, 'parent_id': 0, 'level': 0,
+        'order': 1, 'followup': True, 'type': "normal", 'user': None,
+    })
+
+
+def measure(make_key):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        key = make_key()
+    return len(key), (time.perf_counter() - start) * 1e6 / ROUNDS
+
+
+def main():
+    print("%-14s %10s %10s %14s" % ("key", "text", "length", "usec/key"))
+    for text_length in TEXT_LENGTHS:
+        comment = build_comment(text_length)
+        for name, make_key in [
+            ("legacy", lambda: signed.dumps(
+                comment, compress=True,
+                extra_key=settings.COMMENTS_XTD_SALT)),
+            ("confirmation", lambda: tokens.get_confirmation_key(comment)),
+        ]:
+            print("%-14s %10d %10d %14.2f" %
+                  ((name, text_length) + measure(make_key)))
+    print("%-14s %10s %10d %14.2f" % (("mute", "-") + measure(
+        lambda: tokens.get_mute_key(7, "1234", "bob@example.com"))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark XtdComment.tree_from_queryset with growing comment lists.
+
+Run it from the root of the repository::
+
+    $ python benchmarks/tree_from_queryset.py
+
+The comments are built in memory (no database is required) as deep and
+wide threads mixed together, sorted by COMMENTS_XTD_LIST_ORDER. The time
+per comment must stay roughly constant as the number of comments grows.
+"""
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "django_comments_xtd.tests.settings")
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth.models import AnonymousUser  # noqa: E402
+
+from django_comments_xtd.models import XtdComment  # noqa: E402
+
+
+SIZES = (1000, 10000, 50000, 100000)
+
+
+def build_comments(total, seed=0):
+    """Return `total` unsaved comments ordered by (thread_id, order)."""
+    rnd = random.Random(seed)
+    threads = {}  # thread_id -> list of comments in tree order.
+    comments = []
+    for pk in range(1, total + 1):
+        if not threads or rnd.random() < 0.05:
+            cm = XtdComment(id=pk, comment_ptr_id=pk, thread_id=pk,
+                            parent_id=pk, level=0)
+            threads[pk] = [cm]
+        else:
+            thread_id = rnd.choice(list(threads)[-20:])
+            thread = threads[thread_id]
+            # Mostly reply to the latest comments to produce deep chains.
+            parent = thread[-1] if rnd.random() < 0.7 else rnd.choice(thread)
+            cm = XtdComment(id=pk, comment_ptr_id=pk, thread_id=thread_id,
+                            parent_id=parent.pk, level=parent.level + 1)
+            # Insert right after the parent's last descendant.
+            index = thread.index(parent) + 1
+            while index < len(thread) and thread[index].level > parent.level:
+                index += 1
+            thread.insert(index, cm)
+        comments.append(cm)
+    result = []
+    for thread in threads.values():
+        for order, cm in enumerate(thread, start=1):
+            cm.order = order
+            result.append(cm)
+    return result
+
+
+def main():
+    user = AnonymousUser()
+    print("%10s %12s %16s" % ("comments", "seconds", "usec/comment"))
+    for size in SIZES:
+        comments = build_comments(size)
+        # Like timeit, keep the garbage collector out of the measurement.
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        XtdComment.tree_from_queryset(comments, user=user)
+        elapsed = time.perf_counter() - start
+        gc.enable()
+        print("%10d %12.4f %16.2f" % (size, elapsed, elapsed * 1e6 / size))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from urllib.parse import urlencode
+
 from django.contrib.contenttypes.models import ContentType
 from django.utils.module_loading import import_string
 
@@ -5,7 +7,9 @@ from django_comments.forms import CommentSecurityForm
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
-from django_comments_xtd import get_model as get_comment_model
+from django_comments_xtd import (
+    broker, cache, get_model as get_comment_model
+)
 from django_comments_xtd.conf import settings
 from django_comments_xtd.models import max_thread_level_for_content_type
 from django_comments_xtd.utils import (
@@ -71,6 +75,8 @@ class CommentBoxDriver(object):
                 count_url: <api-url-to-count-comments>,
                 send_url: <api-url-to-send-a-comment>,
                 preview_url: <api-url-to-preview-users-avatar>,
+                stream_url: <api-url-to-stream-events>,  // Only when the
+                                        // COMMENTS_XTD_STREAM_BROKER is set.
                 form: {
                     content_type: <value>,
                     object_pk: <value>,
@@ -91,7 +97,9 @@ class CommentBoxDriver(object):
         ctype_key = "%s.%s" % (ctype.app_label, ctype.model)
         options = get_app_model_options(content_type=ctype_key)
         d = {
-            "comment_count": queryset.count(),
+            "comment_count": cache.get_or_set(
+                'count', ctype.pk, obj.pk, get_current_site_id(request),
+                queryset.count),
             "allow_comments": True,
             "current_user": "0:Anonymous",
             "request_name": False,
@@ -125,6 +133,10 @@ class CommentBoxDriver(object):
             "html_id_suffix": get_html_id_suffix(obj),
             "max_thread_level": max_thread_level_for_content_type(ctype),
         }
+        if broker.get_broker() is not None:
+            d['stream_url'] = "%s?%s" % (
+                cls._reverse("comments-xtd-api-stream"),
+                urlencode({'content_type': ctype_key, 'object_pk': obj.pk}))
         try:
             user_is_authenticated = user.is_authenticated()
         except TypeError:  # Django >= 1.11
@@ -0,0 +1,168 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from django_comments_xtd.models import get_thread_page
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (a.k.a. seek) pagination for comment lists.
+
+    The cursor holds the values of the ordering fields of the last comment
+    in the page, and the next page is fetched with a WHERE clause over
+    those fields instead of an OFFSET. With an index matching the ordering,
+    fetching page N costs the same as fetching page 1.
+
+    The ordering must identify every comment uniquely, so its last field
+    is usually the primary key. Only forward navigation is provided.
+    """
+    ordering = ('-submit_date', '-id')
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(cursor))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    @property
+    def fields(self):
+        return [(name.lstrip('-'), name.startswith('-'))
+                for name in self.ordering]
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_keyset_filter(self, cursor):
+        # (a, b) after (x, y) is: a after x, or a equals x and b after y.
+        keyset_filter = Q()
+        equal_to = {}
+        for (name, descending), value in zip(self.fields, cursor):
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+            keyset_filter |= Q(**equal_to, **{lookup: value})
+            equal_to[name] = value
+        # The redundant bound on the first field, a at or after x, lets the
+        # database seek into the index instead of scanning it from the start.
+        (name, descending), value = self.fields[0], cursor[0]
+        lookup = '%s__%s' % (name, 'lte' if descending else 'gte')
+        return Q(**{lookup: value}) & keyset_filter
+
+    def encode_cursor(self, obj):
+        values = []
+        for name, _ in self.fields:
+            field = self.model._meta.get_field(name)
+            values.append(field.value_to_string(obj))
+        data = json.dumps(values, separators=(',', ':')).encode('ascii')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data = base64.urlsafe_b64decode(
+                encoded.encode('ascii') + b'=' * (-len(encoded) % 4))
+            values = json.loads(data.decode('ascii'))
+            if len(values) != len(self.fields):
+                raise ValueError()
+            return [self.model._meta.get_field(name).to_python(value)
+                    for (name, _), value in zip(self.fields, values)]
+        except (TypeError, ValueError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.page[-1]))
+
+    def get_first_link(self):
+        url = self.request.build_absolute_uri()
+        return remove_query_param(url, self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('first', self.get_first_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'first': {'type': 'string'},
+                'results': schema,
+            },
+        }
+
+
+class ThreadKeysetPagination(KeysetPagination):
+    """
+    KeysetPagination following the threaded order of comments, the same
+    order in which XtdComment.tree_from_queryset expects them.
+    """
+    ordering = ('thread_id', 'order')
+
+
+class ThreadPagination(KeysetPagination):
+    """
+    Pagination by thread. The page size is a number of threads, and each
+    page contains every comment of its threads, so replies are never
+    separated from their thread. The cursor is the last thread_id sent.
+    """
+    ordering = ('thread_id',)
+    page_size = 10
+    max_page_size = 50
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        after = cursor[0] if cursor is not None else None
+        self.page, next_thread_id = get_thread_page(queryset, self.page_size,
+                                                    after)
+        self.has_next = next_thread_id is not None
+        return self.page
+
+
+class SubtreePagination(KeysetPagination):
+    """
+    KeysetPagination over the nested comments of a single comment, which
+    all belong to the same thread.
+    """
+    ordering = ('order',)
@@ -14,14 +14,16 @@ from django_comments.models import CommentFlag
 from django_comments.signals import comment_will_be_posted, comment_was_posted
 from rest_framework import exceptions, serializers
 
-from django_comments_xtd import get_model, signed, views
+from django_comments_xtd import get_model, views
 from django_comments_xtd.choices import CommentTypeChoices
 from django_comments_xtd.conf import settings
 from django_comments_xtd.models import (TmpXtdComment, XtdComment,
                                         LIKEDIT_FLAG, DISLIKEDIT_FLAG,
+                                        MODERATION_ACTIONS,
                                         max_thread_level_for_content_type)
 from django_comments_xtd.signals import (should_request_be_authorized,
                                          confirmation_received, comment_was_updated, comment_was_removed)
+from django_comments_xtd.tokens import get_confirmation_key
 from django_comments_xtd.utils import get_app_model_options, date_format
 
 COMMENT_MAX_LENGTH = getattr(settings, 'COMMENT_MAX_LENGTH', None)
@@ -213,8 +215,13 @@ class WriteCommentSerializer(serializers.Serializer):
                 self.request.user.is_authenticated
         ):
             if views._get_comment_if_exists(resp['comment']) is None:
-                new_comment = views._create_comment(resp['comment'])
+                new_comment, created = views._create_comment_once(
+                    resp['comment'])
                 resp['comment'].xtd_comment = new_comment
+                if not created:
+                    # Posted twice at once, the other request created it.
+                    resp['code'] = 201 if new_comment.is_public else 202
+                    return resp
                 confirmation_received.send(sender=TmpXtdComment,
                                            comment=resp['comment'],
                                            request=self.request)
@@ -227,8 +234,7 @@ class WriteCommentSerializer(serializers.Serializer):
                 else:
                     resp['code'] = 202
         else:
-            key = signed.dumps(resp['comment'], compress=True,
-                               extra_key=settings.COMMENTS_XTD_SALT)
+            key = get_confirmation_key(resp['comment'])
             views.send_email_confirmation_request(resp['comment'], key, site)
             resp['code'] = 204  # Confirmation sent by mail.
 
@@ -353,6 +359,27 @@ class ReadCommentSerializer(serializers.ModelSerializer):
         return None
 
 
+class ReadCommentCountsSerializer(ReadCommentSerializer):
+    """
+    ReadCommentSerializer that represents flags as counts, read from the
+    comment's feedback counters. It expects the result of
+    models.get_feedback_counts in the 'feedback_counts' context, to tell
+    whether the current user flagged the comment.
+    """
+    flags = serializers.SerializerMethodField()
+
+    def get_flags(self, obj):
+        user_flags = self.context['feedback_counts'][obj.pk]
+        return {
+            "like": obj.likedit_count,
+            "dislike": obj.dislikedit_count,
+            "removal": obj.flagged_count,
+            "liked": user_flags['likedit'],
+            "disliked": user_flags['dislikedit'],
+            "flagged": user_flags['user_flagged'],
+        }
+
+
 class DestroyCommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = XtdComment
@@ -401,3 +428,64 @@ class UpdateCommentSerializer(serializers.ModelSerializer):
         model = XtdComment
         fields = ("comment", "type", "id", "submit_date", "pinned_at", "is_edited", "extra_data")
         read_only_fields = ("type", "submit_date", "pinned_at", "is_edited")
+
+
+class ModerateCommentsSerializer(serializers.Serializer):
+    """
+    Moderation action to apply to the comments given by ``ids``, or to the
+    comments that match all the criteria given in ``filter``.
+    """
+    action = serializers.ChoiceField(choices=sorted(MODERATION_ACTIONS))
+    ids = serializers.ListField(child=serializers.IntegerField(),
+                                required=False, allow_empty=False)
+    filter = serializers.DictField(required=False, allow_empty=False)
+
+    filter_fields = {
+        'content_type': serializers.CharField(),
+        'object_pk': serializers.CharField(),
+        'user': serializers.IntegerField(),
+        'ip_address': serializers.IPAddressField(),
+        'submitted_after': serializers.DateTimeField(),
+        'submitted_before': serializers.DateTimeField(),
+    }
+
+    def validate_filter(self, value):
+        unknown = set(value) - set(self.filter_fields)
+        if unknown:
+            raise serializers.ValidationError(
+                "Unknown filter criteria: %s." % ", ".join(sorted(unknown)))
+        lookups = {}
+        for name, raw_value in value.items():
+            field_value = self.filter_fields[name].run_validation(raw_value)
+            if name == 'content_type':
+                try:
+                    app_label, model = field_value.split(".")
+                    lookups['content_type'] = \
+                        ContentType.objects.get_by_natural_key(app_label,
+                                                               model)
+                except (ValueError, ContentType.DoesNotExist):
+                    raise serializers.ValidationError(
+                        "Invalid content_type value: %r." % field_value)
+            elif name == 'user':
+                lookups['user_id'] = field_value
+            elif name == 'submitted_after':
+                lookups['submit_date__gte'] = field_value
+            elif name == 'submitted_before':
+                lookups['submit_date__lt'] = field_value
+            else:
+                lookups[name] = field_value
+        return lookups
+
+    def validate(self, data):
+        if ('ids' in data) == ('filter' in data):
+            raise serializers.ValidationError(
+                "Either ids or filter must be given.")
+        return data
+
+    def get_pks(self, site_id):
+        """Return the pks of the comments to moderate."""
+        if 'ids' in self.validated_data:
+            return self.validated_data['ids']
+        return XtdComment.norel_objects\
+            .filter(site_id=site_id, **self.validated_data['filter'])\
+            .values_list('pk', flat=True)
@@ -0,0 +1,51 @@
+from rest_framework.throttling import BaseThrottle
+
+from django_comments_xtd import ratelimit
+
+
+class RateLimitThrottle(BaseThrottle):
+    """
+    Throttle requests with the token buckets of django_comments_xtd.ratelimit
+    for the scope, keyed by user id, IP address and target object. Limited
+    requests are rejected with 429 Too Many Requests and a Retry-After
+    header, before the view does any database work.
+    """
+    scope = None
+
+    def get_object_ident(self, request):
+        """Return the ident of the object the request is about, or None."""
+        return None
+
+    def allow_request(self, request, view):
+        user = request.user
+        self.wait_time = ratelimit.check(self.scope, {
+            'user': user.pk if user and user.is_authenticated else None,
+            'ip': self.get_ident(request),
+            'object': self.get_object_ident(request),
+        })
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
+
+
+class CommentRateThrottle(RateLimitThrottle):
+    scope = 'comment'
+
+    def get_object_ident(self, request):
+        content_type = request.data.get('content_type')
+        object_pk = request.data.get('object_pk')
+        if not content_type or not object_pk:
+            return None
+        return "%s:%s" % (content_type, object_pk)
+
+
+class FeedbackRateThrottle(RateLimitThrottle):
+    scope = 'feedback'
+
+    def get_object_ident(self, request):
+        return request.data.get('comment') or None
+
+
+class ReportRateThrottle(FeedbackRateThrottle):
+    scope = 'report'
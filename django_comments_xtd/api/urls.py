@@ -1,9 +1,11 @@
 from django.urls import path, re_path
 
 from .views import (
-    CommentCount, CommentCreate, CommentList,
-    CreateReportFlag, ToggleFeedbackFlag,
-    preview_user_avatar, CommentDestroy, CommentPin, CommentUpdate,
+    CommentCount, CommentCounts, CommentCreate, CommentList, CommentReplies,
+    CommentTree,
+    CommentModerate, CreateReportFlag, ToggleFeedbackFlag,
+    preview_user_avatar, comment_stream, CommentDestroy, CommentPin,
+    CommentUpdate,
 )
 
 urlpatterns = [
@@ -12,11 +14,17 @@ urlpatterns = [
     path('preview/', preview_user_avatar,
          name='comments-xtd-api-preview'),
     path("", CommentList.as_view(), name="comments"),
+    path('tree/', CommentTree.as_view(), name='comments-xtd-api-tree'),
+    path('counts/', CommentCounts.as_view(),
+         name='comments-xtd-api-counts'),
+    path('stream/', comment_stream, name='comments-xtd-api-stream'),
     # re_path(r'^(?P<content_type>\w+-\w+)/(?P<object_pk>[-\w]+)/$',
     #         CommentList.as_view(), name='comments-xtd-api-list'),
     # re_path(
     #     r'^(?P<content_type>\w+-\w+)/(?P<object_pk>[-\w]+)/count/$',
     #     CommentCount.as_view(), name='comments-xtd-api-count'),
+    path('moderate/', CommentModerate.as_view(),
+         name='comments-xtd-api-moderate'),
     path('feedback/', ToggleFeedbackFlag.as_view(),
          name='comments-xtd-api-feedback'),
     path('flag/', CreateReportFlag.as_view(),
@@ -25,6 +33,8 @@ urlpatterns = [
          name='comments-xtd-api-destroy'),
     path('<int:pk>/pin/', CommentPin.as_view(),
          name='comments-xtd-api-pin'),
+    path('<int:pk>/replies/', CommentReplies.as_view(),
+         name='comments-xtd-api-replies'),
     path('<int:pk>/', CommentUpdate.as_view(),
          name='comments-xtd-api-update'),
 ]
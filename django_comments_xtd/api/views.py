@@ -1,24 +1,37 @@
+import hashlib
+import json
+import time
+
 import six
 
-from django.db.models import Prefetch
+from django.db.models import Count, F, Max, Prefetch, Sum
 from django.contrib.contenttypes.models import ContentType
+from django.http import (
+    Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+)
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.utils.module_loading import import_string
 from django.utils import timezone
+from django.views.decorators.http import require_GET
 
 from django_comments.models import CommentFlag
-from django_comments.views.moderation import perform_flag
 from rest_framework import generics, mixins, permissions, status, renderers
 from rest_framework.decorators import api_view
+from rest_framework.pagination import _positive_int
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.schemas.openapi import AutoSchema
 
 from django_comments_xtd import views
-from django_comments_xtd import get_model
+from django_comments_xtd import broker, cache, get_model
 from django_comments_xtd.api.serializers import DestroyCommentSerializer, UpdateCommentSerializer
 from django_comments_xtd.conf import settings
-from django_comments_xtd.api import serializers
+from django_comments_xtd.api import pagination, serializers, throttling
 from django_comments_xtd.models import (
-    TmpXtdComment, LIKEDIT_FLAG, DISLIKEDIT_FLAG
+    TmpXtdComment, LIKEDIT_FLAG, DISLIKEDIT_FLAG, get_comment_counts,
+    get_feedback_counts, moderate_comments
 )
 from django_comments_xtd.signals import comment_was_removed, comment_was_pinned
 from django_comments_xtd.utils import get_current_site_id, date_format
@@ -36,13 +49,92 @@ class DefaultsMixin:
     @property
     def pagination_class(self):
         if self.kwargs.get('override_drf_defaults', False):
+            if settings.COMMENTS_XTD_API_PAGINATION_CLASS:
+                return import_string(
+                    settings.COMMENTS_XTD_API_PAGINATION_CLASS)
             return None
         return super().pagination_class
 
 
-class CommentCreate(DefaultsMixin, generics.CreateAPIView):
+class RateLimitMixin:
+    """
+    Check the rate limits of the rate_limit_throttle class, besides those
+    of the throttle classes of the view, see django_comments_xtd.ratelimit.
+    """
+    rate_limit_throttle = None
+
+    def get_throttles(self):
+        return super().get_throttles() + [self.rate_limit_throttle()]
+
+
+class ConditionalGetMixin:
+    """
+    Add ETag and Last-Modified headers to the responses of views of the
+    comments posted to an object, and answer conditional GET requests with
+    304 Not Modified.
+
+    Validators derive from the version of the object in the cache (see
+    COMMENTS_XTD_CACHE_ALIAS), and no query is made to get them. Without
+    cache they derive from an aggregate over the comments of the object.
+    """
+    def get_object_key(self):
+        """Return (content_type_id, object_pk, site_id) or None."""
+        return None
+
+    def get_validators(self, request):
+        object_key = self.get_object_key()
+        if object_key is None:
+            return None, None
+        if cache.get_cache() is not None:
+            version = cache.get_version(*object_key)
+            last_modified = cache.get_last_modified(*object_key)
+        else:
+            version, last_modified = self.get_version_from_db()
+        # The same version renders different responses for every query
+        # string, user and media type.
+        value = "%s|%s|%s|%s" % (version, request.get_full_path(),
+                                 request.user.pk,
+                                 request.META.get('HTTP_ACCEPT', ''))
+        etag = '"%s"' % hashlib.md5(value.encode('utf-8')).hexdigest()
+        return etag, last_modified
+
+    def get_version_from_db(self):
+        data = self.get_queryset().order_by().aggregate(
+            count=Count('pk'), last_id=Max('id'),
+            last_submit_date=Max('submit_date'),
+            last_pinned_at=Max('pinned_at'),
+            last_updated_at=Max('updated_at'),
+            feedback=Sum(F('likedit_count') + F('dislikedit_count') +
+                         F('flagged_count')))
+        dates = [date for date in (data['last_submit_date'],
+                                   data['last_pinned_at'],
+                                   data['last_updated_at']) if date]
+        last_modified = int(max(dates).timestamp()) if dates else None
+        # Every change of a comment sets its updated_at, see XtdComment.
+        version = "%(count)s-%(last_id)s-%(feedback)s" % data
+        if data['last_updated_at']:
+            version += "-%s" % data['last_updated_at'].isoformat()
+        return "%s-%s" % (version, last_modified), last_modified
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        if response is not None:
+            return response
+        response = super(ConditionalGetMixin, self).get(
+            request, *args, **kwargs)
+        if etag and response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class CommentCreate(RateLimitMixin, DefaultsMixin, generics.CreateAPIView):
     """Create a comment."""
     serializer_class = serializers.WriteCommentSerializer
+    rate_limit_throttle = throttling.CommentRateThrottle
 
     resp_dict = {}
 
@@ -74,28 +166,58 @@ class CommentCreate(DefaultsMixin, generics.CreateAPIView):
         self.resp_dict = serializer.save()
 
 
-class CommentList(DefaultsMixin, generics.ListAPIView):
-    """List all comments for a given ContentType and object ID."""
+class CommentList(ConditionalGetMixin, DefaultsMixin, generics.ListAPIView):
+    """List all comments for a given ContentType and object ID.
+
+    With ``counts_only`` (class attribute or ``?counts_only=1`` query
+    parameter) the flags of each comment are given as counts.
+    """
     serializer_class = serializers.ReadCommentSerializer
     permission_classes = (permissions.AllowAny,)
-
-    def get_queryset(self, **kwargs):
+    counts_only = False
+
+    def is_counts_only(self):
+        value = self.request.query_params.get('counts_only', None)
+        if value is None:
+            return self.counts_only
+        return value.lower() in ('1', 'true', 'yes')
+
+    def get_serializer_class(self):
+        if self.is_counts_only():
+            return serializers.ReadCommentCountsSerializer
+        return super(CommentList, self).get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        if self.is_counts_only() and args:
+            kwargs.setdefault('context', self.get_serializer_context())
+            kwargs['context']['feedback_counts'] = get_feedback_counts(
+                args[0], self.request.user, with_counts=False)
+        return super(CommentList, self).get_serializer(*args, **kwargs)
+
+    def get_content_type(self):
         content_type_arg = self.request.query_params.get('content_type', None)
-        object_pk_arg = self.request.query_params.get('object_pk', None)
         try:
             app_label, model = content_type_arg.split(".")
-            content_type = ContentType.objects.get_by_natural_key(app_label,
-                                                                  model)
-        except (AssertionError, ValueError, ContentType.DoesNotExist):
+            return ContentType.objects.get_by_natural_key(app_label, model)
+        except (AttributeError, AssertionError, ValueError,
+                ContentType.DoesNotExist):
+            return None
+
+    def get_object_key(self):
+        content_type = self.get_content_type()
+        if content_type is None:
+            return None
+        return (content_type.pk, self.request.query_params.get('object_pk'),
+                get_current_site_id(self.request))
+
+    def get_queryset(self, **kwargs):
+        content_type = self.get_content_type()
+        object_pk_arg = self.request.query_params.get('object_pk', None)
+        if content_type is None:
             qs = XtdComment.objects.none()
         else:
-            flags_qs = CommentFlag.objects.filter(flag__in=[
-                CommentFlag.SUGGEST_REMOVAL, LIKEDIT_FLAG, DISLIKEDIT_FLAG
-            ]).prefetch_related('user')
-            prefetch = Prefetch('flags', queryset=flags_qs)
             qs = XtdComment\
                 .objects\
-                .prefetch_related(prefetch)\
                 .filter(
                     content_type=content_type,
                     object_pk=object_pk_arg,
@@ -103,34 +225,166 @@ class CommentList(DefaultsMixin, generics.ListAPIView):
                     is_public=True,
                     is_removed=False
                 ).order_by('-submit_date')
+            qs = self.prefetch_flags(qs)
         return qs
 
+    def list(self, request, *args, **kwargs):
+        content_type = self.get_content_type()
+        if self.paginator is not None or content_type is None:
+            return super(CommentList, self).list(request, *args, **kwargs)
+        comments = cache.get_or_set(
+            'list-counts' if self.is_counts_only() else 'list',
+            content_type.pk, request.query_params.get('object_pk'),
+            get_current_site_id(request),
+            lambda: list(self.filter_queryset(self.get_queryset())))
+        serializer = self.get_serializer(comments, many=True)
+        return Response(serializer.data)
+
+    def prefetch_flags(self, qs):
+        if self.is_counts_only():
+            return qs
+        flags_qs = CommentFlag.objects.filter(flag__in=[
+            CommentFlag.SUGGEST_REMOVAL, LIKEDIT_FLAG, DISLIKEDIT_FLAG
+        ]).prefetch_related('user')
+        return qs.prefetch_related(Prefetch('flags', queryset=flags_qs))
+
+
+class CommentTree(CommentList):
+    """List the comments for a given ContentType and object ID as a tree.
+
+    Only the first ``max_replies`` replies of each thread are included
+    (``?replies=<n>`` query parameter), each comment comes with the number
+    of its nested comments left out in ``remaining_count``. They can be
+    fetched with ``CommentReplies``.
+
+    The tree is paginated by thread, whatever the pagination of the list
+    is, so that replies are never separated from their parents.
+    """
+    pagination_class = pagination.ThreadPagination
+    max_replies = 3
+
+    def get_max_replies(self):
+        try:
+            return _positive_int(self.request.query_params['replies'])
+        except (KeyError, ValueError):
+            return self.max_replies
+
+    def list(self, request, *args, **kwargs):
+        max_replies = self.get_max_replies()
+        queryset = self.filter_queryset(self.get_queryset())\
+            .order_by(*settings.COMMENTS_XTD_LIST_ORDER)\
+            .filter(order__lte=max_replies + 1)
+        comments = self.paginate_queryset(queryset)
+        tree = XtdComment.tree_from_queryset(comments, user=request.user,
+                                             max_replies=max_replies)
+        serializer = self.get_serializer(comments, many=True)
+        data = {item['id']: item for item in serializer.data}
+
+        result = []
+        stack = [(tree, result)]
+        while stack:
+            nodes, items = stack.pop()
+            for node in nodes:
+                item = dict(data[node['comment'].pk])
+                item['remaining_count'] = node['remaining_count']
+                item['children'] = []
+                items.append(item)
+                stack.append((node['children'], item['children']))
+        return self.get_paginated_response(result)
+
+
+class CommentReplies(CommentList):
+    """List the nested comments of a comment, in threaded order.
+
+    The nested comments are a contiguous range of the thread, they are
+    fetched by pages of the keyset pagination.
+    """
+    pagination_class = pagination.SubtreePagination
 
-class CommentCount(DefaultsMixin, generics.GenericAPIView):
+    def get_queryset(self, **kwargs):
+        comment = get_object_or_404(
+            XtdComment.norel_objects,
+            pk=self.kwargs['pk'],
+            site__pk=get_current_site_id(self.request),
+            is_public=True,
+            is_removed=False
+        )
+        qs = comment.get_descendants(
+            XtdComment.objects.filter(is_public=True, is_removed=False))
+        return self.prefetch_flags(qs)
+
+
+class CommentCount(ConditionalGetMixin, DefaultsMixin,
+                   generics.RetrieveAPIView):
     """Get number of comments posted to a given ContentType and object ID."""
     serializer_class = serializers.ReadCommentSerializer
     permission_classes = (permissions.AllowAny,)
 
+    def get_content_type(self):
+        app_label, model = self.kwargs['content_type'].split("-")
+        return ContentType.objects.get_by_natural_key(app_label, model)
+
     def get_queryset(self):
-        content_type_arg = self.kwargs.get('content_type', None)
-        object_pk_arg = self.kwargs.get('object_pk', None)
-        app_label, model = content_type_arg.split("-")
-        content_type = ContentType.objects.get_by_natural_key(app_label, model)
-        qs = XtdComment.objects.filter(content_type=content_type,
-                                       object_pk=object_pk_arg,
-                                       is_public=True)
+        qs = XtdComment.objects.filter(
+            content_type=self.get_content_type(),
+            object_pk=self.kwargs.get('object_pk', None),
+            site__pk=get_current_site_id(self.request),
+            is_public=True
+        )
         return qs
 
+    def get_object_key(self):
+        return (self.get_content_type().pk, self.kwargs['object_pk'],
+                get_current_site_id(self.request))
+
+    def retrieve(self, request, *args, **kwargs):
+        count = cache.get_or_set('count', *self.get_object_key(),
+                                 self.get_queryset().count)
+        return Response({'count': count})
+
+
+class CommentCounts(DefaultsMixin, generics.GenericAPIView):
+    """
+    Get the number of comments posted to many objects at once, given in
+    ``object`` query parameters as "app_label.model:object_pk", ie:
+    ?object=blog.post:4&object=blog.post:5. Counts are fetched with a
+    single query and returned by object: {"counts": {"blog.post:4": 3, ...}}
+    """
+    permission_classes = (permissions.AllowAny,)
+    max_objects = 100
+
     def get(self, request, *args, **kwargs):
-        return Response({'count': self.get_queryset().count()})
+        objects = request.query_params.getlist('object')
+        if not objects:
+            raise ValidationError({'object': "This field is required."})
+        if len(objects) > self.max_objects:
+            raise ValidationError(
+                {'object': "Up to %d objects are allowed." % self.max_objects})
+        pairs = {}
+        for item in objects:
+            try:
+                app_model, object_pk = item.split(":", 1)
+                app_label, model = app_model.split(".")
+                content_type = ContentType.objects.get_by_natural_key(
+                    app_label, model)
+            except (ValueError, ContentType.DoesNotExist):
+                raise ValidationError(
+                    {'object': "Invalid object value: %r." % item})
+            pairs[item] = (content_type.pk, object_pk)
+        counts = get_comment_counts(pairs.values(),
+                                    site_id=get_current_site_id(request))
+        return Response({'counts': {item: counts[pair]
+                                    for item, pair in pairs.items()}})
 
 
 class ToggleFeedbackFlag(
-        DefaultsMixin, generics.CreateAPIView, mixins.DestroyModelMixin):
+        RateLimitMixin, DefaultsMixin, generics.CreateAPIView,
+        mixins.DestroyModelMixin):
     """Create and delete like/dislike flags."""
 
     serializer_class = serializers.FlagSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    rate_limit_throttle = throttling.FeedbackRateThrottle
 
     # schema = AutoSchema(operation_id_base="Feedback")
 
@@ -149,11 +403,13 @@ class ToggleFeedbackFlag(
         self.created = f(self.request, serializer.validated_data['comment'])
 
 
-class CreateReportFlag(DefaultsMixin, generics.CreateAPIView):
+class CreateReportFlag(RateLimitMixin, DefaultsMixin,
+                       generics.CreateAPIView):
     """Create 'removal suggestion' flags."""
 
     serializer_class = serializers.FlagSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    rate_limit_throttle = throttling.ReportRateThrottle
 
     # schema = AutoSchema(operation_id_base="ReportFlag")
 
@@ -161,7 +417,7 @@ class CreateReportFlag(DefaultsMixin, generics.CreateAPIView):
         return super(CreateReportFlag, self).post(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        perform_flag(self.request, serializer.validated_data['comment'])
+        views.perform_flag(self.request, serializer.validated_data['comment'])
 
 
 @api_view(["POST"])
@@ -177,6 +433,65 @@ def preview_user_avatar(request, *args, **kwargs):
     return Response({'url': get_user_avatar(temp_comment)})
 
 
+@require_GET
+def comment_stream(request):
+    """
+    Stream the events about the comments posted to the object given by the
+    content_type (app_label.model) and object_pk query parameters.
+
+    Requests accepting text/event-stream get Server-Sent Events for up to
+    COMMENTS_XTD_STREAM_TIMEOUT seconds, after which the EventSource of
+    the browser reconnects. Other requests are answered as a long-poll, a
+    JSON object with the events published after the ``last_event_id``
+    query parameter or, if there are none yet, when the timeout expires::
+
+        {"last_event_id": 12, "events": [{"id": 12, "type": "posted",
+                                          "comment": 34}]}
+    """
+    event_broker = broker.get_broker()
+    if event_broker is None:
+        raise Http404("Streaming of comments is disabled.")
+    try:
+        app_label, model = request.GET['content_type'].split(".")
+        content_type = ContentType.objects.get_by_natural_key(app_label, model)
+        object_pk = request.GET['object_pk']
+    except (KeyError, ValueError, ContentType.DoesNotExist):
+        return HttpResponseBadRequest("Invalid content_type or object_pk.")
+    channel = broker.get_channel(content_type.pk, object_pk,
+                                 get_current_site_id(request))
+    last_id = request.META.get('HTTP_LAST_EVENT_ID',
+                               request.GET.get('last_event_id'))
+    try:
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        last_id = event_broker.last_id(channel)
+    timeout = settings.COMMENTS_XTD_STREAM_TIMEOUT
+
+    if 'text/event-stream' not in request.META.get('HTTP_ACCEPT', ''):
+        last_id, events = event_broker.wait(channel, last_id, timeout)
+        return JsonResponse({'last_event_id': last_id, 'events': events})
+
+    def stream(last_id):
+        deadline = time.monotonic() + timeout
+        remaining = timeout
+        while remaining > 0:
+            # Wake up every 15 seconds to keep the connection alive.
+            last_id, events = event_broker.wait(channel, last_id,
+                                                min(remaining, 15))
+            for event in events:
+                yield "id: %d\ndata: %s\n\n" % (
+                    event['id'], json.dumps(event))
+            if not events:
+                yield ": keepalive\n\n"
+            remaining = deadline - time.monotonic()
+
+    response = StreamingHttpResponse(stream(last_id),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable buffering in nginx.
+    return response
+
+
 class CommentDestroy(DefaultsMixin, generics.DestroyAPIView):
     queryset = XtdComment.objects.all()
     serializer_class = DestroyCommentSerializer
@@ -194,6 +509,30 @@ class CommentDestroy(DefaultsMixin, generics.DestroyAPIView):
         instance.save()
 
 
+class IsModerator(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and
+                    request.user.has_perm('django_comments.can_moderate'))
+
+
+class CommentModerate(DefaultsMixin, generics.GenericAPIView):
+    """
+    Publish, unpublish, remove, restore, pin or unpin many comments at
+    once, given by ids or by a filter. See moderate_comments.
+    """
+    serializer_class = serializers.ModerateCommentsSerializer
+    permission_classes = (IsModerator,)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        action = serializer.validated_data['action']
+        site_id = get_current_site_id(request)
+        comments = moderate_comments(serializer.get_pks(site_id), action,
+                                     site_id=site_id)
+        return Response({'action': action, 'count': len(comments)})
+
+
 class CommentPin(DefaultsMixin, generics.UpdateAPIView):
     queryset = XtdComment.objects.all()
     serializer_class = DestroyCommentSerializer
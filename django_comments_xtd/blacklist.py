@@ -0,0 +1,178 @@
+"""
+In-process index of the blacklisted domains, used by SpamModerator.
+
+The index is loaded from the BlackListedDomain model the first time it is
+needed, and looked up without hitting the database. A domain matches when
+it, or any of its parent domains, is blacklisted: blacklisting
+"example.com" discards comments from "mail.example.com" too.
+
+The index is reloaded when its version is bumped by invalidate(). Saving or
+deleting a BlackListedDomain bumps it, see django_comments_xtd.handlers, and
+so must any code that changes the table bypassing the model signals, ie:
+bulk_create or QuerySet.delete. The version is kept in the cache of
+COMMENTS_XTD_CACHE_ALIAS, when enabled, so that every process sees the
+bumps, and every process reloads its index every
+COMMENTS_XTD_BLACKLIST_REFRESH seconds too.
+
+Only the first load of the index blocks the lookup. Afterwards the index is
+reloaded in a background thread, lookups keep using the current index
+meanwhile, and the new one replaces it once complete.
+"""
+import logging
+import threading
+import time
+
+from django.db import connections, transaction
+
+from django_comments_xtd import cache
+from django_comments_xtd.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(domain):
+    return domain.strip().rstrip('.').lower()
+
+
+class DomainIndex(object):
+    """Set of blacklisted domains, matching their subdomains too."""
+    def __init__(self, domains=()):
+        self.domains = {normalize(domain) for domain in domains}
+        self.domains.discard('')
+
+    def __len__(self):
+        return len(self.domains)
+
+    def __contains__(self, domain):
+        domain = normalize(domain)
+        if domain in self.domains:
+            return True
+        # Walk up the parent domains, ie: "a.b.com", "b.com", "com".
+        dot = domain.find('.')
+        while dot != -1:
+            if domain[dot + 1:] in self.domains:
+                return True
+            dot = domain.find('.', dot + 1)
+        return False
+
+
+VERSION_KEY = 'django_comments_xtd:blacklist:version'
+
+_index = None
+_index_version = None
+_loaded_at = 0.0
+_version = 0
+_reloading = False
+_lock = threading.Lock()
+_first_load_lock = threading.Lock()
+
+
+def load_index():
+    """Return a new DomainIndex with the domains in the database."""
+    from django_comments_xtd.models import BlackListedDomain
+
+    domains = BlackListedDomain.objects.values_list('domain', flat=True)
+    return DomainIndex(domains.iterator(chunk_size=10000))
+
+
+def get_version():
+    """Return the current version of the index, shared through the cache
+    when COMMENTS_XTD_CACHE_ALIAS is set, or else of this process."""
+    shared = cache.get_cache()
+    if shared is None:
+        return _version
+    version = shared.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock, so that no process takes its index as
+        # current after the version was evicted from the cache.
+        version = time.time_ns() // 1000
+        if not shared.add(VERSION_KEY, version, timeout=None):
+            version = shared.get(VERSION_KEY, version)
+    return version
+
+
+def reload(version=None):
+    """Load the index from the database and replace the current one."""
+    global _index, _index_version, _loaded_at
+
+    if version is None:
+        version = get_version()
+    index = load_index()
+    with _lock:
+        _index = index
+        _index_version = version
+        _loaded_at = time.monotonic()
+
+
+def _reload_in_background(version):
+    global _reloading
+
+    try:
+        reload(version)
+    except Exception:
+        logger.exception("Failed to reload the blacklisted domains.")
+    finally:
+        with _lock:
+            _reloading = False
+
+
+def _run_in_background(function, *args):
+    def run():
+        try:
+            function(*args)
+        finally:
+            # Close the connections opened by the thread.
+            connections.close_all()
+
+    threading.Thread(target=run, daemon=True,
+                     name="comments-xtd-blacklist").start()
+
+
+def get_index():
+    """
+    Return the current DomainIndex. When it is outdated, start reloading it
+    in a background thread, unless a reload is running already.
+    """
+    global _reloading
+
+    version = get_version()
+    if _index is None:
+        with _first_load_lock:
+            if _index is None:
+                reload(version)
+        return _index
+    refresh = settings.COMMENTS_XTD_BLACKLIST_REFRESH
+    if _index_version != version or (
+        refresh and time.monotonic() - _loaded_at >= refresh
+    ):
+        with _lock:
+            start, _reloading = not _reloading, True
+        if start:
+            _run_in_background(_reload_in_background, version)
+    return _index
+
+
+def is_blacklisted(domain):
+    return domain in get_index()
+
+
+def invalidate():
+    """Bump the version of the index, to reload it on the next lookup of
+    every process."""
+    def bump_version():
+        global _version
+        with _lock:
+            _version += 1
+        shared = cache.get_cache()
+        if shared is not None:
+            try:
+                shared.incr(VERSION_KEY)
+            except ValueError:  # No version, the next one starts anew.
+                pass
+
+    bump_version()
+    # A lookup before the changes are committed would reload the index
+    # without them in other threads, bump the version again after commit.
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump_version)
@@ -0,0 +1,166 @@
+"""
+Brokers of the events streamed to the readers of the comments of an object.
+
+Events are published to a channel per content type, object_pk and site,
+each with an id that grows by one per event in the channel. Readers wait
+for the events after the last id they received. Brokers keep only a short
+backlog of events per channel, events are notifications that the comments
+of the object changed, not the changes themselves.
+
+The broker in use is defined by the setting COMMENTS_XTD_STREAM_BROKER:
+
+ * LocalBroker keeps events in the memory of the process. It only serves
+   setups with a single process, ie: the development server.
+ * RedisBroker keeps events in Redis, shared by every process. It requires
+   the redis package or a client object with the same interface.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from django_comments_xtd.conf import settings
+
+
+def get_channel(content_type_id, object_pk, site_id):
+    return '%s:%s:%s' % (content_type_id, object_pk, site_id)
+
+
+class BaseBroker(object):
+    def publish(self, channel, event):
+        """Publish the dict event to the channel, return its id."""
+        raise NotImplementedError
+
+    def last_id(self, channel):
+        """Return the id of the last event published to the channel."""
+        raise NotImplementedError
+
+    def wait(self, channel, last_id, timeout):
+        """
+        Wait up to timeout seconds for events published to the channel
+        after last_id. Returns a tuple with the id of the last event and
+        the list of events, which is empty if the timeout expired.
+        """
+        raise NotImplementedError
+
+
+class LocalBroker(BaseBroker):
+    def __init__(self, backlog=100):
+        self.backlog = backlog
+        self._events = {}
+        self._last_ids = {}
+        self._condition = threading.Condition()
+
+    def publish(self, channel, event):
+        with self._condition:
+            event_id = self._last_ids.get(channel, 0) + 1
+            self._last_ids[channel] = event_id
+            self._events.setdefault(channel, deque(maxlen=self.backlog))\
+                .append(dict(event, id=event_id))
+            self._condition.notify_all()
+        return event_id
+
+    def last_id(self, channel):
+        with self._condition:
+            return self._last_ids.get(channel, 0)
+
+    def wait(self, channel, last_id, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events = [event for event in self._events.get(channel, ())
+                          if event['id'] > last_id]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        if events:
+            last_id = events[-1]['id']
+        return last_id, events
+
+
+class RedisBroker(BaseBroker):
+    """
+    Events of a channel are stored in a Redis list, and their ids come from
+    a Redis counter. Readers poll the counter every poll_interval seconds.
+    """
+    def __init__(self, url="redis://localhost:6379/0", client=None,
+                 backlog=100, poll_interval=0.5,
+                 key_prefix="django_comments_xtd:stream"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured(
+                    "RedisBroker requires the redis package.")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.backlog = backlog
+        self.poll_interval = poll_interval
+        self.key_prefix = key_prefix
+
+    def _keys(self, channel):
+        key = "%s:%s" % (self.key_prefix, channel)
+        return key + ":id", key + ":events"
+
+    def publish(self, channel, event):
+        id_key, events_key = self._keys(channel)
+        event_id = self.client.incr(id_key)
+        self.client.rpush(events_key, json.dumps(dict(event, id=event_id)))
+        self.client.ltrim(events_key, -self.backlog, -1)
+        return event_id
+
+    def last_id(self, channel):
+        id_key, _ = self._keys(channel)
+        return int(self.client.get(id_key) or 0)
+
+    def wait(self, channel, last_id, timeout):
+        _, events_key = self._keys(channel)
+        deadline = time.monotonic() + timeout
+        while self.last_id(channel) <= last_id:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return last_id, []
+            time.sleep(min(self.poll_interval, remaining))
+        events = [json.loads(item)
+                  for item in self.client.lrange(events_key, 0, -1)]
+        events = sorted([event for event in events if event['id'] > last_id],
+                        key=lambda event: event['id'])
+        if events:
+            last_id = events[-1]['id']
+        return last_id, events
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the broker in use, or None when streaming is disabled."""
+    path = settings.COMMENTS_XTD_STREAM_BROKER
+    if not path:
+        return None
+    with _brokers_lock:
+        if path not in _brokers:
+            broker_class = import_string(path)
+            _brokers[path] = broker_class(
+                **settings.COMMENTS_XTD_STREAM_BROKER_OPTIONS)
+        return _brokers[path]
+
+
+def publish_comment_event(comment, event_type):
+    """
+    Publish an event of the given type, ie: 'posted', 'removed', about the
+    comment to the channel of its object, once the transaction commits.
+    """
+    broker = get_broker()
+    if broker is None:
+        return
+    channel = get_channel(comment.content_type_id, comment.object_pk,
+                          comment.site_id)
+    event = {'type': event_type, 'comment': comment.pk}
+    transaction.on_commit(lambda: broker.publish(channel, event))
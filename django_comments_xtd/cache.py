@@ -0,0 +1,155 @@
+"""
+Opt-in cache of the comments posted to an object.
+
+Enabled with the setting COMMENTS_XTD_CACHE_ALIAS, the name of one of the
+caches in Django's CACHES setting. Values are stored per content type,
+object_pk and site, under keys that include a version number kept in the
+cache too. Invalidating the cached values of an object is an increment of
+its version, the values stored under older versions are never read again
+and expire after COMMENTS_XTD_CACHE_TIMEOUT seconds.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import caches
+from django.db import transaction
+
+from django_comments_xtd.conf import settings
+
+
+KEY_PREFIX = 'django_comments_xtd'
+
+_missing = object()
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the cache in use, or None when the cache is disabled."""
+    alias = settings.COMMENTS_XTD_CACHE_ALIAS
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def _object_key(content_type_id, object_pk, site_id):
+    return '%s:%s:%s' % (content_type_id, object_pk, site_id)
+
+
+def get_version(content_type_id, object_pk, site_id):
+    """Return the current version of the cached values of the object."""
+    cache = get_cache()
+    key = '%s:version:%s' % (
+        KEY_PREFIX, _object_key(content_type_id, object_pk, site_id))
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, so that values cached before the version
+        # was evicted from the cache are not taken as current.
+        version = time.time_ns() // 1000
+        if cache.add(key, version, timeout=None):
+            _set_last_modified(cache, content_type_id, object_pk, site_id)
+        else:
+            version = cache.get(key, version)
+    return version
+
+
+def _set_last_modified(cache, content_type_id, object_pk, site_id):
+    key = '%s:modified:%s' % (
+        KEY_PREFIX, _object_key(content_type_id, object_pk, site_id))
+    cache.set(key, int(time.time()), timeout=None)
+
+
+def get_last_modified(content_type_id, object_pk, site_id):
+    """
+    Return the timestamp of the last invalidation of the cached values of
+    the object, or of the creation of its version, whichever is later.
+    """
+    cache = get_cache()
+    key = '%s:modified:%s' % (
+        KEY_PREFIX, _object_key(content_type_id, object_pk, site_id))
+    last_modified = cache.get(key)
+    if last_modified is None:
+        # Evicted, from now on the object is taken as modified now.
+        last_modified = int(time.time())
+        if not cache.add(key, last_modified, timeout=None):
+            last_modified = cache.get(key, last_modified)
+    return last_modified
+
+
+def invalidate(content_type_id, object_pk, site_id):
+    """Invalidate the cached values of an object in O(1)."""
+    cache = get_cache()
+    if cache is None:
+        return
+    key = '%s:version:%s' % (
+        KEY_PREFIX, _object_key(content_type_id, object_pk, site_id))
+
+    def bump_version():
+        try:
+            cache.incr(key)
+        except ValueError:  # No version, so there is nothing to invalidate.
+            pass
+        _set_last_modified(cache, content_type_id, object_pk, site_id)
+
+    bump_version()
+    # Values cached by other requests before the changes are committed
+    # would not contain them, invalidate them again after the commit.
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump_version)
+
+
+def invalidate_comment(comment):
+    """Invalidate the cached values of the object a comment belongs to.
+    Works with XtdComment, Comment and TmpXtdComment instances."""
+    if get_cache() is None:
+        return
+    content_type_id = getattr(comment, 'content_type_id', None)
+    if content_type_id is None:
+        content_type_id = comment.content_type.pk
+    invalidate(content_type_id, comment.object_pk, comment.site_id)
+
+
+def get_or_set(kind, content_type_id, object_pk, site_id, compute):
+    """
+    Return the value of the given kind cached for the object, or compute it
+    by calling compute() and cache it. The kind is a short string, ie:
+    'count', 'tree', 'list'. Without cache it returns compute().
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    version = get_version(content_type_id, object_pk, site_id)
+    key = '%s:%s:%s:%s' % (
+        KEY_PREFIX, kind, _object_key(content_type_id, object_pk, site_id),
+        version)
+    value = cache.get(key, _missing)
+    if value is _missing:
+        _record(kind, 'misses')
+        value = compute()
+        cache.set(key, value, settings.COMMENTS_XTD_CACHE_TIMEOUT)
+    else:
+        _record(kind, 'hits')
+    return value
+
+
+def _record(kind, event):
+    with _metrics_lock:
+        _metrics[(kind, event)] += 1
+
+
+def get_metrics():
+    """
+    Return the hits and misses of the cache in this process by kind, ie:
+    {'tree': {'hits': 120, 'misses': 3}, 'count': {'hits': 80, ...}}
+    """
+    metrics = {}
+    with _metrics_lock:
+        for (kind, event), count in _metrics.items():
+            metrics.setdefault(kind, {'hits': 0, 'misses': 0})[event] = count
+    return metrics
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
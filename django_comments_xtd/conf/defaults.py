@@ -39,6 +39,14 @@ COMMENTS_XTD_SEND_HTML_EMAIL = True
 # your own celery app.
 COMMENTS_XTD_THREADED_EMAILS = True
 
+# Class path of the backend delivering emails, see django_comments_xtd.mail.
+# When None, COMMENTS_XTD_THREADED_EMAILS picks ThreadedMailBackend or
+# SyncMailBackend.
+COMMENTS_XTD_MAIL_BACKEND = None
+
+# Keyword arguments to create the mail backend, ie: {"workers": 4}.
+COMMENTS_XTD_MAIL_BACKEND_OPTIONS = {}
+
 # Define what commenting features a pair app_label.model can have.
 COMMENTS_XTD_APP_MODEL_OPTIONS = {
     'default': {
@@ -65,6 +73,75 @@ COMMENTS_XTD_API_USER_REPR = username
 COMMENTS_XTD_API_GET_USER_AVATAR = "django_comments_xtd.utils.get_user_avatar"
 
 
+# Pagination class used by the web API list of comments. The default None
+# returns all the comments at once. Use the keyset paginators to fetch
+# pages at a constant cost:
+#  - "django_comments_xtd.api.pagination.KeysetPagination", newest first.
+#  - "django_comments_xtd.api.pagination.ThreadKeysetPagination", threaded.
+COMMENTS_XTD_API_PAGINATION_CLASS = None
+
+
+# Name of the cache, in Django's CACHES setting, in which to store the list,
+# tree and count of comments of every object. None disables the cache.
+COMMENTS_XTD_CACHE_ALIAS = None
+
+# Seconds the comments of an object remain in the cache. Values are
+# invalidated as soon as comments are posted, changed or flagged.
+COMMENTS_XTD_CACHE_TIMEOUT = 300
+
+
+# Broker of the events streamed to the readers of the comments of an object,
+# ie: "django_comments_xtd.broker.LocalBroker" for a single process, or
+# "django_comments_xtd.broker.RedisBroker". None disables the stream.
+COMMENTS_XTD_STREAM_BROKER = None
+
+# Keyword arguments to create the broker, ie: {"url": "redis://..."}.
+COMMENTS_XTD_STREAM_BROKER_OPTIONS = {}
+
+# Seconds a request to the stream endpoint is kept open.
+COMMENTS_XTD_STREAM_TIMEOUT = 30
+
+# Send a single comments_were_moderated signal per bulk moderation request,
+# instead of comment_was_removed, comment_was_pinned or comment_was_updated
+# per comment.
+COMMENTS_XTD_BULK_MODERATION_SIGNAL = False
+
+
+# Token bucket rate limits of the web API endpoints that post comments
+# ("comment"), like/dislike flags ("feedback") and removal suggestions
+# ("report"), per user id, IP address and target object, ie:
+# {"comment": {"user": "5/min", "ip": "20/min", "object": "60/min"}}.
+# See django_comments_xtd.ratelimit. Empty disables the limits.
+COMMENTS_XTD_RATE_LIMITS = {}
+
+# Class path of the backend that keeps the token buckets. Use
+# "django_comments_xtd.ratelimit.LocMemRateLimitBackend" to keep them in the
+# memory of the process.
+COMMENTS_XTD_RATE_LIMIT_BACKEND = (
+    "django_comments_xtd.ratelimit.CacheRateLimitBackend"
+)
+
+# Keyword arguments to create the backend, ie: {"alias": "ratelimit"}.
+COMMENTS_XTD_RATE_LIMIT_BACKEND_OPTIONS = {}
+
+# Class path of the runner of the reviews of the comments held in review by
+# their moderator, see XtdCommentModerator.review. Use
+# "django_comments_xtd.moderation.SyncReviewRunner" to review them in the
+# request, or a class with a submit(comment_pk) method that hands the review
+# to a task queue.
+COMMENTS_XTD_REVIEW_RUNNER = (
+    "django_comments_xtd.moderation.ThreadedReviewRunner"
+)
+
+# Keyword arguments to create the review runner, ie: {"workers": 4}.
+COMMENTS_XTD_REVIEW_RUNNER_OPTIONS = {}
+
+# Seconds after which every process reloads its index of blacklisted
+# domains, used by SpamModerator. Changes to BlackListedDomain reload the
+# index of every process sharing COMMENTS_XTD_CACHE_ALIAS, or else of the
+# process that made them, right away. 0 disables the periodic reload.
+COMMENTS_XTD_BLACKLIST_REFRESH = 300
+
 # Makes the "Notify me about followup comments" checkbox in the
 # comment form checked (True) or unchecked (False) by default.
 COMMENTS_XTD_DEFAULT_FOLLOWUP = False
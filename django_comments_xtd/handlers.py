@@ -1,9 +1,103 @@
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .signals import should_request_be_authorized
+from django_comments.models import CommentFlag
+from django_comments.signals import comment_was_flagged, comment_was_posted
+
+from . import blacklist, broker, cache, get_model
+from .models import BlackListedDomain
+from .signals import (
+    should_request_be_authorized, confirmation_received, comment_was_removed,
+    comment_was_updated, comment_was_pinned, comments_were_moderated
+)
 
 
 @receiver(should_request_be_authorized, dispatch_uid="check_authentication")
 def check_authentication(sender, comment, request, **kwargs):
     if request.user and request.user.is_authenticated:
         return True
+
+
+# ----------------------------------------------------------------------
+# Invalidation of the cached comments, see django_comments_xtd.cache.
+
+@receiver(comment_was_posted, dispatch_uid="cache_comment_was_posted")
+@receiver(confirmation_received, dispatch_uid="cache_confirmation_received")
+@receiver(comment_was_removed, dispatch_uid="cache_comment_was_removed")
+@receiver(comment_was_updated, dispatch_uid="cache_comment_was_updated")
+@receiver(comment_was_pinned, dispatch_uid="cache_comment_was_pinned")
+@receiver(comment_was_flagged, dispatch_uid="cache_comment_was_flagged")
+def invalidate_cached_comments(sender, comment, **kwargs):
+    cache.invalidate_comment(comment)
+
+
+@receiver(post_save, sender=get_model(), dispatch_uid="cache_comment_saved")
+@receiver(post_delete, sender=get_model(),
+          dispatch_uid="cache_comment_deleted")
+def invalidate_cached_comments_on_save(sender, instance, raw=False,
+                                       **kwargs):
+    if not raw:
+        cache.invalidate_comment(instance)
+
+
+@receiver(comments_were_moderated,
+          dispatch_uid="cache_comments_were_moderated")
+def invalidate_cached_moderated_comments(sender, comments, **kwargs):
+    for object_key in {(comment.content_type_id, comment.object_pk,
+                        comment.site_id) for comment in comments}:
+        cache.invalidate(*object_key)
+
+
+@receiver(post_save, sender=CommentFlag, dispatch_uid="cache_flag_saved")
+@receiver(post_delete, sender=CommentFlag, dispatch_uid="cache_flag_deleted")
+def invalidate_cached_comments_on_flag(sender, instance, raw=False,
+                                       **kwargs):
+    if not raw:
+        cache.invalidate_comment(instance.comment)
+
+
+# ----------------------------------------------------------------------
+# Reload of the index of blacklisted domains, see
+# django_comments_xtd.blacklist.
+
+@receiver(post_save, sender=BlackListedDomain,
+          dispatch_uid="blacklist_domain_saved")
+@receiver(post_delete, sender=BlackListedDomain,
+          dispatch_uid="blacklist_domain_deleted")
+def invalidate_blacklist(sender, **kwargs):
+    blacklist.invalidate()
+
+
+# ----------------------------------------------------------------------
+# Events streamed to the readers of the comments, see
+# django_comments_xtd.broker. New comments are taken from post_save, as
+# comment_was_posted is not sent when a comment is created on confirmation.
+
+@receiver(post_save, sender=get_model(), dispatch_uid="stream_comment_saved")
+def stream_comment_posted(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.is_public:
+        broker.publish_comment_event(instance, 'posted')
+
+
+@receiver(comment_was_removed, dispatch_uid="stream_comment_was_removed")
+def stream_comment_removed(sender, comment, **kwargs):
+    broker.publish_comment_event(comment, 'removed')
+
+
+@receiver(comment_was_updated, dispatch_uid="stream_comment_was_updated")
+def stream_comment_updated(sender, comment, **kwargs):
+    broker.publish_comment_event(comment, 'updated')
+
+
+@receiver(comment_was_pinned, dispatch_uid="stream_comment_was_pinned")
+def stream_comment_pinned(sender, comment, **kwargs):
+    broker.publish_comment_event(comment, 'pinned')
+
+
+@receiver(comments_were_moderated,
+          dispatch_uid="stream_comments_were_moderated")
+def stream_comments_moderated(sender, action, comments, **kwargs):
+    event_type = {'remove': 'removed', 'pin': 'pinned',
+                  'unpin': 'pinned'}.get(action, 'updated')
+    for comment in comments:
+        broker.publish_comment_event(comment, event_type)
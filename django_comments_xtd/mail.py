@@ -0,0 +1,217 @@
+"""
+Backends delivering the emails sent by django-comments-xtd: confirmation
+requests, follow-up notifications and moderation notices.
+
+The backend in use is defined by the setting COMMENTS_XTD_MAIL_BACKEND. When
+it is not set, COMMENTS_XTD_THREADED_EMAILS picks one of:
+
+ * SyncMailBackend delivers the messages in the thread of the caller, before
+   returning. It is the one to use in tests, or when delivery is handled by
+   an email backend that already queues, ie: django-celery-email.
+ * ThreadedMailBackend queues the messages in a bounded queue, drained by a
+   pool of worker threads that deliver them in batches.
+
+Both hand every batch of messages to the Django email backend in a single
+call, through one connection. When the call fails the messages are sent one
+by one, retried with an exponential backoff, and a message that keeps failing
+is dropped without holding back the others. The messages sent within a
+`with backend.batch():` block are handed over in batches, ie: the follow-up
+notifications of a comment.
+"""
+import itertools
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.mail import get_connection
+from django.utils.module_loading import import_string
+
+from django_comments_xtd.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class BaseMailBackend(object):
+    def __init__(self, batch_size=50, retries=0, backoff=1.0):
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+
+    def dispatch(self, messages, fail_silently=False):
+        """Deliver or schedule the delivery of the email messages."""
+        raise NotImplementedError
+
+    def send_messages(self, messages, fail_silently=False):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            self.dispatch(messages, fail_silently)
+            return
+        pending.extend((message, fail_silently) for message in messages)
+        if len(pending) >= self.batch_size:
+            self._dispatch_pending(pending)
+
+    def _dispatch_pending(self, pending):
+        for fail_silently, group in itertools.groupby(pending,
+                                                      lambda item: item[1]):
+            self.dispatch([message for message, _ in group], fail_silently)
+        del pending[:]
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect the messages sent by the current thread within the block,
+        and dispatch them in batches of up to batch_size messages.
+        """
+        if getattr(self._local, 'pending', None) is not None:
+            yield  # Already collecting in an outer block.
+            return
+        self._local.pending = []
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            self._dispatch_pending(pending)
+
+    def deliver(self, messages, fail_silently=False):
+        """
+        Deliver the messages, see deliver_items. When a message is dropped
+        and fail_silently is False, raise its error once the other messages
+        are delivered.
+        """
+        errors = self.deliver_items([(message, fail_silently)
+                                     for message in messages])
+        if errors:
+            raise errors[-1][1]
+
+    def deliver_items(self, items):
+        """
+        Deliver the (message, fail_silently) items, handing the messages to
+        the email backend in one call through a single connection. When the
+        call fails, the messages are sent one by one, and every message that
+        fails is retried up to self.retries times, waiting backoff seconds,
+        twice as long on every further attempt. A message that still fails
+        is dropped. Return the (message, error) pairs of the messages dropped
+        whose fail_silently is False.
+
+        An email backend that fails in the middle of a call may have sent
+        the messages before the failing one, they are sent again.
+        """
+        items = list(items)
+        if not items:
+            return []
+        try:
+            self._send([message for message, _ in items])
+            return []
+        except Exception as exc:
+            batch_error = exc
+            logger.warning("Failed to deliver %d email message(s) at once, "
+                           "sending them one by one.", len(items),
+                           exc_info=True)
+        errors = []
+        # The call with a single message was its first attempt already.
+        first_attempt = 1 if len(items) == 1 else 0
+        for message, fail_silently in items:
+            error = batch_error if first_attempt else None
+            for attempt in range(first_attempt, self.retries + 1):
+                if attempt:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                try:
+                    self._send([message])
+                    error = None
+                    break
+                except Exception as exc:
+                    error = exc
+            if error is not None and not fail_silently:
+                errors.append((message, error))
+        return errors
+
+    def _send(self, messages):
+        with get_connection() as connection:
+            connection.send_messages(messages)
+
+
+class SyncMailBackend(BaseMailBackend):
+    def dispatch(self, messages, fail_silently=False):
+        self.deliver(messages, fail_silently)
+
+
+class ThreadedMailBackend(BaseMailBackend):
+    """
+    Messages wait in a queue of up to queue_size messages, taken by workers
+    in batches of up to batch_size messages. When the queue is full the
+    caller waits up to block_timeout seconds, and then delivers the message
+    itself, so that senders slow down to the pace of delivery.
+    """
+    def __init__(self, workers=2, queue_size=1000, batch_size=50,
+                 block_timeout=5, retries=3, backoff=1.0):
+        super().__init__(batch_size=batch_size, retries=retries,
+                         backoff=backoff)
+        self.workers = workers
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name="comments-xtd-mail")
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for message, error in self.deliver_items(batch):
+                    logger.error("Failed to deliver the email message %r.",
+                                 message.subject, exc_info=error)
+            except Exception:
+                logger.exception("Failed to deliver %d email message(s).",
+                                 len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def dispatch(self, messages, fail_silently=False):
+        self._start_workers()
+        for message in messages:
+            try:
+                self.queue.put((message, fail_silently),
+                               timeout=self.block_timeout)
+            except queue.Full:
+                self.deliver([message], fail_silently)
+
+    def join(self):
+        """Wait until every queued message has been processed."""
+        self.queue.join()
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_mail_backend():
+    """Return the mail backend in use."""
+    path = settings.COMMENTS_XTD_MAIL_BACKEND
+    if not path:
+        if settings.COMMENTS_XTD_THREADED_EMAILS:
+            path = "django_comments_xtd.mail.ThreadedMailBackend"
+        else:
+            path = "django_comments_xtd.mail.SyncMailBackend"
+    with _backends_lock:
+        if path not in _backends:
+            backend_class = import_string(path)
+            _backends[path] = backend_class(
+                **settings.COMMENTS_XTD_MAIL_BACKEND_OPTIONS)
+        return _backends[path]
@@ -0,0 +1,138 @@
+import csv
+import gzip
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from django_comments_xtd import blacklist
+from django_comments_xtd.models import BlackListedDomain
+
+
+__all__ = ['Command']
+
+
+DOMAIN_RE = re.compile(r'^(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+'
+                       r'[a-z0-9][a-z0-9-]{0,61}[a-z0-9]$')
+
+
+def open_list(path):
+    """Open a plain text or gzip compressed domain list as text."""
+    with open(path, 'rb') as stream:
+        compressed = stream.read(2) == b'\x1f\x8b'
+    if compressed:
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace',
+                         newline='')
+    return open(path, encoding='utf-8', errors='replace', newline='')
+
+
+def read_domains(lines, max_length):
+    """
+    Yield (domain, valid) for every entry of a domain list: one domain per
+    line, or per row in the first column of a CSV file. Text after '#' is
+    a comment. Domains are normalized, ie: "*.Spam.com." is "spam.com".
+    """
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        value = row[0].split('#', 1)[0]
+        domain = blacklist.normalize(value).lstrip('@')
+        if domain.startswith('*.'):
+            domain = domain[2:]
+        if not domain:
+            continue
+        yield domain, (len(domain) <= max_length and
+                       DOMAIN_RE.match(domain) is not None)
+
+
+class Command(BaseCommand):
+    help = ("Synchronize the blacklisted domains with a domain list file, "
+            "ie: the list at http://www.joewein.net/spam/blacklist.htm")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help="Domain list, plain text or CSV, "
+                                 "optionally gzip compressed.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help="Database connection to import into.")
+        parser.add_argument('--keep-existing', action='store_true',
+                            help="Only add domains, don't remove the "
+                                 "domains missing from the list.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Domains inserted or deleted per query.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report the changes, without applying "
+                                 "them.")
+
+    def read_list(self, path):
+        """Return the set of valid domains in the list file."""
+        max_length = BlackListedDomain._meta.get_field('domain').max_length
+        domains, invalid = set(), 0
+        try:
+            with open_list(path) as lines:
+                for domain, valid in read_domains(lines, max_length):
+                    if valid:
+                        domains.add(domain)
+                    else:
+                        invalid += 1
+                        if self.verbosity > 1:
+                            self.stdout.write("Skipped invalid domain '%s'."
+                                              % domain)
+        except (OSError, EOFError) as exc:
+            raise CommandError("Can't read '%s': %s" % (path, exc))
+        if invalid:
+            self.stdout.write("Skipped %d invalid domain(s)." % invalid)
+        return domains
+
+    def diff(self, using, domains, keep_existing):
+        """
+        Return the domains to add and the ids of the rows to delete: those
+        of the domains not in the list, unless keep_existing, and those
+        repeating a domain.
+        """
+        existing, delete_ids = set(), []
+        rows = BlackListedDomain.objects.using(using)\
+            .order_by('pk').values_list('pk', 'domain')\
+            .iterator(chunk_size=10000)
+        for pk, domain in rows:
+            domain = blacklist.normalize(domain)
+            if domain in existing or (
+                not keep_existing and domain not in domains
+            ):
+                delete_ids.append(pk)
+            else:
+                existing.add(domain)
+        return sorted(domains - existing), delete_ids
+
+    def delete_rows(self, connection, ids, batch_size):
+        # Raw deletes, QuerySet.delete() would fetch every row to send the
+        # post_delete signal, that reloads the index of blacklisted domains.
+        qn = connection.ops.quote_name
+        sql = "DELETE FROM %s WHERE %s IN (%%s)" % (
+            qn(BlackListedDomain._meta.db_table),
+            qn(BlackListedDomain._meta.pk.column))
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start:start + batch_size]
+                cursor.execute(sql % ', '.join(['%s'] * len(batch)), batch)
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        using = options['database']
+        batch_size = options['batch_size']
+        domains = self.read_list(options['path'])
+        add, delete_ids = self.diff(using, domains, options['keep_existing'])
+        if options['dry_run']:
+            self.stdout.write("Would add %d domain(s) and remove %d "
+                              "domain(s)." % (len(add), len(delete_ids)))
+            return
+
+        with transaction.atomic(using=using):
+            self.delete_rows(connections[using], delete_ids, batch_size)
+            BlackListedDomain.objects.using(using).bulk_create(
+                [BlackListedDomain(domain=domain) for domain in add],
+                batch_size=batch_size)
+            if add or delete_ids:
+                blacklist.invalidate()
+        self.stdout.write("Added %d domain(s) and removed %d domain(s)."
+                          % (len(add), len(delete_ids)))
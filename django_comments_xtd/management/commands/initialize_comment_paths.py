@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.utils import ConnectionDoesNotExist
+from django.core.management.base import BaseCommand
+
+from django_comments_xtd.models import XtdComment
+
+
+class Command(BaseCommand):
+    help = "Initialize the path field for all the comments in the DB."
+
+    def add_arguments(self, parser):
+        parser.add_argument('using', nargs='*', type=str)
+        parser.add_argument('--threads-per-batch', type=int, default=100,
+                            help="Number of threads updated per transaction.")
+
+    def initialize_paths(self, using, thread_ids):
+        comments = XtdComment.norel_objects.using(using)
+        with transaction.atomic(using=using):
+            # Lock the root comments of the threads, as replies do, so
+            # that no reply gets its path from a parent without path.
+            comments.filter(pk__in=thread_ids)\
+                    .update(thread_id=F('thread_id'))
+            paths = {}
+            updated = []
+            for comment in comments.filter(thread_id__in=thread_ids)\
+                                   .order_by('thread_id', 'order')\
+                                   .only('pk', 'parent_id', 'path'):
+                if comment.pk == comment.parent_id:
+                    path = ''
+                elif comment.parent_id in paths:
+                    parent = paths[comment.parent_id]
+                    path = parent.get_reply_path()
+                else:  # The parent is gone, the path remains unknown.
+                    path = None
+                paths[comment.pk] = comment
+                if comment.path != path:
+                    comment.path = path
+                    updated.append(comment)
+            comments.bulk_update(updated, ['path'], batch_size=500)
+        return len(paths)
+
+    def handle(self, *args, **options):
+        total = 0
+        using = options['using'] or ['default']
+        batch_size = options['threads_per_batch']
+
+        for db_conn in using:
+            try:
+                thread_ids = list(
+                    XtdComment.norel_objects.using(db_conn)
+                    .filter(pk=F('thread_id')).order_by('pk')
+                    .values_list('pk', flat=True))
+                for index in range(0, len(thread_ids), batch_size):
+                    total += self.initialize_paths(
+                        db_conn, thread_ids[index:index + batch_size])
+            except ConnectionDoesNotExist:
+                self.stdout.write("DB connection '%s' does not exist." %
+                                  db_conn)
+                continue
+        self.stdout.write("Updated %d XtdComment object(s)." % total)
@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models import Max, Min
+from django.db.utils import ConnectionDoesNotExist
+from django.core.management.base import BaseCommand
+
+from django_comments_xtd.models import XtdComment, get_content_hash
+
+
+class Command(BaseCommand):
+    help = "Initialize the content_hash field of the comments in the DB."
+
+    def add_arguments(self, parser):
+        parser.add_argument('using', nargs='*', type=str)
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Range of comment ids updated per "
+                                 "transaction.")
+
+    def initialize_hashes(self, using, start, end):
+        """
+        Set the content_hash of the comments without it whose id is in
+        [start, end). Duplicated comments, with a hash already taken, are
+        left without it. Returns the number of comments updated.
+        """
+        comments = XtdComment.norel_objects.using(using)
+        with transaction.atomic(using=using):
+            hashes = {}
+            for comment in comments.filter(pk__gte=start, pk__lt=end,
+                                           content_hash__isnull=True)\
+                                   .order_by('pk')\
+                                   .only('pk', 'content_type_id',
+                                         'object_pk', 'site_id', 'comment',
+                                         'user_name', 'user_email',
+                                         'followup', 'submit_date'):
+                comment.content_hash = get_content_hash(comment)
+                hashes.setdefault(comment.content_hash, comment)
+            taken = set(comments.filter(content_hash__in=list(hashes))
+                                .values_list('content_hash', flat=True))
+            updated = [comment for content_hash, comment in hashes.items()
+                       if content_hash not in taken]
+            comments.bulk_update(updated, ['content_hash'], batch_size=500)
+        return len(updated)
+
+    def handle(self, *args, **options):
+        total = 0
+        using = options['using'] or ['default']
+        batch_size = options['batch_size']
+
+        for db_conn in using:
+            try:
+                bounds = XtdComment.norel_objects.using(db_conn)\
+                    .filter(content_hash__isnull=True)\
+                    .aggregate(first=Min('pk'), last=Max('pk'))
+                if bounds['first'] is None:
+                    continue
+                for start in range(bounds['first'], bounds['last'] + 1,
+                                   batch_size):
+                    total += self.initialize_hashes(db_conn, start,
+                                                    start + batch_size)
+            except ConnectionDoesNotExist:
+                self.stdout.write("DB connection '%s' does not exist." %
+                                  db_conn)
+                continue
+        self.stdout.write("Updated %d XtdComment object(s)." % total)
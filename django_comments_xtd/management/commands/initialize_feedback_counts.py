@@ -0,0 +1,51 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.utils import ConnectionDoesNotExist
+from django.core.management.base import BaseCommand
+
+from django_comments.models import CommentFlag
+
+from django_comments_xtd.models import (
+    XtdComment, LIKEDIT_FLAG, DISLIKEDIT_FLAG
+)
+
+
+class Command(BaseCommand):
+    help = ("Initialize the likedit_count, dislikedit_count and "
+            "flagged_count fields for all the comments in the DB.")
+
+    counters = (
+        ('likedit_count', LIKEDIT_FLAG),
+        ('dislikedit_count', DISLIKEDIT_FLAG),
+        ('flagged_count', CommentFlag.SUGGEST_REMOVAL),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('using', nargs='*', type=str)
+
+    def initialize_feedback_counts(self, using):
+        # A single UPDATE, the counts are aggregated by the database.
+        values = {}
+        for field, flag in self.counters:
+            flag_count = CommentFlag.objects.using(using)\
+                .filter(comment_id=OuterRef('pk'), flag=flag)\
+                .order_by()\
+                .values('comment_id')\
+                .annotate(count=Count('pk'))\
+                .values('count')
+            values[field] = Coalesce(
+                Subquery(flag_count, output_field=IntegerField()), 0)
+        return XtdComment.norel_objects.using(using).update(**values)
+
+    def handle(self, *args, **options):
+        total = 0
+        using = options['using'] or ['default']
+
+        for db_conn in using:
+            try:
+                total += self.initialize_feedback_counts(db_conn)
+            except ConnectionDoesNotExist:
+                self.stdout.write("DB connection '%s' does not exist." %
+                                  db_conn)
+                continue
+        self.stdout.write("Updated %d XtdComment object(s)." % total)
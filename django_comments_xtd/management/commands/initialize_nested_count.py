@@ -1,46 +1,175 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections, transaction
+from django.db.models import F, Max, Q
 from django.db.utils import ConnectionDoesNotExist
 from django.core.management.base import BaseCommand
 
 from django_comments_xtd.models import XtdComment
 
 
+def initialize_threads(using, after, upto, batch_size=500):
+    """
+    Compute nested_count for the threads whose root id is in (after, upto],
+    either bound being None for no bound. Only the comments whose
+    nested_count changes are written. Returns the number of comments read.
+    """
+    comments = XtdComment.norel_objects.using(using)
+    threads = Q()
+    if after is not None:
+        threads &= Q(thread_id__gt=after)
+    if upto is not None:
+        threads &= Q(thread_id__lte=upto)
+
+    total = 0
+    updated = []
+    with transaction.atomic(using=using):
+        # Lock the root comments of the threads, as replies do, so
+        # that no reply changes the counts while they are computed.
+        comments.filter(threads, pk=F('thread_id'))\
+                .update(thread_id=F('thread_id'))
+        rows = comments.filter(threads)\
+                       .order_by('thread_id', '-order')\
+                       .values_list('pk', 'parent_id', 'thread_id',
+                                    'nested_count')\
+                       .iterator(chunk_size=2000)
+        # Control break.
+        active_thread_id = -1
+        parents = {}
+        for pk, parent_id, thread_id, old_nested_count in rows:
+            # Clean up parents when there is a control break.
+            if thread_id != active_thread_id:
+                parents = {}
+                active_thread_id = thread_id
+            nested_count = parents.pop(pk, 0)
+            parents[parent_id] = parents.get(parent_id, 0) + 1 + nested_count
+            total += 1
+            if nested_count != old_nested_count:
+                updated.append(XtdComment(pk=pk, nested_count=nested_count))
+            if len(updated) >= batch_size:
+                comments.bulk_update(updated, ['nested_count'])
+                updated = []
+        comments.bulk_update(updated, ['nested_count'])
+    return total
+
+
+def _initialize_threads(args):
+    return initialize_threads(*args)
+
+
 class Command(BaseCommand):
     help = "Initialize the nested_count field for all the comments in the DB."
 
     def add_arguments(self, parser):
         parser.add_argument('using', nargs='*', type=str)
+        parser.add_argument('--threads-per-batch', type=int, default=1000,
+                            help="Number of threads updated per transaction.")
+        parser.add_argument('--since', type=int, default=None,
+                            help="Skip the threads whose root comment id is "
+                                 "lower than or equal to this one.")
+        parser.add_argument('--checkpoint', default=None,
+                            help="File where the last thread processed is "
+                                 "recorded, to resume an interrupted run.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of processes updating threads.")
 
-    def initialize_nested_count(self, using):
-        # Control break.
-        active_thread_id = -1
-        parents = {}
+    def get_batches(self, using, since, batch_size):
+        """
+        Yield (after, upto) ranges of root ids with up to batch_size threads
+        each, the last one open ended.
+        """
+        roots = XtdComment.norel_objects.using(using)\
+            .filter(pk=F('thread_id')).order_by('pk')
+        after = since
+        while True:
+            qs = roots if after is None else roots.filter(pk__gt=after)
+            thread_ids = list(qs.values_list('pk', flat=True)[:batch_size])
+            if len(thread_ids) < batch_size:
+                yield after, None
+                return
+            yield after, thread_ids[-1]
+            after = thread_ids[-1]
 
-        qs = XtdComment.objects.using(using).order_by('thread_id', '-order')
+    def read_checkpoint(self, using):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint_file:
+                return json.load(checkpoint_file).get(using)
 
-        for comment in qs:
-            # Clean up parents when there is a control break.
-            if comment.thread_id != active_thread_id:
-                parents = {}
-                active_thread_id = comment.thread_id
+    def write_checkpoint(self, using, thread_id):
+        if not self.checkpoint:
+            return
+        data = {}
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint_file:
+                data = json.load(checkpoint_file)
+        data[using] = thread_id
+        with open(self.checkpoint, 'w') as checkpoint_file:
+            json.dump(data, checkpoint_file)
 
-            nested_count = parents.get(comment.comment_ptr_id, 0)
-            parents.setdefault(comment.parent_id, 0)
-            if nested_count > 0:
-                parents[comment.parent_id] += 1 + nested_count
-            else:
-                parents[comment.parent_id] += 1
-            comment.nested_count = nested_count
-            comment.save()
+    def initialize_nested_count(self, using, since=None, batch_size=1000,
+                                workers=1):
+        checkpoint = self.read_checkpoint(using)
+        if checkpoint is not None:
+            since = max(since or 0, checkpoint)
+        batches = self.get_batches(using, since, batch_size)
 
-        return qs.count()
+        if workers > 1:
+            # Workers open their own connections, the parent's one must
+            # not be shared with the forked processes.
+            batches = list(batches)
+            connections[using].close()
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           initializer=django.setup)
+            counts = executor.map(
+                _initialize_threads,
+                [(using, after, upto) for after, upto in batches])
+            results = zip(batches, counts)
+        else:
+            executor = None
+            results = (((after, upto), initialize_threads(using, after, upto))
+                       for after, upto in batches)
+
+        total = 0
+        started = time.monotonic()
+        try:
+            for (after, upto), count in results:
+                total += count
+                elapsed = time.monotonic() - started
+                if upto is None and (self.checkpoint or self.verbosity > 1):
+                    # The last batch, look for the id of its last root.
+                    roots = XtdComment.norel_objects.using(using)\
+                        .filter(pk=F('thread_id'))
+                    if after is not None:
+                        roots = roots.filter(pk__gt=after)
+                    upto = roots.aggregate(upto=Max('pk'))['upto'] or after
+                if upto is not None:
+                    self.write_checkpoint(using, upto)
+                if self.verbosity > 1:
+                    self.stdout.write(
+                        "Processed %d comment(s) up to thread %s, "
+                        "%.1f comment(s)/s." %
+                        (total, upto, total / elapsed if elapsed else total))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return total
 
     def handle(self, *args, **options):
         total = 0
         using = options['using'] or ['default']
+        self.verbosity = options['verbosity']
+        self.checkpoint = options['checkpoint']
 
         for db_conn in using:
             try:
-                total += self.initialize_nested_count(db_conn)
+                total += self.initialize_nested_count(
+                    db_conn, since=options['since'],
+                    batch_size=options['threads_per_batch'],
+                    workers=options['workers'])
             except ConnectionDoesNotExist:
                 self.stdout.write("DB connection '%s' does not exist." %
                                   db_conn)
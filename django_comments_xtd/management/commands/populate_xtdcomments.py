@@ -1,4 +1,7 @@
-from django.db import connections
+import time
+
+from django.db import connections, transaction
+from django.db.models import Max, Min
 from django.db.utils import ConnectionDoesNotExist, IntegrityError
 from django.core.management.base import BaseCommand
 
@@ -15,35 +18,123 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('using', nargs='*', type=str)
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Range of comment ids inserted per query.")
+        parser.add_argument('--skip-existing', action='store_true',
+                            help="Add only the comments not in the "
+                                 "xtdcomment table yet.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report the number of comments to add, "
+                                 "without adding them.")
+
+    def get_insert_sql(self, connection, skip_existing):
+        """
+        Return the INSERT ... SELECT statement that adds every comment in a
+        range of ids as the root of its own thread, and its params.
+        """
+        qn = connection.ops.quote_name
+        xtd_table = qn(XtdComment._meta.db_table)
+        columns, values, params = [], [], []
+        for field in XtdComment._meta.local_concrete_fields:
+            columns.append(qn(field.column))
+            if field.column in ('comment_ptr_id', 'thread_id', 'parent_id'):
+                values.append('c.%s' % qn(Comment._meta.pk.column))
+                continue
+            if field.name == 'path':
+                value = ''
+            else:
+                value = field.get_default()
+            values.append('%s')
+            params.append(field.get_db_prep_save(value, connection))
+        sql = ("INSERT INTO %s (%s) SELECT %s FROM %s c "
+               "WHERE c.%s >= %%s AND c.%s < %%s" %
+               (xtd_table, ', '.join(columns), ', '.join(values),
+                qn(Comment._meta.db_table), qn(Comment._meta.pk.column),
+                qn(Comment._meta.pk.column)))
+        if skip_existing:
+            sql += (" AND NOT EXISTS (SELECT 1 FROM %s x WHERE x.%s = c.%s)" %
+                    (xtd_table, qn('comment_ptr_id'),
+                     qn(Comment._meta.pk.column)))
+        return sql, params
 
-    def populate_db(self, cursor):
-        for comment in Comment.objects.all():
-            sql = ("INSERT INTO %(table)s "
-                   "       ('comment_ptr_id', 'thread_id', 'parent_id',"
-                   "        'level', 'order', 'followup') "
-                   "VALUES (%(id)d, %(id)d, %(id)d, 0, 1, FALSE)")
-            cursor.execute(sql % {'table': XtdComment._meta.db_table,
-                                  'id': comment.id})
+    def count_comments(self, using, skip_existing):
+        comments = Comment.objects.using(using)
+        if skip_existing:
+            comments = comments.exclude(
+                pk__in=XtdComment.norel_objects.using(using).values('pk'))
+        return comments.count()
+
+    def populate_db(self, using, batch_size=10000, skip_existing=False):
+        connection = connections[using]
+        bounds = Comment.objects.using(using)\
+            .aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            return 0
+        sql, params = self.get_insert_sql(connection, skip_existing)
+
+        total = 0
+        started = time.monotonic()
+        for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+            end = min(start + batch_size - 1, bounds['last'])
+            try:
+                with transaction.atomic(using=using):
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql,
+                                       params + [start, start + batch_size])
+                        total += cursor.rowcount
+            except IntegrityError as exc:
+                # The ranges before this one are already committed.
+                self.write_failed_range(using, start, end, exc)
+                break
+            if self.verbosity > 0:
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    "Added %d comment(s) up to id %d, %.1f comment(s)/s." %
+                    (total, end, total / elapsed if elapsed else total))
+        return total
+
+    def in_connection(self, using):
+        if using != 'default':
+            return " (in '%s' DB connection)" % using
+        return ""
+
+    def write_not_empty(self, using):
+        self.stdout.write("Table '%s'%s must be empty."
+                          % (XtdComment._meta.db_table,
+                             self.in_connection(using)))
+
+    def write_failed_range(self, using, start, end, exc):
+        self.stdout.write("Could not add the comments with ids from %d to %d "
+                          "to table '%s'%s: %s" %
+                          (start, end, XtdComment._meta.db_table,
+                           self.in_connection(using), exc))
+        self.stdout.write("The comments with lower ids were added. Run the "
+                          "command again with --skip-existing to add the "
+                          "rest.")
 
     def handle(self, *args, **options):
         total = 0
         using = options['using'] or ['default']
+        skip_existing = options['skip_existing']
+        self.verbosity = options['verbosity']
         for db_conn in using:
             try:
-                self.populate_db(connections[db_conn].cursor())
-                total += XtdComment.objects.using(db_conn).count()
+                if options['dry_run']:
+                    total += self.count_comments(db_conn, skip_existing)
+                    continue
+                if (
+                    not skip_existing and
+                    XtdComment.norel_objects.using(db_conn).exists()
+                ):
+                    self.write_not_empty(db_conn)
+                    continue
+                total += self.populate_db(db_conn, options['batch_size'],
+                                          skip_existing)
             except ConnectionDoesNotExist:
                 self.stdout.write("DB connection '%s' does not exist."
                                   % db_conn)
                 continue
-            except IntegrityError:
-                if db_conn != 'default':
-                    self.stdout.write("Table '%s' (in '%s' DB connection) "
-                                      "must be empty."
-                                      % (XtdComment._meta.db_table, db_conn))
-                else:
-                    self.stdout.write("Table '%s' must be empty."
-                                      % XtdComment._meta.db_table)
-            finally:
-                continue
-        self.stdout.write("Added %d XtdComment object(s)." % total)
+        if options['dry_run']:
+            self.stdout.write("Would add %d XtdComment object(s)." % total)
+        else:
+            self.stdout.write("Added %d XtdComment object(s)." % total)
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 02:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_comments_xtd", "0010_xtdcomment_is_edited_xtdcomment_pinned_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="xtdcomment",
+            name="likedit_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="xtdcomment",
+            name="dislikedit_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="xtdcomment",
+            name="flagged_count",
+            field=models.IntegerField(default=0),
+        ),
+    ]
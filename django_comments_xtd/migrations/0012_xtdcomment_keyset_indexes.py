@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_comments_xtd", "0011_xtdcomment_feedback_counters"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="xtdcomment",
+            index=models.Index(
+                fields=["thread_id", "order"], name="xtdcomment_thread_order_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+
+class AddUniqueConstraintConcurrently(migrations.AddConstraint):
+    """
+    AddConstraint that, on PostgreSQL, builds the unique index concurrently,
+    without locking the table against writes, and then attaches it to the
+    constraint. Other databases add the constraint as AddConstraint does.
+    """
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_forwards(app_label, schema_editor,
+                                             from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        qn = schema_editor.quote_name
+        table = qn(model._meta.db_table)
+        name = qn(self.constraint.name)
+        columns = ", ".join(qn(model._meta.get_field(field).column)
+                            for field in self.constraint.fields)
+        schema_editor.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY %s ON %s (%s)"
+            % (name, table, columns)
+        )
+        schema_editor.execute(
+            "ALTER TABLE %s ADD CONSTRAINT %s UNIQUE USING INDEX %s"
+            % (table, name, name)
+        )
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ("django_comments_xtd", "0013_xtdcomment_path"),
+    ]
+
+    operations = [
+        # A null column without default doesn't rewrite the table.
+        migrations.AddField(
+            model_name="xtdcomment",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=32, null=True
+            ),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name="xtdcomment",
+            constraint=models.UniqueConstraint(
+                fields=("content_hash",), name="xtdcomment_content_hash_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# The index that backs KeysetPagination, ordered by submit date within the
+# comments of an object. The django_comments table belongs to another app,
+# whose models don't declare the index, so it's kept out of the migration
+# state and created and dropped by name.
+INDEX_NAME = "comments_object_submit_idx"
+INDEX_COLUMNS = ("content_type_id", "object_pk", "submit_date", "id")
+
+
+def get_table(apps):
+    return apps.get_model("django_comments", "Comment")._meta.db_table
+
+
+def create_object_submit_index(apps, schema_editor):
+    qn = schema_editor.quote_name
+    schema_editor.execute(
+        "CREATE INDEX %s ON %s (%s)" % (
+            qn(INDEX_NAME), qn(get_table(apps)),
+            ", ".join(qn(column) for column in INDEX_COLUMNS)
+        )
+    )
+
+
+def drop_object_submit_index(apps, schema_editor):
+    qn = schema_editor.quote_name
+    sql = "DROP INDEX %s" % qn(INDEX_NAME)
+    if schema_editor.connection.vendor == "mysql":
+        sql += " ON %s" % qn(get_table(apps))
+    schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_comments", "0004_add_object_pk_is_removed_index"),
+        ("django_comments_xtd", "0014_xtdcomment_content_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_object_submit_index, drop_object_submit_index
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_comments_xtd', '0015_comment_object_submit_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xtdcomment',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
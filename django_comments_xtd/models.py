@@ -1,22 +1,64 @@
+import datetime
+import hashlib
+from collections import defaultdict
+
 from django.db import models
-from django.db.models import F, Max, Min, Q
-from django.db.transaction import atomic
+from django.db.models import (
+    CharField, Count, Exists, F, IntegerField, Max, Min, OuterRef, Q,
+    QuerySet, Subquery
+)
+from django.db.models.functions import Cast, Coalesce
+from django.db.transaction import atomic, on_commit
 from django.contrib.contenttypes.models import ContentType
 from django.core import signing
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from django_comments.managers import CommentManager
 from django_comments.models import Comment, CommentFlag
 
-from django_comments_xtd import get_model
+from django_comments_xtd import cache, get_model
 from django_comments_xtd.choices import CommentTypeChoices
 from django_comments_xtd.conf import settings
+from django_comments_xtd.signals import (
+    comment_was_pinned, comment_was_removed, comment_was_updated,
+    comments_were_moderated
+)
+from django_comments_xtd.utils import get_current_site_id
 
 
 LIKEDIT_FLAG = "I liked it"
 DISLIKEDIT_FLAG = "I disliked it"
 
+# Denormalized feedback counters, maintained with F() expressions.
+FEEDBACK_COUNTER_FIELDS = ('likedit_count', 'dislikedit_count',
+                           'flagged_count')
+
+# Number of digits of every comment id in XtdComment.path.
+PATH_DIGITS = 10
+
+
+def get_content_hash(comment):
+    """
+    Hash of the values that identify a post of a comment: the target object
+    (content_type, object_pk and site), the comment, user_name, user_email,
+    followup and submit_date of an XtdComment or TmpXtdComment.
+    The submit_date is set when the comment form is posted, and kept in the
+    confirmation key, so posting it again gives the same hash.
+    """
+    content_type_id = comment.content_type_id or comment.content_type.pk
+    submit_date = comment.submit_date
+    if timezone.is_aware(submit_date):
+        submit_date = submit_date.astimezone(datetime.timezone.utc)\
+                                 .replace(tzinfo=None)
+    value = "\x00".join([str(content_type_id), str(comment.object_pk),
+                         str(comment.site_id), comment.comment or '',
+                         comment.user_name or '', comment.user_email or '',
+                         '1' if comment.followup else '0',
+                         submit_date.isoformat()])
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:32]
+
 
 def max_thread_level_for_content_type(content_type):
     app_model = "%s.%s" % (content_type.app_label, content_type.model)
@@ -26,6 +68,182 @@ def max_thread_level_for_content_type(content_type):
         return settings.COMMENTS_XTD_MAX_THREAD_LEVEL
 
 
+def get_feedback_counts(comments, user=None, with_counts=True):
+    """
+    Return the like, dislike and removal suggestion counts of the given
+    comments, in a dictionary keyed by comment pk. Comments can be given as
+    a queryset or as an iterable of comments or comment pks.
+
+    Counts are computed with one GROUP BY query over the flags table. When
+    the user is authenticated, one more query (served by the unique index
+    on user, comment and flag) tells whether the user flagged each comment.
+    With ``with_counts=False`` only the latter query runs, which is enough
+    when the counts are read from the comments' feedback counters.
+    The returned dictionary is a ``defaultdict``, comments without flags get
+    zero counts. Each value looks like::
+
+        {
+            'likedit_count': <int>, 'dislikedit_count': <int>,
+            'flagged_count': <int>, 'likedit': <bool>,
+            'dislikedit': <bool>, 'user_flagged': <bool>
+        }
+    """
+    flag_keys = {
+        LIKEDIT_FLAG: ('likedit_count', 'likedit'),
+        DISLIKEDIT_FLAG: ('dislikedit_count', 'dislikedit'),
+        CommentFlag.SUGGEST_REMOVAL: ('flagged_count', 'user_flagged'),
+    }
+
+    def empty_counts():
+        entry = {}
+        for count_key, user_key in flag_keys.values():
+            entry.update({count_key: 0, user_key: False})
+        return entry
+
+    counts = defaultdict(empty_counts)
+    if isinstance(comments, QuerySet) and not comments.query.is_sliced:
+        comment_ids = comments.order_by().values('pk')
+    else:
+        comment_ids = [getattr(cm, 'pk', cm) for cm in comments]
+        if not comment_ids:
+            return counts
+
+    flags_qs = CommentFlag.objects.filter(comment_id__in=comment_ids,
+                                          flag__in=list(flag_keys))
+    if with_counts:
+        rows = flags_qs.values_list('comment_id', 'flag')\
+                       .annotate(count=Count('pk'))\
+                       .order_by()
+        for comment_id, flag, count in rows:
+            counts[comment_id][flag_keys[flag][0]] = count
+
+    if user is not None and user.is_authenticated:
+        rows = flags_qs.filter(user=user).values_list('comment_id', 'flag')
+        for comment_id, flag in rows:
+            counts[comment_id][flag_keys[flag][1]] = True
+    return counts
+
+
+def update_feedback_counters(comment, **deltas):
+    """
+    Add deltas to the feedback counters of the given comment, ie::
+
+        update_feedback_counters(comment, likedit_count=1,
+                                 dislikedit_count=-1)
+
+    The update uses F() expressions, so it's safe under concurrent requests
+    and takes part in the ongoing transaction.
+    """
+    values = {field: F(field) + delta
+              for field, delta in deltas.items() if delta}
+    if values:
+        values['updated_at'] = timezone.now()
+        get_model().norel_objects.filter(pk=comment.pk).update(**values)
+
+
+def get_thread_page(comments, threads, after=None):
+    """
+    Return the comments of the first `threads` threads of the queryset
+    `comments` whose thread_id is greater than `after`, in threaded order,
+    and the thread_id to pass as `after` to get the next page, or None if
+    there are no more threads.
+
+    Threads are never split: a page holds every comment of its threads,
+    fetched with a single range query on (thread_id, order).
+    """
+    comments = comments.order_by('thread_id', 'order')
+    if not comments.query.standard_ordering:
+        # Undo a reverse(), as the one in XtdCommentManager.for_content_types.
+        comments = comments.reverse()
+    if after is not None:
+        comments = comments.filter(thread_id__gt=after)
+    thread_ids = list(comments.order_by('thread_id')
+                              .prefetch_related(None)
+                              .values_list('thread_id', flat=True)
+                              .distinct()[:threads + 1])
+    if not thread_ids:
+        return [], None
+    last_thread_id = thread_ids[:threads][-1]
+    page = list(comments.filter(thread_id__gte=thread_ids[0],
+                                thread_id__lte=last_thread_id))
+    return page, last_thread_id if len(thread_ids) > threads else None
+
+
+def get_comment_counts(objects, site_id=None):
+    """
+    Return the number of public comments posted to each of the given
+    objects, in a dictionary keyed by (content_type_id, object_pk) with the
+    object_pk as a string. Objects can be given as model instances or as
+    (content_type, object_pk) pairs, where content_type is a ContentType,
+    its pk or its natural key "app_label.model".
+
+    All the counts are fetched with a single GROUP BY query.
+    """
+    pks_by_content_type = defaultdict(set)
+    for obj in objects:
+        if isinstance(obj, models.Model):
+            content_type = ContentType.objects.get_for_model(obj)
+            object_pk = obj.pk
+        else:
+            content_type, object_pk = obj
+        if isinstance(content_type, str):
+            content_type = ContentType.objects.get_by_natural_key(
+                *content_type.split("."))
+        content_type_id = getattr(content_type, 'pk', content_type)
+        pks_by_content_type[int(content_type_id)].add(str(object_pk))
+
+    counts = {(content_type_id, object_pk): 0
+              for content_type_id, pks in pks_by_content_type.items()
+              for object_pk in pks}
+    if not counts:
+        return counts
+    if site_id is None:
+        site_id = get_current_site_id()
+    lookup = Q()
+    for content_type_id, pks in pks_by_content_type.items():
+        lookup |= Q(content_type_id=content_type_id, object_pk__in=pks)
+    rows = XtdComment.norel_objects.filter(
+        lookup, site_id=site_id, is_public=True
+    ).order_by().values_list('content_type_id', 'object_pk')\
+        .annotate(count=Count('pk'))
+    for content_type_id, object_pk, count in rows:
+        counts[(content_type_id, object_pk)] = count
+    return counts
+
+
+def annotate_comment_counts(queryset, site_id=None, name='comment_count'):
+    """
+    Annotate every object of the queryset with the number of public
+    comments posted to it, under the given name, with a subquery grouped
+    by object_pk. The objects and their counts come in a single query.
+    """
+    if site_id is None:
+        site_id = get_current_site_id()
+    content_type = ContentType.objects.get_for_model(queryset.model)
+    counts = XtdComment.norel_objects.filter(
+        content_type=content_type,
+        object_pk=Cast(OuterRef('pk'), output_field=CharField()),
+        site_id=site_id, is_public=True
+    ).order_by().values('object_pk').annotate(count=Count('pk'))\
+        .values('count')
+    return queryset.annotate(**{
+        name: Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+    })
+
+
+class CommentCountQuerySet(QuerySet):
+    """
+    QuerySet for models that receive comments, to build their managers, ie:
+
+        objects = CommentCountQuerySet.as_manager()
+
+    Then ``Article.objects.with_comment_counts()`` annotates each article
+    with its ``comment_count``.
+    """
+    def with_comment_counts(self, site_id=None, name='comment_count'):
+        return annotate_comment_counts(self, site_id=site_id, name=name)
+
+
 class MaxThreadLevelExceededException(Exception):
     def __init__(self, comment):
         self.comment = comment
@@ -68,61 +286,235 @@ class XtdComment(Comment):
     followup = models.BooleanField(blank=True, default=False,
                                    help_text=_("Notify follow-up comments"))
     nested_count = models.IntegerField(default=0, db_index=True)
+    likedit_count = models.IntegerField(default=0)
+    dislikedit_count = models.IntegerField(default=0)
+    flagged_count = models.IntegerField(default=0)
     type = models.CharField(verbose_name="评论类型", max_length=16, choices=CommentTypeChoices.choices,
                             blank=True, default=CommentTypeChoices.TYPE_NORMAL)
     pinned_at = models.DateTimeField("置顶时间", db_index=True, null=True, blank=True)
     is_edited = models.BooleanField("是否被编辑", default=False)
+    # Ids of the ancestors of the comment, from the root of the thread,
+    # padded to PATH_DIGITS digits. Empty in root comments, and null when
+    # unknown, until populated with the command initialize_comment_paths.
+    path = models.CharField(max_length=255, null=True, blank=True,
+                            db_index=True, editable=False)
+    # Unique get_content_hash of the comment, to find duplicates with an
+    # index lookup. Null until populated with the command
+    # initialize_content_hashes in comments posted before the field existed.
+    content_hash = models.CharField(max_length=32, null=True, blank=True,
+                                    editable=False)
+    # Time of the last change of the comment after it was posted, ie: an
+    # edit, a pin, a moderation action or new feedback. Null until then.
+    updated_at = models.DateTimeField(null=True, blank=True, editable=False)
     objects = XtdCommentManager()
     norel_objects = CommentManager()
 
+    class Meta:
+        # Same options the model inherits from django_comments' Comment.
+        ordering = ('submit_date',)
+        permissions = [("can_moderate", "Can moderate comments")]
+        verbose_name = _('comment')
+        verbose_name_plural = _('comments')
+        indexes = [
+            # Threaded order, used by the keyset pagination of the web API.
+            models.Index(fields=['thread_id', 'order'],
+                         name='xtdcomment_thread_order_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash'],
+                                    name='xtdcomment_content_hash_uniq'),
+        ]
+
     def save(self, *args, **kwargs):
         is_new = self.pk is None
-        super(Comment, self).save(*args, **kwargs)
-        if is_new:
-            if not self.parent_id:
-                self.parent_id = self.id
-                self.thread_id = self.id
+        if (
+            not is_new and not self._state.adding and not args and
+            kwargs.get('update_fields') is None and
+            not kwargs.get('force_insert', False)
+        ):
+            # Feedback counters are only written with F() expressions, do
+            # not overwrite them with the values loaded in this instance.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in FEEDBACK_COUNTER_FIELDS
+            ]
+        if not is_new:
+            update_fields = kwargs.get('update_fields')
+            if not self._state.adding:
+                self.updated_at = timezone.now()
+                if update_fields and 'updated_at' not in update_fields:
+                    update_fields = list(update_fields) + ['updated_at']
+                    kwargs['update_fields'] = update_fields
+            super(Comment, self).save(*args, **kwargs)
+            if (
+                update_fields is None or
+                {'is_public', 'is_removed'} <= set(update_fields)
+            ):
+                self._was_public = self.is_public and not self.is_removed
             else:
-                if max_thread_level_for_content_type(self.content_type):
-                    with atomic():
-                        self._calculate_thread_data()
-                else:
+                self._was_public = None
+            return
+        if self.submit_date is None:
+            self.submit_date = timezone.now()
+        if self.content_hash is None:
+            self.content_hash = get_content_hash(self)
+        with atomic():
+            if self.parent_id:
+                if not max_thread_level_for_content_type(self.content_type):
                     raise MaxThreadLevelExceededException(self)
-            kwargs["force_insert"] = False
+                self._calculate_thread_data()
+            else:
+                self.path = ''
             super(Comment, self).save(*args, **kwargs)
+        self._was_public = self.is_public and not self.is_removed
+
+    def _save_parents(self, cls, *args, **kwargs):
+        # Root comments are the parent and the thread of themselves. Their
+        # id is known once the row of django_comments is inserted, set it
+        # before inserting the row of XtdComment, so that it is inserted,
+        # and sent to post_save receivers, with its final values.
+        inserted = super(XtdComment, self)._save_parents(cls, *args,
+                                                         **kwargs)
+        if not self.parent_id and self.comment_ptr_id:
+            self.parent_id = self.thread_id = self.comment_ptr_id
+        return inserted
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(XtdComment, cls).from_db(db, field_names, values)
+        if 'is_public' in field_names and 'is_removed' in field_names:
+            instance._was_public = (
+                instance.is_public and not instance.is_removed)
+        return instance
+
+    def was_public(self):
+        """
+        Return whether the comment is public and not removed in the DB, as
+        it was loaded or, if unknown, as it is now in the DB.
+        """
+        was_public = getattr(self, '_was_public', None)
+        if was_public is None:
+            was_public = Comment.objects.filter(
+                pk=self.id, is_public=True, is_removed=False).exists()
+            self._was_public = was_public
+        return was_public
 
     def _calculate_thread_data(self):
         # Implements the following approach:
         #  http://www.sqlteam.com/article/sql-for-threaded-discussion-forums
-        parent = XtdComment.objects.get(pk=self.parent_id)
+        # with a fixed number of statements, run before inserting the reply.
+        comments = XtdComment.norel_objects
+        # Lock the root comment of the thread with a no-op UPDATE, so that
+        # concurrent replies to the same thread are inserted one after the
+        # other. An UPDATE takes the row lock in PostgreSQL and MySQL, and
+        # the write lock of the database in SQLite. The thread_id of the
+        # parent never changes, it's read first because MySQL can't UPDATE
+        # a table filtered by a subquery on the same table.
+        thread_id = comments.filter(pk=self.parent_id)\
+                            .values_list('thread_id', flat=True).first()
+        comments.filter(pk=thread_id).update(thread_id=F('thread_id'))
+
+        parent = comments.get(pk=self.parent_id)
         if parent.level == max_thread_level_for_content_type(self.content_type):
             raise MaxThreadLevelExceededException(self)
-
         self.thread_id = parent.thread_id
         self.level = parent.level + 1
-        qc_eq_thread = XtdComment.norel_objects\
-                                 .filter(thread_id=parent.thread_id)
-        qc_ge_level = qc_eq_thread.filter(level__lte=parent.level,
-                                          order__gt=parent.order)
-        if qc_ge_level.count():
-            min_order = qc_ge_level.aggregate(Min('order'))['order__min']
-            qc_eq_thread.filter(order__gte=min_order)\
+        self.path = parent.get_reply_path()
+        qc_eq_thread = comments.filter(thread_id=parent.thread_id)
+
+        # The reply goes before the next comment at the same or an upper
+        # level than the parent, or at the end of the thread.
+        orders = qc_eq_thread.aggregate(
+            next_order=Min('order', filter=Q(level__lte=parent.level,
+                                             order__gt=parent.order)),
+            max_order=Max('order'))
+        if orders['next_order'] is not None:
+            qc_eq_thread.filter(order__gte=orders['next_order'])\
                         .update(order=F('order') + 1)
-            self.order = min_order
+            self.order = orders['next_order']
+        else:
+            self.order = orders['max_order'] + 1
+
+        parent.update_ancestors(include_self=True,
+                                nested_count=F('nested_count') + 1)
+
+    def get_ancestors(self, include_self=False):
+        """
+        Return the ancestors of this comment, from the path when known or
+        else as the comments before this one in the thread with no comment
+        at the same or an upper level between them and this comment.
+        Either way it is a single query.
+        """
+        comments = XtdComment.norel_objects.all()
+        if self.path is not None:
+            pks = self.get_ancestor_ids() + ([self.id] if include_self else [])
+            return comments.filter(pk__in=pks)
+        qc_eq_thread = comments.filter(thread_id=self.thread_id)
+        between = qc_eq_thread.filter(order__gt=OuterRef('order'),
+                                      order__lt=self.order,
+                                      level__lte=OuterRef('level'))
+        if include_self:
+            qs = qc_eq_thread.filter(order__lte=self.order,
+                                     level__lte=self.level)
         else:
-            max_order = qc_eq_thread.aggregate(Max('order'))['order__max']
-            self.order = max_order + 1
-
-        if self.id != parent.id:
-            parent_ids = []
-            while True:
-                parent_ids.append(parent.pk)
-                if parent.id == parent.parent_id:
-                    break
-                parent = qc_eq_thread.get(pk=parent.parent_id)
-            if parent_ids:
-                qc_eq_thread.filter(pk__in=parent_ids)\
-                            .update(nested_count=F('nested_count') + 1)
+            qs = qc_eq_thread.filter(order__lt=self.order,
+                                     level__lt=self.level)
+        return qs.exclude(Exists(between))
+
+    def update_ancestors(self, include_self=False, **values):
+        """
+        Update the ancestors of this comment with the given values. Without
+        path, get_ancestors filters the comments with a subquery on the same
+        table, that MySQL doesn't allow in an UPDATE, so their ids are read
+        first.
+        """
+        ancestors = self.get_ancestors(include_self=include_self)
+        if self.path is None:
+            ancestors = XtdComment.norel_objects.filter(
+                pk__in=list(ancestors.values_list('pk', flat=True)))
+        return ancestors.update(**values)
+
+    def get_ancestor_ids(self):
+        """
+        Return the ids of the ancestors of this comment, from the root of
+        the thread, or None if its path is unknown.
+        """
+        if self.path is None:
+            return None
+        return [int(self.path[index:index + PATH_DIGITS])
+                for index in range(0, len(self.path), PATH_DIGITS)]
+
+    def get_reply_path(self):
+        """Return the path of a reply to this comment, or None if it is
+        unknown or does not fit in the path field."""
+        if self.path is None or self.pk >= 10 ** PATH_DIGITS:
+            return None
+        path = '%s%0*d' % (self.path, PATH_DIGITS, self.pk)
+        if len(path) > self._meta.get_field('path').max_length:
+            return None
+        return path
+
+    def get_descendants(self, queryset=None):
+        """
+        Return the nested comments of this comment in threaded order, with
+        a single query. They are a contiguous range of (thread_id, order)
+        that ends before the next comment in the thread at the same or at an
+        upper level. The path is not used: it is null in the comments too
+        deep, or with ids too long, to fit in the field.
+        """
+        if queryset is None:
+            queryset = get_model().objects.all()
+        next_order = XtdComment.norel_objects\
+            .filter(thread_id=self.thread_id, order__gt=self.order,
+                    level__lte=self.level)\
+            .order_by().values('thread_id').annotate(next=Min('order'))\
+            .values('next')
+        return queryset.filter(
+            thread_id=self.thread_id, order__gt=self.order,
+            # Without a next comment the range ends at the end of the thread.
+            order__lt=Coalesce(Subquery(next_order), F('order') + 1)
+        ).order_by('thread_id', 'order')
 
     def get_reply_url(self):
         return reverse("comments-xtd-reply", kwargs={"cid": self.pk})
@@ -135,14 +527,26 @@ class XtdComment(Comment):
 
     @classmethod
     def tree_from_queryset(cls, queryset, with_flagging=False,
-                           with_feedback=False, user=None):
+                           with_feedback=False, user=None, counts_only=False,
+                           max_replies=None):
         """Converts a XtdComment queryset into a list of nested dictionaries.
-        The queryset has to be ordered by thread_id, order.
+        The queryset can be in any order, siblings are listed in the order
+        in which they come in the queryset. The tree is built in linear time.
         Each dictionary contains two attributes::
             {
                 'comment': the comment object itself,
                 'children': [list of child comment dictionaries]
             }
+
+        With counts_only the flags of the comments are not loaded. Instead
+        the lists of users in 'likedit_users', 'dislikedit_users' and
+        'flagged' are replaced by 'likedit_count', 'dislikedit_count' and
+        'user_flagged'. Counts come from the comments' feedback counters.
+
+        With max_replies only the first max_replies replies of each thread,
+        in threaded order, are included, and every dictionary gets a
+        'remaining_count' with the number of its nested comments left out,
+        taken from the comment's nested_count.
         """
         def get_flags(comment, user):
             flags_dict = {}
@@ -152,6 +556,12 @@ class XtdComment(Comment):
             dislikedit_users = []
             flagging_users = []
 
+            if not (with_feedback or with_flagging):
+                return flags_dict
+
+            if counts_only:
+                return get_counts(comment)
+
             for flag in comment.flags.all():
                 user_repr = settings.COMMENTS_XTD_API_USER_REPR(flag.user)
                 if with_feedback:
@@ -181,17 +591,21 @@ class XtdComment(Comment):
 
             return flags_dict
 
-        def add_children(children, obj, user):
-            for item in children:
-                if item['comment'].pk == obj.parent_id:
-                    child_dict = {'comment': obj, 'children': []}
-                    child_dict.update(get_flags(obj, user))
-                    item['children'].append(child_dict)
-                    return True
-                elif item['children']:
-                    if add_children(item['children'], obj, user):
-                        return True
-            return False
+        def get_counts(comment):
+            user_flags = feedback_counts[comment.pk]
+            flags_dict = {}
+            if with_feedback:
+                flags_dict.update({
+                    'likedit': user_flags['likedit'],
+                    'dislikedit': user_flags['dislikedit'],
+                    'likedit_count': comment.likedit_count,
+                    'dislikedit_count': comment.dislikedit_count
+                })
+            if with_flagging:
+                flags_dict.update({'user_flagged': user_flags['user_flagged']})
+            if with_flagging and add_flagged_count:
+                flags_dict.update({'flagged_count': comment.flagged_count})
+            return flags_dict
 
         def get_comment_dict(obj):
             new_dict = {'comment': obj, 'children': []}
@@ -205,36 +619,60 @@ class XtdComment(Comment):
         if user.has_perm('django_comments.can_moderate'):
             add_flagged_count = True
 
-        dic_list = []
-        cur_dict = None
-        for obj in queryset:
-            if cur_dict and obj.level == cur_dict['comment'].level:
-                dic_list.append(cur_dict)
-                cur_dict = None
-            if not cur_dict:
-                cur_dict = get_comment_dict(obj)
-                continue
-            if obj.parent_id == cur_dict['comment'].pk:
-                child_dict = get_comment_dict(obj)
-                cur_dict['children'].append(child_dict)
+        if max_replies is not None:
+            # The root of a thread has order 1, its first replies follow.
+            if isinstance(queryset, QuerySet):
+                queryset = queryset.filter(order__lte=max_replies + 1)
             else:
-                add_children(cur_dict['children'], obj, user)
-        if cur_dict:
-            dic_list.append(cur_dict)
+                queryset = [cm for cm in queryset
+                            if cm.order <= max_replies + 1]
+
+        feedback_counts = None
+        if counts_only and (with_feedback or with_flagging):
+            feedback_counts = get_feedback_counts(queryset, user,
+                                                  with_counts=False)
+
+        # Every node is indexed by the pk of its comment, so attaching a
+        # reply to its parent is a dict lookup instead of a walk over the
+        # tree built so far. Nodes are linked in a second pass over the
+        # index so that the result does not depend on the list order, and
+        # siblings keep the relative order in which the queryset returned
+        # them. Replies whose parent is not in the queryset are left out.
+        nodes = {obj.pk: get_comment_dict(obj) for obj in queryset}
+        dic_list = []
+        for pk, node in nodes.items():
+            parent_id = node['comment'].parent_id
+            if parent_id == pk:
+                dic_list.append(node)
+            elif parent_id in nodes:
+                nodes[parent_id]['children'].append(node)
+
+        if max_replies is not None:
+            # Count the descendants included under each node, children
+            # before parents, by walking a preorder list backwards.
+            preorder, stack = [], list(dic_list)
+            while stack:
+                node = stack.pop()
+                preorder.append(node)
+                stack.extend(node['children'])
+            included = {}
+            for node in reversed(preorder):
+                comment = node['comment']
+                included[comment.pk] = sum(
+                    included[child['comment'].pk] + 1
+                    for child in node['children'])
+                node['remaining_count'] = max(
+                    comment.nested_count - included[comment.pk], 0)
 
         return dic_list
 
 
 def publish_or_unpublish_nested_comments(comment, are_public=False):
-    qs = get_model().norel_objects.filter(~Q(pk=comment.id),
-                                          parent_id=comment.id)
-    nested = [cm.id for cm in qs]
-    qs.update(is_public=are_public)
-    while len(nested):
-        cm_id = nested.pop()
-        qs = XtdComment.norel_objects.filter(~Q(pk=cm_id), parent_id=cm_id)
-        nested.extend([cm.id for cm in qs])
-        qs.update(is_public=are_public)
+    # is_public is a field of the parent model, update it with a subquery
+    # instead of letting Django fetch the pks of the nested comments first.
+    nested = comment.get_descendants(XtdComment.norel_objects.all())
+    Comment.objects.filter(pk__in=nested.order_by().values('pk'))\
+                   .update(is_public=are_public)
     # Update nested_count in parents comments in the same thread.
     # The comment.nested_count doesn't change because the comment's is_public
     # attribute is not changing, only its nested comments change, and it will
@@ -243,16 +681,152 @@ def publish_or_unpublish_nested_comments(comment, are_public=False):
         op = F('nested_count') + comment.nested_count
     else:
         op = F('nested_count') - comment.nested_count
-    XtdComment.norel_objects.filter(thread_id=comment.thread_id,
-                                    level__lt=comment.level,
-                                    order__lt=comment.order)\
-                            .update(nested_count=op)
+    comment.update_ancestors(nested_count=op)
 
 
 def publish_or_unpublish_on_pre_save(sender, instance, raw, using, **kwargs):
-    if not raw and instance and instance.id:
-        are_public = (not instance.is_removed) and instance.is_public
+    if raw or not instance or not instance.id or instance._state.adding:
+        return
+    are_public = (not instance.is_removed) and instance.is_public
+    if instance.was_public() != are_public:
         publish_or_unpublish_nested_comments(instance, are_public=are_public)
+    cache.invalidate_comment(instance)
+
+
+# ----------------------------------------------------------------------
+# Bulk moderation.
+
+# Fields set by every moderation action, and the signal sent per comment.
+MODERATION_ACTIONS = {
+    'publish': ({'is_public': True}, comment_was_updated),
+    'unpublish': ({'is_public': False}, comment_was_updated),
+    'remove': ({'is_removed': True}, comment_was_removed),
+    'restore': ({'is_removed': False}, comment_was_updated),
+    'pin': ({'pinned_at': timezone.now}, comment_was_pinned),
+    'unpin': ({'pinned_at': None}, comment_was_pinned),
+}
+
+MODERATION_BATCH_SIZE = 500
+
+
+def _batches(items, size=MODERATION_BATCH_SIZE):
+    items = list(items)
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def _update_in_batches(queryset, changes):
+    """Write {field: {pk: value}} changes, one UPDATE per batch of pks with
+    the same value, for fields with few distinct values."""
+    for field, values in changes.items():
+        pks_by_value = defaultdict(list)
+        for pk, value in values.items():
+            pks_by_value[value].append(pk)
+        for value, pks in pks_by_value.items():
+            for batch in _batches(sorted(pks)):
+                queryset.filter(pk__in=batch).update(**{field: value})
+
+
+def moderate_comments(pks, action, site_id=None):
+    """
+    Apply a moderation action of MODERATION_ACTIONS to the comments with
+    the given pks, of the site site_id if given, in one transaction, and
+    return them.
+
+    The result is the same as saving the comments one by one in threaded
+    order: nested comments of comments whose visibility changes are
+    published or unpublished, and the nested_count of their ancestors is
+    updated. But it is computed once per thread, and written with batched
+    UPDATE statements.
+
+    Once the transaction is committed it sends the signal of the action
+    per comment or, with the setting COMMENTS_XTD_BULK_MODERATION_SIGNAL, a
+    single comments_were_moderated signal.
+    """
+    fields, signal = MODERATION_ACTIONS[action]
+    fields = {field: value() if callable(value) else value
+              for field, value in fields.items()}
+    comments = XtdComment.norel_objects
+    selectable = comments.all()
+    if site_id is not None:
+        selectable = selectable.filter(site_id=site_id)
+    with atomic():
+        selected, thread_ids = set(), set()
+        for batch in _batches(sorted(set(pks))):
+            for pk, thread_id in selectable.filter(pk__in=batch)\
+                                           .values_list('pk', 'thread_id'):
+                selected.add(pk)
+                thread_ids.add(thread_id)
+        rows = {}
+        for batch in _batches(sorted(thread_ids)):
+            # Lock the root comments of the threads, as replies do.
+            comments.filter(pk__in=batch).update(thread_id=F('thread_id'))
+            for row in comments.filter(thread_id__in=batch).order_by()\
+                               .values('pk', 'thread_id', 'parent_id',
+                                       'order', 'level', 'nested_count',
+                                       'is_public', 'is_removed'):
+                rows[row['pk']] = row
+
+        changes = {'is_public': {}, 'is_removed': {}, 'nested_count': {}}
+        threads = defaultdict(list)
+        for row in sorted(rows.values(),
+                          key=lambda row: (row['thread_id'], row['order'])):
+            threads[row['thread_id']].append(row)
+        for thread in threads.values():
+            for index, row in enumerate(thread):
+                if row['pk'] not in selected:
+                    continue
+                was_public = row['is_public'] and not row['is_removed']
+                for field in ('is_public', 'is_removed'):
+                    if field in fields and row[field] != fields[field]:
+                        row[field] = changes[field][row['pk']] = fields[field]
+                are_public = row['is_public'] and not row['is_removed']
+                if was_public == are_public:
+                    continue
+                # As in publish_or_unpublish_nested_comments.
+                for nested in thread[index + 1:]:
+                    if nested['level'] <= row['level']:
+                        break
+                    if nested['is_public'] != are_public:
+                        nested['is_public'] = are_public
+                        changes['is_public'][nested['pk']] = are_public
+                delta = row['nested_count'] * (1 if are_public else -1)
+                parent = row
+                while parent['pk'] != parent['parent_id'] and \
+                        parent['parent_id'] in rows:
+                    parent = rows[parent['parent_id']]
+                    parent['nested_count'] += delta
+                    changes['nested_count'][parent['pk']] = \
+                        parent['nested_count']
+
+        _update_in_batches(Comment.objects, {
+            'is_public': changes['is_public'],
+            'is_removed': changes['is_removed']})
+        comments.bulk_update(
+            [XtdComment(pk=pk, nested_count=nested_count)
+             for pk, nested_count in changes['nested_count'].items()],
+            ['nested_count'], batch_size=MODERATION_BATCH_SIZE)
+        updates = {'updated_at': timezone.now()}
+        if 'pinned_at' in fields:
+            updates['pinned_at'] = fields['pinned_at']
+        for batch in _batches(sorted(selected)):
+            comments.filter(pk__in=batch).update(**updates)
+
+        moderated = []
+        for batch in _batches(sorted(selected)):
+            moderated.extend(get_model().norel_objects.filter(pk__in=batch))
+
+        def send_signals():
+            if settings.COMMENTS_XTD_BULK_MODERATION_SIGNAL:
+                comments_were_moderated.send(sender=get_model(),
+                                             action=action,
+                                             comments=moderated)
+            else:
+                for comment in moderated:
+                    signal.send(sender=comment.__class__, comment=comment)
+
+        on_commit(send_signals)
+    return moderated
 
 
 # ----------------------------------------------------------------------
@@ -271,9 +845,19 @@ class DummyDefaultManager:
 class TmpXtdComment(dict):
     """
     Temporary XtdComment to be pickled, ziped and appended to a URL.
+
+    The content_object is loaded when first accessed, from the content_type
+    and object_pk.
     """
     _default_manager = DummyDefaultManager()
 
+    def __missing__(self, key):
+        if key != 'content_object' or 'content_type' not in self:
+            raise KeyError(key)
+        self[key] = self['content_type'].get_object_for_this_type(
+            pk=self['object_pk'])
+        return self[key]
+
     def __getattr__(self, key):
         try:
             return self[key]
@@ -295,14 +879,9 @@ class TmpXtdComment(dict):
 
     def __setstate__(self, state):
         ct_key = state.pop('content_type_key')
+        # get_by_natural_key is served from the ContentType cache.
         ctype = ContentType.objects.get_by_natural_key(*ct_key)
-        self.update(
-            state,
-            content_type=ctype,
-            content_object=ctype.get_object_for_this_type(
-                pk=state['object_pk']
-            )
-        )
+        self.update(state, content_type=ctype)
 
     def __reduce__(self):
         state = {k: v for k, v in self.items() if k != 'content_object'}
@@ -321,6 +900,7 @@ class BlackListedDomain(models.Model):
     You can download for free a recent version of the list, and subscribe
     to get notified on changes. Changes can be fetched with rsync for a
     small fee (check their conditions, or use any other Spam filter).
+    Load it with the management command import_blacklist.
     """
     domain = models.CharField(max_length=200, db_index=True)
 
@@ -1,6 +1,11 @@
-from django.contrib.sites.shortcuts import get_current_site
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from django.contrib.sites.shortcuts import get_current_site
+from django.db import connections, transaction
 from django.template import loader
+from django.utils.module_loading import import_string
 
 from django_comments import get_model
 from django_comments.signals import (comment_will_be_posted,
@@ -9,12 +14,18 @@ from django_comments.models import CommentFlag
 from django_comments.moderation import Moderator, CommentModerator
 
 
+from django_comments_xtd import blacklist
 from django_comments_xtd.conf import settings
-from django_comments_xtd.models import BlackListedDomain, TmpXtdComment
-from django_comments_xtd.signals import confirmation_received
+from django_comments_xtd.models import TmpXtdComment
+from django_comments_xtd.signals import (
+    comment_was_removed, comment_was_updated, confirmation_received
+)
 from django_comments_xtd.utils import send_mail
 
 
+logger = logging.getLogger(__name__)
+
+
 class XtdCommentModerator(CommentModerator):
     """
     Encapsulates comment-moderation options for a given-model.
@@ -39,11 +50,24 @@ class XtdCommentModerator(CommentModerator):
          If removal suggestion notifications should be sent to site staff
          or moderators, this method is responsible for sending the email.
 
+    ``review``
+        Expensive checks, ie: content classifiers or link reputation
+        services, that run out of the request when ``review_comments`` is
+        ``True``. Comments allowed and not moderated by the cheap checks of
+        ``allow`` and ``moderate`` are saved as non-public, and reviewed
+        later by the runner of ``COMMENTS_XTD_REVIEW_RUNNER``. Return
+        ``'publish'`` to publish the comment, ``'remove'`` to discard it,
+        or ``None`` to leave it to the moderators.
+
     Check the parent class to read about methods ``allow``, ``email``, and
     ``moderate``.
 
     """
     removal_suggestion_notification = None
+    review_comments = False
+
+    def review(self, comment, content_object):
+        return 'publish'
 
     def notify_removal_suggestion(self, comment, content_object, request):
         if not self.removal_suggestion_notification:
@@ -82,6 +106,10 @@ class SpamModerator(XtdCommentModerator):
     ``SpamModerator`` uses the additional ``django_comments_xtd`` model:
      * ``BlackListedDomain``
 
+    Domains are looked up in the in-process index of
+    ``django_comments_xtd.blacklist``, that matches the subdomains of the
+    blacklisted domains too.
+
     Remember to update the content regularly through an external Spam
     filtering service.
     """
@@ -91,13 +119,18 @@ class SpamModerator(XtdCommentModerator):
         except IndexError:
             return False
         else:
-            if BlackListedDomain.objects.filter(domain=domain).count():
+            if blacklist.is_blacklisted(domain):
                 return False
             return super(SpamModerator, self).allow(comment, content_object,
                                                     request)
 
 
 class XtdModerator(Moderator):
+    """
+    Moderation is staged: ``allow`` and ``moderate`` decide in the request,
+    when the comment is about to be posted, and ``review`` decides once the
+    comment has been saved, as non-public, out of the request.
+    """
     def connect(self):
         comment_will_be_posted.connect(self.pre_save_moderation,
                                        sender=TmpXtdComment)
@@ -106,6 +139,18 @@ class XtdModerator(Moderator):
         comment_was_flagged.connect(self.comment_flagged,
                                     sender=get_model())
 
+    def pre_save_moderation(self, sender, comment, request, **kwargs):
+        if super().pre_save_moderation(sender, comment, request,
+                                       **kwargs) is False:
+            return False
+        model = comment.content_type.model_class()
+        if (
+            model in self._registry and
+            self._registry[model].review_comments and comment.is_public
+        ):
+            comment.is_public = False
+            comment.in_review = True
+
     def comment_flagged(self, sender, comment, flag, created, request,
                         **kwargs):
         model = comment.content_type.model_class()
@@ -119,3 +164,80 @@ class XtdModerator(Moderator):
 
 
 moderator = XtdModerator()
+
+
+# ----------------------------------------------------------------------
+# Review of the comments saved in review, see XtdCommentModerator.review.
+
+def review_comment(comment_pk):
+    """
+    Run the review of the moderator of the comment, and publish or discard
+    the comment accordingly. Comments published or removed meanwhile, ie:
+    by a moderator, are left as they are.
+    """
+    from django_comments_xtd.views import notify_comment_followers
+
+    comment = get_model().objects.filter(pk=comment_pk).first()
+    if comment is None or comment.is_public or comment.is_removed:
+        return
+    model = comment.content_type.model_class()
+    if model not in moderator._registry:
+        return
+    action = moderator._registry[model].review(comment,
+                                               comment.content_object)
+    if action == 'publish':
+        comment.is_public = True
+        comment.save()
+        comment_was_updated.send(sender=comment.__class__, comment=comment)
+        notify_comment_followers(comment)
+    elif action == 'remove':
+        comment.is_removed = True
+        comment.save()
+        comment_was_removed.send(sender=comment.__class__, comment=comment)
+    elif action is not None:
+        raise ValueError("Unknown review outcome %r." % (action,))
+
+
+class SyncReviewRunner(object):
+    """Reviews the comments in the thread of the caller."""
+    def submit(self, comment_pk):
+        review_comment(comment_pk)
+
+
+class ThreadedReviewRunner(object):
+    """Reviews the comments in a pool of worker threads."""
+    def __init__(self, workers=2):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="comments-xtd-review")
+
+    def _review(self, comment_pk):
+        try:
+            review_comment(comment_pk)
+        except Exception:
+            logger.exception("Failed to review comment %s.", comment_pk)
+        finally:
+            connections.close_all()
+
+    def submit(self, comment_pk):
+        self.executor.submit(self._review, comment_pk)
+
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+
+def get_review_runner():
+    """Return the review runner in use."""
+    path = settings.COMMENTS_XTD_REVIEW_RUNNER
+    with _runners_lock:
+        if path not in _runners:
+            runner_class = import_string(path)
+            _runners[path] = runner_class(
+                **settings.COMMENTS_XTD_REVIEW_RUNNER_OPTIONS)
+        return _runners[path]
+
+
+def submit_for_review(comment):
+    """Submit the comment for review once the transaction is committed."""
+    transaction.on_commit(
+        lambda: get_review_runner().submit(comment.pk))
@@ -0,0 +1,202 @@
+"""
+Rate limits of the requests that post comments and flags.
+
+Limits are token buckets: a bucket holds up to N tokens, a request takes
+one, and tokens are given back at a rate of N per period. A client may send
+bursts of N requests, and then one request every period/N seconds.
+
+The setting COMMENTS_XTD_RATE_LIMITS defines the limits per scope and per
+key: the id of the user, the IP address of the client and the object the
+request is about, ie::
+
+    COMMENTS_XTD_RATE_LIMITS = {
+        "comment": {"user": "5/min", "ip": "20/min", "object": "60/min"},
+        "feedback": {"user": "30/min", "ip": "60/min"},
+        "report": {"user": "10/hour", "ip": "20/hour"},
+    }
+
+Buckets are kept by the backend of COMMENTS_XTD_RATE_LIMIT_BACKEND, in one
+of Django's caches by default, shared by every process. The requests
+allowed and limited in the running process are returned by get_metrics().
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from django_comments_xtd.conf import settings
+
+
+KEY_PREFIX = 'django_comments_xtd:ratelimit'
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600,
+           'd': 86400, 'day': 86400}
+
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """Return the (capacity, period) of a rate, ie: "5/min" is (5, 60)."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+class BaseRateLimitBackend(object):
+    def get_bucket(self, key):
+        """Return the (tokens, updated_at) of a bucket, or None."""
+        raise NotImplementedError
+
+    def set_bucket(self, key, bucket, timeout):
+        raise NotImplementedError
+
+    def get_buckets(self, keys):
+        """Return a dict with the (tokens, updated_at) of the buckets found
+        of the given keys."""
+        buckets = {}
+        for key in keys:
+            bucket = self.get_bucket(key)
+            if bucket is not None:
+                buckets[key] = bucket
+        return buckets
+
+    def consume(self, key, capacity, period):
+        """
+        Take a token from the bucket. Return 0 when the request is allowed,
+        or the number of seconds to wait for the next token.
+        """
+        return self.consume_all([(key, capacity, period)])
+
+    def consume_all(self, limits):
+        """
+        Take a token from every bucket of the (key, capacity, period)
+        limits, only if all of them have one. Return 0 when the request is
+        allowed, or else the number of seconds to wait until it would be,
+        without taking any token.
+        """
+        now = time.time()
+        buckets = self.get_buckets([key for key, _, _ in limits])
+        updates, wait = [], 0
+        for key, capacity, period in limits:
+            refill_rate = capacity / period
+            if key not in buckets:
+                tokens = capacity
+            else:
+                tokens, updated_at = buckets[key]
+                tokens = min(capacity,
+                             tokens + (now - updated_at) * refill_rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / refill_rate)
+            updates.append((key, tokens - 1, period))
+        if wait:
+            return wait
+        for key, tokens, period in updates:
+            # The bucket is full again, and can be dropped, after `period`.
+            self.set_bucket(key, (tokens, now), timeout=period)
+        return 0
+
+
+class CacheRateLimitBackend(BaseRateLimitBackend):
+    """
+    Keeps the buckets in one of Django's caches, by default the one in
+    COMMENTS_XTD_CACHE_ALIAS or else 'default'. Buckets are read and written
+    without locks, so concurrent requests may take the same token.
+    """
+    def __init__(self, alias=None):
+        self.alias = (alias or settings.COMMENTS_XTD_CACHE_ALIAS or
+                      'default')
+
+    def get_bucket(self, key):
+        return caches[self.alias].get(key)
+
+    def get_buckets(self, keys):
+        return caches[self.alias].get_many(keys)
+
+    def set_bucket(self, key, bucket, timeout):
+        caches[self.alias].set(key, bucket, timeout=timeout)
+
+
+class LocMemRateLimitBackend(BaseRateLimitBackend):
+    """Keeps the buckets in the memory of the process, ie: for tests."""
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, key):
+        return self.buckets.get(key)
+
+    def set_bucket(self, key, bucket, timeout):
+        self.buckets[key] = bucket
+
+    def consume_all(self, limits):
+        with self.lock:
+            return super().consume_all(limits)
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the rate limit backend in use."""
+    path = settings.COMMENTS_XTD_RATE_LIMIT_BACKEND
+    with _backends_lock:
+        if path not in _backends:
+            backend_class = import_string(path)
+            _backends[path] = backend_class(
+                **settings.COMMENTS_XTD_RATE_LIMIT_BACKEND_OPTIONS)
+        return _backends[path]
+
+
+def check(scope, idents):
+    """
+    Take a token from the buckets of the scope for the given idents, a dict
+    {'user': ..., 'ip': ..., 'object': ...} of the keys of the request, with
+    None for the keys that don't apply. Return 0 when the request is
+    allowed, or the number of seconds to wait before retrying it. Limited
+    requests don't take tokens from any bucket.
+    """
+    limits = settings.COMMENTS_XTD_RATE_LIMITS.get(scope)
+    if not limits:
+        return 0
+    buckets = []
+    for kind, rate in limits.items():
+        ident = idents.get(kind)
+        if ident is None:
+            continue
+        ident = hashlib.md5(str(ident).encode('utf-8')).hexdigest()
+        buckets.append(('%s:%s:%s:%s' % (KEY_PREFIX, scope, kind, ident),) +
+                       parse_rate(rate))
+    wait = get_backend().consume_all(buckets)
+    _record(scope, 'limited' if wait else 'allowed')
+    return wait
+
+
+def _record(scope, event):
+    with _metrics_lock:
+        _metrics[(scope, event)] += 1
+
+
+def get_metrics():
+    """
+    Return the requests allowed and limited in this process by scope, ie:
+    {'comment': {'allowed': 120, 'limited': 3}, 'feedback': {...}}
+    """
+    metrics = {}
+    with _metrics_lock:
+        for (scope, event), count in _metrics.items():
+            metrics.setdefault(scope, {'allowed': 0, 'limited': 0})[event] = \
+                count
+    return metrics
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
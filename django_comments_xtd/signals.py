@@ -21,3 +21,7 @@ comment_was_removed = Signal()
 comment_was_updated = Signal()
 
 comment_was_pinned = Signal()
+
+# Sent once by django_comments_xtd.models.moderate_comments, instead of one
+# signal per comment, when COMMENTS_XTD_BULK_MODERATION_SIGNAL is True.
+comments_were_moderated = Signal()
@@ -191,10 +191,19 @@ export class CommentBox extends React.Component {
 
   componentDidMount() {
     this.load_comments();
-    if(this.props.polling_interval)
+    if(this.props.stream_url && window.EventSource) {
+      // The server pushes an event every time the comments change.
+      this.event_source = new EventSource(this.props.stream_url);
+      this.event_source.onmessage = this.load_count.bind(this);
+    } else if(this.props.polling_interval)
       setInterval(this.load_count.bind(this), this.props.polling_interval);
   }
 
+  componentWillUnmount() {
+    if(this.event_source)
+      this.event_source.close();
+  }
+
   render() {
     var settings = this.props;
     var comment_counter = this.render_comment_counter();
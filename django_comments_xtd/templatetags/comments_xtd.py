@@ -15,9 +15,11 @@ from django.urls import reverse
 from django.utils.safestring import mark_safe
 
 from django_comments.models import CommentFlag
-from django_comments_xtd import get_model as get_comment_model
+from django_comments_xtd import cache, get_model as get_comment_model
 from django_comments_xtd.api import frontend
-from django_comments_xtd.models import LIKEDIT_FLAG, DISLIKEDIT_FLAG
+from django_comments_xtd.models import (
+    LIKEDIT_FLAG, DISLIKEDIT_FLAG, get_comment_counts
+)
 from django_comments_xtd.utils import (
     get_app_model_options, get_current_site_id, get_html_id_suffix
 )
@@ -77,6 +79,64 @@ def get_xtdcomment_count(parser, token):
     return XtdCommentCountNode(as_varname, content_types)
 
 
+# ----------------------------------------------------------------------
+class XtdCommentCountsNode(Node):
+    """Store the number of XtdComments of every object in a list."""
+
+    def __init__(self, object_list, as_varname):
+        self.object_list = Variable(object_list)
+        self.as_varname = as_varname
+
+    def render(self, context):
+        object_list = self.object_list.resolve(context)
+        context[self.as_varname] = get_comment_counts(
+            object_list, site_id=get_current_site_id(context.get('request')))
+        return ''
+
+
+@register.tag
+def get_xtdcomment_counts(parser, token):
+    """
+    Gets the comment count of every object in a list with a single query,
+    and populates the template context with a variable containing them,
+    whose name is defined by the 'as' clause. Read the count of each object
+    with the filter xtdcomment_count.
+
+    Syntax::
+
+        {% get_xtdcomment_counts for object_list as var %}
+
+    Example usage::
+
+        {% get_xtdcomment_counts for object_list as comment_counts %}
+        {% for object in object_list %}
+            {{ comment_counts|xtdcomment_count:object }}
+        {% endfor %}
+
+    """
+    tokens = token.contents.split()
+
+    if len(tokens) != 5:
+        raise TemplateSyntaxError("%r tag requires 4 arguments" % tokens[0])
+
+    if tokens[1] != 'for':
+        raise TemplateSyntaxError("2nd. argument in %r tag must be 'for'" %
+                                  tokens[0])
+
+    if tokens[3] != 'as':
+        raise TemplateSyntaxError("4th. argument in %r tag must be 'as'" %
+                                  tokens[0])
+
+    return XtdCommentCountsNode(tokens[2], tokens[4])
+
+
+@register.filter
+def xtdcomment_count(counts, obj):
+    """Return the count of obj from the counts of get_xtdcomment_counts."""
+    content_type = ContentType.objects.get_for_model(obj)
+    return counts.get((content_type.pk, str(obj.pk)), 0)
+
+
 # ----------------------------------------------------------------------
 class WhoCanPostNode(Node):
     """Stores the who_can_post value from COMMENTS_XTD_APP_MODEL_OPTION"""
@@ -282,15 +342,42 @@ def get_last_xtdcomments(parser, token):
 
 
 # ----------------------------------------------------------------------
+def _get_tree_queryset(obj, request, counts_only=False):
+    content_type = ContentType.objects.get_for_model(obj)
+    queryset = XtdComment.objects.filter(
+        content_type=content_type,
+        object_pk=obj.pk,
+        site__pk=get_current_site_id(request),
+        is_public=True
+    )
+    if not counts_only:
+        flags_qs = CommentFlag.objects.filter(flag__in=[
+            CommentFlag.SUGGEST_REMOVAL, LIKEDIT_FLAG, DISLIKEDIT_FLAG
+        ]).prefetch_related('user')
+        queryset = queryset.prefetch_related(Prefetch('flags',
+                                                      queryset=flags_qs))
+    return queryset
+
+
+def _get_tree_comments(obj, request, counts_only=False):
+    content_type = ContentType.objects.get_for_model(obj)
+    queryset = _get_tree_queryset(obj, request, counts_only=counts_only)
+    return cache.get_or_set('tree-counts' if counts_only else 'tree',
+                            content_type.pk, obj.pk,
+                            get_current_site_id(request),
+                            lambda: list(queryset))
+
+
 class RenderXtdCommentTreeNode(Node):
     def __init__(self, obj, cvars, allow_feedback=False, show_feedback=False,
-                 allow_flagging=False, template_path=None):
+                 allow_flagging=False, template_path=None, counts_only=False):
         self.obj = Variable(obj) if obj else None
         self.cvars = self.parse_cvars(cvars)
         self.allow_feedback = allow_feedback
         self.show_feedback = show_feedback
         self.allow_flagging = allow_flagging
         self.template_path = template_path
+        self.counts_only = counts_only
 
     def parse_cvars(self, pairs):
         cvars = []
@@ -306,24 +393,14 @@ class RenderXtdCommentTreeNode(Node):
         if self.obj:
             obj = self.obj.resolve(context)
             content_type = ContentType.objects.get_for_model(obj)
-            flags_qs = CommentFlag.objects.filter(flag__in=[
-                CommentFlag.SUGGEST_REMOVAL, LIKEDIT_FLAG, DISLIKEDIT_FLAG
-            ]).prefetch_related('user')
-            prefetch = Prefetch('flags', queryset=flags_qs)
-            queryset = XtdComment\
-                .objects\
-                .prefetch_related(prefetch)\
-                .filter(
-                    content_type=content_type,
-                    object_pk=obj.pk,
-                    site__pk=get_current_site_id(context.get('request')),
-                    is_public=True
-                )
+            queryset = _get_tree_comments(obj, context.get('request'),
+                                          counts_only=self.counts_only)
             comments = XtdComment.tree_from_queryset(
                 queryset,
                 with_flagging=self.allow_flagging,
                 with_feedback=self.allow_feedback,
-                user=context['user']
+                user=context['user'],
+                counts_only=self.counts_only
             )
             context_dict['comments'] = comments
         if self.cvars:
@@ -361,31 +438,21 @@ class RenderXtdCommentTreeNode(Node):
 
 
 class GetXtdCommentTreeNode(Node):
-    def __init__(self, obj, var_name, with_feedback):
+    def __init__(self, obj, var_name, with_feedback, counts_only=False):
         self.obj = Variable(obj)
         self.var_name = var_name
         self.with_feedback = with_feedback
+        self.counts_only = counts_only
 
     def render(self, context):
         obj = self.obj.resolve(context)
-        content_type = ContentType.objects.get_for_model(obj)
-        flags_qs = CommentFlag.objects.filter(flag__in=[
-            CommentFlag.SUGGEST_REMOVAL, LIKEDIT_FLAG, DISLIKEDIT_FLAG
-        ]).prefetch_related('user')
-        prefetch = Prefetch('flags', queryset=flags_qs)
-        queryset = XtdComment\
-            .objects\
-            .prefetch_related(prefetch)\
-            .filter(
-                content_type=content_type,
-                object_pk=obj.pk,
-                site__pk=get_current_site_id(context.get('request')),
-                is_public=True
-            )
+        queryset = _get_tree_comments(obj, context.get('request'),
+                                      counts_only=self.counts_only)
         dic_list = XtdComment.tree_from_queryset(
             queryset,
             with_feedback=self.with_feedback,
-            user=context['user']
+            user=context['user'],
+            counts_only=self.counts_only
         )
         context[self.var_name] = dic_list
         return ''
@@ -401,19 +468,24 @@ def render_xtdcomment_tree(parser, token):
 
         {% render_xtdcomment_tree [for <object>] [with vname1=<obj1>
            vname2=<obj2>] [allow_feedback] [show_feedback] [allow_flagging]
-           [using <template>] %}
+           [counts_only] [using <template>] %}
         {% render_xtdcomment_tree with <varname>=<context-var> %}
 
     Example usage::
 
         {% render_xtdcomment_tree for object allow_feedback %}
+        {% render_xtdcomment_tree for object allow_feedback counts_only %}
         {% render_xtdcomment_tree with comments=comment.children %}
+
+    With ``counts_only`` the feedback is rendered from like, dislike and
+    removal suggestion counts instead of the lists of users who sent it.
     """
     obj = None
     cvars = []
     allow_feedback = False
     show_feedback = False
     allow_flagging = False
+    counts_only = False
     template_path = None
     tokens = token.contents.split()
     tag = tokens.pop(0)
@@ -434,7 +506,7 @@ def render_xtdcomment_tree(parser, token):
                                           % tag)
         if token == "with":
             tail_tokens = ["allow_feedback", "show_feedback", "allow_flagging",
-                           "using"]
+                           "counts_only", "using"]
             try:
                 if tokens[0] not in tail_tokens:
                     while len(tokens) and tokens[0] not in tail_tokens:
@@ -453,6 +525,8 @@ def render_xtdcomment_tree(parser, token):
             show_feedback = True
         if token == "allow_flagging":
             allow_flagging = True
+        if token == "counts_only":
+            counts_only = True
         if token == "using":
             try:
                 template_path = tokens[0]
@@ -464,7 +538,8 @@ def render_xtdcomment_tree(parser, token):
                                     allow_feedback=allow_feedback,
                                     show_feedback=show_feedback,
                                     allow_flagging=allow_flagging,
-                                    template_path=template_path)
+                                    template_path=template_path,
+                                    counts_only=counts_only)
 
 
 @register.tag
@@ -489,10 +564,24 @@ def get_xtdcomment_tree(parser, token):
             'dislikedit': [user_object_x, user_object_y, ...],
         }
 
+    Adding *counts_only* replaces the lists of users by the number of
+    likes and dislikes::
+        {
+            'comment': xtdcomment object,
+            'children': [ list of child xtdcomment dicts ],
+            'likedit': <bool>,  // Whether the user liked the comment.
+            'dislikedit': <bool>,  // Whether the user disliked it.
+            'likedit_count': <int>,
+            'dislikedit_count': <int>,
+        }
+
     Syntax::
-        {% get_xtdcomment_tree for [object] as [varname] [with_feedback] %}
+        {% get_xtdcomment_tree for [object] as [varname] [with_feedback]
+           [counts_only] %}
     Example usage::
         {% get_xtdcomment_tree for post as comment_list %}
+        {% get_xtdcomment_tree for post as comment_list with_feedback
+           counts_only %}
     """
     try:
         tag_name, args = token.contents.split(None, 1)
@@ -503,11 +592,11 @@ def get_xtdcomment_tree(parser, token):
     if not match:
         raise TemplateSyntaxError("%s tag had invalid arguments" % tag_name)
     obj, var_name = match.groups()
-    if args.strip().endswith('with_feedback'):
-        with_feedback = True
-    else:
-        with_feedback = False
-    return GetXtdCommentTreeNode(obj, var_name, with_feedback)
+    tail_tokens = args[match.end():].split()
+    with_feedback = 'with_feedback' in tail_tokens
+    counts_only = 'counts_only' in tail_tokens
+    return GetXtdCommentTreeNode(obj, var_name, with_feedback,
+                                 counts_only=counts_only)
 
 
 # ----------------------------------------------------------------------
@@ -4,7 +4,7 @@ from django.db import models
 from django.urls import reverse
 
 from django_comments_xtd.conf import settings
-from django_comments_xtd.models import XtdComment
+from django_comments_xtd.models import CommentCountQuerySet, XtdComment
 from django_comments_xtd.moderation import moderator, XtdCommentModerator
 
 
@@ -24,7 +24,7 @@ class Article(models.Model):
     allow_comments = models.BooleanField('allow comments', default=True)
     publish = models.DateTimeField('publish', default=datetime.now)
 
-    objects = PublicManager()
+    objects = PublicManager.from_queryset(CommentCountQuerySet)()
 
     class Meta:
         db_table = 'demo_articles'
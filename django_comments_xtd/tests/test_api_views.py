@@ -2,18 +2,34 @@ from __future__ import unicode_literals
 
 from datetime import datetime
 import json
+from unittest import skipUnless
 from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission, User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import force_authenticate
 
 from django_comments_xtd import django_comments
-from django_comments_xtd import get_model
+from django_comments_xtd import get_model, views
+from django_comments_xtd.api.views import (
+    CommentCount, CommentCounts, CommentList, CommentModerate,
+    CommentReplies, CommentTree
+)
 from django_comments_xtd.conf import settings
 from django_comments_xtd.tests.models import Article
-from django_comments_xtd.tests.utils import post_comment
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1, thread_test_step_2, thread_test_step_3,
+    thread_test_step_4
+)
+from django_comments_xtd.tests.utils import post_comment, request_factory
 
 
 app_model_options_mock = {
@@ -47,6 +63,27 @@ class CommentCreateTestCase(TestCase):
         self.assertTrue('id' in data)
         self.assertEqual(data['id'], 1)  # id of the new created comment.
 
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_CONFIRM_EMAIL=False)
+    def test_posts_at_once_create_one_comment(self):
+        data = {"name": "Bob", "email": "fulanito@detal.com",
+                "followup": True, "reply_to": 0, "level": 1, "order": 1,
+                "comment": "Es war einmal eine kleine...",
+                "honeypot": ""}
+        data.update(self.form.initial)
+        # Both posts get the same submit_date, and so the same content_hash.
+        with patch('django_comments.forms.timezone.now',
+                   return_value=timezone.now()):
+            self.assertEqual(post_comment(data).status_code, 201)
+            comment = XtdComment.objects.get()
+            # The comment is created by another request after the lookup.
+            with patch('django_comments_xtd.views._get_comment_if_exists',
+                       side_effect=[None, comment]):
+                response = post_comment(data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], comment.pk)
+        self.assertEqual(XtdComment.objects.count(), 1)
+
     def test_post_returns_2xx_response(self):
         data = {"name": "Bob", "email": "fulanito@detal.com",
                 "followup": True, "reply_to": 0, "level": 1, "order": 1,
@@ -111,3 +148,403 @@ class CommentCreateTestCase(TestCase):
         response = post_comment(data)
         self.assertEqual(XtdComment.objects.count(), 1)  # Comment not added.
         self.assertEqual(response.status_code, 400)
+
+
+class CommentListTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        request = request_factory.post('/')
+        request.user = self.user
+        views.perform_like(request, XtdComment.objects.get(pk=3))
+
+    def get_comments(self, **params):
+        params.update({'content_type': 'tests.article',
+                       'object_pk': self.article.pk})
+        request = request_factory.get(reverse('comments'), params)
+        force_authenticate(request, user=self.user)
+        return CommentList.as_view()(request, override_drf_defaults=True)
+
+    def test_list_comments_with_flags(self):
+        response = self.get_comments()
+        self.assertEqual(response.status_code, 200)
+        flags = {cm['id']: cm['flags'] for cm in response.data}
+        self.assertEqual(flags[3], [{'flag': 'like', 'user': 'bob',
+                                     'id': self.user.pk}])
+        self.assertEqual(flags[4], [])
+
+    def test_list_comments_with_counts_only(self):
+        response = self.get_comments(counts_only=1)
+        self.assertEqual(response.status_code, 200)
+        flags = {cm['id']: cm['flags'] for cm in response.data}
+        self.assertEqual(flags[3], {'like': 1, 'dislike': 0, 'removal': 0,
+                                    'liked': True, 'disliked': False,
+                                    'flagged': False})
+        self.assertEqual(flags[4]['like'], 0)
+        self.assertFalse(flags[4]['liked'])
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+
+    def get_comments(self, page_size=2, **params):
+        params.update({'content_type': 'tests.article',
+                       'object_pk': self.article.pk, 'page_size': page_size})
+        request = request_factory.get(reverse('comments'), params)
+        force_authenticate(request, user=self.user)
+        return CommentList.as_view()(request, override_drf_defaults=True)
+
+    def get_all_pages(self, page_size=2):
+        pages, params = [], {}
+        while True:
+            response = self.get_comments(page_size=page_size, **params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([cm['id'] for cm in response.data['results']])
+            if response.data['next'] is None:
+                return pages
+            query = parse_qs(urlparse(response.data['next']).query)
+            params['cursor'] = query['cursor'][0]
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_API_PAGINATION_CLASS=(
+                        "django_comments_xtd.api.pagination."
+                        "KeysetPagination"))
+    def test_pages_follow_submit_date(self):
+        expected = list(XtdComment.objects.order_by('-submit_date', '-id')
+                        .values_list('id', flat=True))
+        pages = self.get_all_pages()
+        self.assertTrue(all(len(page) <= 2 for page in pages))
+        self.assertEqual(sum(pages, []), expected)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_API_PAGINATION_CLASS=(
+                        "django_comments_xtd.api.pagination."
+                        "ThreadKeysetPagination"))
+    def test_pages_follow_thread_order(self):
+        expected = list(XtdComment.objects.order_by('thread_id', 'order')
+                        .values_list('id', flat=True))
+        pages = self.get_all_pages()
+        self.assertTrue(all(len(page) <= 2 for page in pages))
+        self.assertEqual(sum(pages, []), expected)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_API_PAGINATION_CLASS=(
+                        "django_comments_xtd.api.pagination."
+                        "KeysetPagination"))
+    @skipUnless(connection.vendor == 'sqlite', "Query plan of SQLite")
+    def test_pages_seek_into_the_object_submit_date_index(self):
+        response = self.get_comments()
+        query = parse_qs(urlparse(response.data['next']).query)
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_comments(cursor=query['cursor'][0])
+        sql = next(captured['sql'] for captured in ctx.captured_queries
+                   if 'ORDER BY "django_comments"."submit_date"' in
+                   captured['sql'])
+        self.assertNotIn('OFFSET', sql)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN %s' % sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertIn('SEARCH django_comments USING INDEX '
+                      'comments_object_submit_idx (content_type_id=? AND '
+                      'object_pk=? AND submit_date<?)', plan)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_API_PAGINATION_CLASS=(
+                        "django_comments_xtd.api.pagination."
+                        "KeysetPagination"))
+    def test_invalid_cursor_returns_404(self):
+        response = self.get_comments(cursor="not-a-cursor")
+        self.assertEqual(response.status_code, 404)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_API_PAGINATION_CLASS=(
+                        "django_comments_xtd.api.pagination."
+                        "ThreadPagination"))
+    def test_pages_do_not_split_threads(self):
+        threads = {}
+        for thread_id, pk in XtdComment.objects.order_by('thread_id', 'order')\
+                                               .values_list('thread_id', 'id'):
+            threads.setdefault(thread_id, []).append(pk)
+        self.assertEqual(self.get_all_pages(page_size=1),
+                         list(threads.values()))
+
+
+class CommentTreeTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+        thread_test_step_3(self.article)
+        thread_test_step_4(self.article)
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+
+    def get_tree(self, **params):
+        params.update({'content_type': 'tests.article',
+                       'object_pk': self.article.pk})
+        request = request_factory.get(reverse('comments-xtd-api-tree'),
+                                      params)
+        force_authenticate(request, user=self.user)
+        return CommentTree.as_view()(request, override_drf_defaults=True)
+
+    def get_replies(self, pk, **params):
+        request = request_factory.get(
+            reverse('comments-xtd-api-replies', kwargs={'pk': pk}), params)
+        force_authenticate(request, user=self.user)
+        return CommentReplies.as_view()(request, pk=pk)
+
+    def as_pks(self, items):
+        return [(item['id'], item['remaining_count'],
+                 self.as_pks(item['children'])) for item in items]
+
+    def test_tree_with_first_replies(self):
+        # Thread 1: c1 -> (c3, c4 -> c7), thread 2: c2 -> c5 -> c6.
+        response = self.get_tree(replies=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.as_pks(response.data['results']), [
+            (1, 2, [(3, 0, [])]),
+            (2, 1, [(5, 1, [])]),
+        ])
+
+    def test_tree_with_all_replies(self):
+        response = self.get_tree(replies=10)
+        self.assertEqual(self.as_pks(response.data['results']), [
+            (1, 0, [(3, 0, []), (4, 0, [(7, 0, [])])]),
+            (2, 0, [(5, 0, [(6, 0, [])])]),
+        ])
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_API_PAGINATION_CLASS=(
+                        'django_comments_xtd.api.pagination.'
+                        'ThreadKeysetPagination'))
+    def test_tree_pages_do_not_split_threads(self):
+        # Thread 1 has 4 comments, more than the page size of the list.
+        response = self.get_tree(replies=10, page_size=1)
+        self.assertEqual(self.as_pks(response.data['results']), [
+            (1, 0, [(3, 0, []), (4, 0, [(7, 0, [])])]),
+        ])
+        query = parse_qs(urlparse(response.data['next']).query)
+        response = self.get_tree(replies=10, page_size=1,
+                                 cursor=query['cursor'][0])
+        self.assertEqual(self.as_pks(response.data['results']), [
+            (2, 0, [(5, 0, [(6, 0, [])])]),
+        ])
+        self.assertIsNone(response.data['next'])
+
+    def test_replies_are_the_subtree_of_the_comment(self):
+        response = self.get_replies(1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([cm['id'] for cm in response.data['results']],
+                         [3, 4, 7])
+        self.assertIsNone(response.data['next'])
+
+    def test_replies_are_paginated(self):
+        response = self.get_replies(1, page_size=2)
+        self.assertEqual([cm['id'] for cm in response.data['results']],
+                         [3, 4])
+        query = parse_qs(urlparse(response.data['next']).query)
+        response = self.get_replies(1, page_size=2, cursor=query['cursor'][0])
+        self.assertEqual([cm['id'] for cm in response.data['results']], [7])
+
+    def test_replies_to_missing_comment_returns_404(self):
+        self.assertEqual(self.get_replies(100).status_code, 404)
+
+    def test_replies_to_removed_comment_returns_404(self):
+        XtdComment.objects.filter(pk=1).update(is_removed=True)
+        self.assertEqual(self.get_replies(1).status_code, 404)
+
+
+class CommentCountsTestCase(TestCase):
+    def setUp(self):
+        self.article_1 = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        self.article_2 = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_1(self.article_2)
+
+    def get_counts(self, objects):
+        request = request_factory.get(reverse('comments-xtd-api-counts'),
+                                      {'object': objects})
+        return CommentCounts.as_view()(request)
+
+    def test_counts_of_many_objects(self):
+        objects = ['tests.article:%d' % self.article_1.pk,
+                   'tests.article:%d' % self.article_2.pk,
+                   'tests.article:99']
+        response = self.get_counts(objects)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'counts': {
+            objects[0]: 4, objects[1]: 2, objects[2]: 0}})
+
+    def test_invalid_objects_return_400(self):
+        for objects in [[], ['tests.article'], ['tests.nothing:1']]:
+            self.assertEqual(self.get_counts(objects).status_code, 400)
+
+
+class CommentModerateTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        self.moderator = User.objects.create_user("alice",
+                                                  "alice@example.com", "pwd")
+        self.moderator.user_permissions.add(Permission.objects.get(
+            content_type__app_label="django_comments",
+            codename="can_moderate"))
+        XtdComment.norel_objects.filter(pk=3).update(ip_address="10.0.0.1")
+
+    def moderate(self, user, data):
+        request = request_factory.post(reverse('comments-xtd-api-moderate'),
+                                       data, format='json')
+        force_authenticate(request, user=user)
+        return CommentModerate.as_view()(request)
+
+    def test_moderate_requires_permission(self):
+        response = self.moderate(self.user, {'action': 'remove',
+                                             'ids': [1]})
+        self.assertEqual(response.status_code, 403)
+
+    def test_moderate_by_ids(self):
+        response = self.moderate(self.moderator, {'action': 'remove',
+                                                  'ids': [1, 2, 100]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'action': 'remove', 'count': 2})
+        self.assertEqual(
+            list(XtdComment.objects.filter(is_removed=True)
+                 .values_list('pk', flat=True)), [1, 2])
+
+    def test_moderate_by_ids_of_the_current_site(self):
+        site2 = Site.objects.create(domain='site2.com', name='site2.com')
+        XtdComment.norel_objects.filter(pk=2).update(site=site2)
+        response = self.moderate(self.moderator, {'action': 'remove',
+                                                  'ids': [1, 2]})
+        self.assertEqual(response.data, {'action': 'remove', 'count': 1})
+        self.assertFalse(XtdComment.objects.get(pk=2).is_removed)
+
+    def test_moderate_by_filter(self):
+        response = self.moderate(self.moderator, {
+            'action': 'unpublish',
+            'filter': {'content_type': 'tests.article',
+                       'object_pk': str(self.article.pk),
+                       'ip_address': '10.0.0.1'}})
+        self.assertEqual(response.data, {'action': 'unpublish', 'count': 1})
+        self.assertEqual(
+            list(XtdComment.objects.filter(is_public=False)
+                 .values_list('pk', flat=True)), [3])
+
+    def test_invalid_requests_return_400(self):
+        for data in [{'action': 'remove'},
+                     {'action': 'delete', 'ids': [1]},
+                     {'action': 'remove', 'ids': [1], 'filter': {'user': 1}},
+                     {'action': 'remove', 'filter': {'email': 'x'}},
+                     {'action': 'remove',
+                      'filter': {'content_type': 'tests.nothing'}}]:
+            response = self.moderate(self.moderator, data)
+            self.assertEqual(response.status_code, 400, data)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        thread_test_step_1(self.article)
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+
+    def get_comments(self, **headers):
+        request = request_factory.get(
+            reverse('comments'), {'content_type': 'tests.article',
+                                  'object_pk': self.article.pk}, **headers)
+        force_authenticate(request, user=self.user)
+        return CommentList.as_view()(request, override_drf_defaults=True)
+
+    def get_count(self, **headers):
+        request = request_factory.get('/count/', **headers)
+        force_authenticate(request, user=self.user)
+        return CommentCount.as_view()(request, content_type='tests-article',
+                                      object_pk=str(self.article.pk),
+                                      override_drf_defaults=True)
+
+    def like_comment(self, pk):
+        request = request_factory.post('/')
+        request.user = self.user
+        views.perform_like(request, XtdComment.objects.get(pk=pk))
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_CACHE_ALIAS='default')
+    def test_not_modified_without_queries_when_cache_is_warm(self):
+        response = self.get_comments()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.get_comments(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_CACHE_ALIAS='default')
+    def test_changes_invalidate_etag_with_cache(self):
+        etag = self.get_comments()['ETag']
+        self.like_comment(1)
+        response = self.get_comments(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_changes_invalidate_etag_without_cache(self):
+        etag = self.get_comments()['ETag']
+        response = self.get_comments(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.like_comment(1)
+        response = self.get_comments(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_edit_invalidates_etag_without_cache(self):
+        etag = self.get_comments()['ETag']
+        comment = XtdComment.objects.get(pk=1)
+        comment.comment = "An edited comment"
+        comment.is_edited = True
+        comment.save()
+        response = self.get_comments(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        comments = {cm['id']: cm['comment'] for cm in response.data}
+        self.assertEqual(comments[1], "An edited comment")
+
+    def test_unpin_invalidates_etag_without_cache(self):
+        # Comment 2 keeps the latest pinned_at after comment 1 is unpinned.
+        now = timezone.now()
+        XtdComment.objects.filter(pk=1).update(pinned_at=now)
+        XtdComment.objects.filter(pk=2).update(pinned_at=now)
+        etag = self.get_comments()['ETag']
+        comment = XtdComment.objects.get(pk=1)
+        comment.pinned_at = None
+        comment.save()
+        response = self.get_comments(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_CACHE_ALIAS='default')
+    def test_count_not_modified(self):
+        response = self.get_count()
+        self.assertEqual(response.data, {'count': 2})
+        etag = response['ETag']
+        self.assertEqual(
+            self.get_count(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        thread_test_step_2(self.article)
+        response = self.get_count(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'count': 4})
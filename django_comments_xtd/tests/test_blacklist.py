@@ -0,0 +1,126 @@
+from datetime import datetime
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.test import TestCase, RequestFactory
+
+from django_comments_xtd import blacklist
+from django_comments_xtd.models import BlackListedDomain, TmpXtdComment
+from django_comments_xtd.moderation import SpamModerator
+from django_comments_xtd.tests.models import Diary
+
+
+class DomainIndexTestCase(TestCase):
+    def test_matches_domains_and_subdomains(self):
+        index = blacklist.DomainIndex(["spam.com", "Bad.Example.org."])
+        self.assertIn("spam.com", index)
+        self.assertIn("mail.spam.com", index)
+        self.assertIn("a.b.SPAM.com", index)
+        self.assertIn("bad.example.org", index)
+        self.assertIn("x.bad.example.org", index)
+        self.assertNotIn("example.org", index)
+        self.assertNotIn("notspam.com", index)
+        self.assertNotIn("spam.com.ar", index)
+        self.assertNotIn("com", index)
+
+
+def run_now(function, *args):
+    function(*args)
+
+
+class BlacklistTestCase(TestCase):
+    def setUp(self):
+        # Reload in the thread of the test, to see the rows it creates.
+        patcher = patch.object(blacklist, '_run_in_background', run_now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        blacklist.invalidate()
+        BlackListedDomain.objects.create(domain="spam.com")
+
+    def test_lookups_do_not_hit_the_database(self):
+        blacklist.get_index()
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist.is_blacklisted("spam.com"))
+            self.assertTrue(blacklist.is_blacklisted("mail.spam.com"))
+            self.assertFalse(blacklist.is_blacklisted("example.com"))
+
+    def test_index_is_reloaded_on_save_and_delete(self):
+        self.assertFalse(blacklist.is_blacklisted("example.com"))
+        domain = BlackListedDomain.objects.create(domain="example.com")
+        with self.assertNumQueries(1):
+            self.assertTrue(blacklist.is_blacklisted("example.com"))
+        domain.delete()
+        self.assertFalse(blacklist.is_blacklisted("example.com"))
+
+    def test_index_is_reloaded_on_invalidate(self):
+        blacklist.get_index()
+        BlackListedDomain.objects.bulk_create([
+            BlackListedDomain(domain="example.com")])
+        self.assertFalse(blacklist.is_blacklisted("example.com"))
+        blacklist.invalidate()
+        self.assertTrue(blacklist.is_blacklisted("example.com"))
+
+    def test_index_is_reloaded_periodically(self):
+        blacklist.get_index()
+        BlackListedDomain.objects.bulk_create([
+            BlackListedDomain(domain="example.com")])
+        with patch.object(blacklist.time, 'monotonic',
+                          return_value=blacklist._loaded_at + 299):
+            self.assertFalse(blacklist.is_blacklisted("example.com"))
+        with patch.object(blacklist.time, 'monotonic',
+                          return_value=blacklist._loaded_at + 300):
+            self.assertTrue(blacklist.is_blacklisted("example.com"))
+
+    def test_reload_does_not_block_lookups(self):
+        blacklist.get_index()
+        BlackListedDomain.objects.bulk_create([
+            BlackListedDomain(domain="example.com")])
+        blacklist.invalidate()
+        with patch.object(blacklist, '_run_in_background') as run:
+            with self.assertNumQueries(0):
+                self.assertFalse(blacklist.is_blacklisted("example.com"))
+                self.assertFalse(blacklist.is_blacklisted("example.com"))
+            # A single reload is started, the current index is used until
+            # it is complete.
+            self.assertEqual(run.call_count, 1)
+            function, *args = run.call_args[0]
+            function(*args)
+        self.assertTrue(blacklist.is_blacklisted("example.com"))
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_CACHE_ALIAS='default')
+    def test_version_is_shared_through_the_cache(self):
+        caches['default'].clear()
+        blacklist.get_index()
+        BlackListedDomain.objects.bulk_create([
+            BlackListedDomain(domain="example.com")])
+        self.assertFalse(blacklist.is_blacklisted("example.com"))
+        # Another process invalidates the index.
+        caches['default'].incr(blacklist.VERSION_KEY)
+        self.assertTrue(blacklist.is_blacklisted("example.com"))
+
+
+class SpamModeratorTestCase(TestCase):
+    def setUp(self):
+        patcher = patch.object(blacklist, '_run_in_background', run_now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        blacklist.invalidate()
+        BlackListedDomain.objects.create(domain="spam.com")
+        self.diary_entry = Diary.objects.create(
+            body="What I did on October...", allow_comments=True,
+            publish=datetime.now())
+        self.moderator = SpamModerator(Diary)
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+
+    def allow(self, email):
+        comment = TmpXtdComment(user_email=email)
+        return self.moderator.allow(comment, self.diary_entry, self.request)
+
+    def test_allow(self):
+        self.assertTrue(self.allow("bob@example.com"))
+        self.assertFalse(self.allow("bob@spam.com"))
+        self.assertFalse(self.allow("bob@mail.spam.com"))
+        self.assertFalse(self.allow("bob"))
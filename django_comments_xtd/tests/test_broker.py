@@ -0,0 +1,154 @@
+import json
+import threading
+from unittest.mock import patch
+
+from django.http import Http404
+from django.test import TestCase
+from django.urls import reverse
+
+from django_comments_xtd import broker
+from django_comments_xtd.api.views import comment_stream
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1, thread_test_step_2
+)
+from django_comments_xtd.tests.utils import request_factory
+
+
+class FakeRedis(object):
+    """Local stand-in for the subset of the Redis client used by
+    RedisBroker."""
+    def __init__(self):
+        self.data = {}
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value).encode()
+
+    def rpush(self, key, value):
+        self.data.setdefault(key, []).append(value.encode())
+
+    def ltrim(self, key, start, end):
+        items = self.data.get(key, [])
+        end = len(items) if end == -1 else end + 1
+        self.data[key] = items[start:end] if start >= 0 else items[start:]
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+
+class BrokerTestsMixin(object):
+    def test_wait_returns_events_after_last_id(self):
+        self.assertEqual(self.broker.last_id('c'), 0)
+        self.broker.publish('c', {'type': 'posted', 'comment': 1})
+        self.broker.publish('c', {'type': 'removed', 'comment': 1})
+        self.broker.publish('other', {'type': 'posted', 'comment': 2})
+        self.assertEqual(self.broker.last_id('c'), 2)
+        last_id, events = self.broker.wait('c', 1, timeout=0)
+        self.assertEqual(last_id, 2)
+        self.assertEqual(events, [{'type': 'removed', 'comment': 1, 'id': 2}])
+
+    def test_wait_times_out(self):
+        self.assertEqual(self.broker.wait('c', 0, timeout=0.01), (0, []))
+
+    def test_backlog_is_bounded(self):
+        for pk in range(5):
+            self.broker.publish('c', {'type': 'posted', 'comment': pk})
+        last_id, events = self.broker.wait('c', 0, timeout=0)
+        self.assertEqual(last_id, 5)
+        self.assertEqual([event['id'] for event in events], [3, 4, 5])
+
+    def test_wait_wakes_up_on_publish(self):
+        timer = threading.Timer(0.05, self.broker.publish,
+                                args=('c', {'type': 'posted', 'comment': 1}))
+        timer.start()
+        last_id, events = self.broker.wait('c', 0, timeout=5)
+        timer.join()
+        self.assertEqual(last_id, 1)
+
+
+class LocalBrokerTestCase(BrokerTestsMixin, TestCase):
+    def setUp(self):
+        self.broker = broker.LocalBroker(backlog=3)
+
+
+class RedisBrokerTestCase(BrokerTestsMixin, TestCase):
+    def setUp(self):
+        self.broker = broker.RedisBroker(client=FakeRedis(), backlog=3,
+                                         poll_interval=0.01)
+
+
+class CommentStreamTestCase(TestCase):
+    def setUp(self):
+        patcher = patch.multiple(
+            'django_comments_xtd.conf.settings',
+            COMMENTS_XTD_STREAM_BROKER="django_comments_xtd.broker.LocalBroker",
+            COMMENTS_XTD_STREAM_TIMEOUT=0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        broker._brokers.clear()
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        with self.captureOnCommitCallbacks(execute=True):
+            thread_test_step_1(self.article)
+
+    def get_stream(self, **params):
+        params.update({'content_type': 'tests.article',
+                       'object_pk': self.article.pk})
+        headers = {}
+        if params.pop('sse', False):
+            headers['HTTP_ACCEPT'] = 'text/event-stream'
+        request = request_factory.get(reverse('comments-xtd-api-stream'),
+                                      params, **headers)
+        return comment_stream(request)
+
+    def test_long_poll_returns_published_events(self):
+        response = self.get_stream(last_event_id=0)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['last_event_id'], 2)
+        self.assertEqual([(ev['type'], ev['comment']) for ev in data['events']],
+                         [('posted', 1), ('posted', 2)])
+
+    def test_long_poll_without_last_event_id_waits_for_new_events(self):
+        data = json.loads(self.get_stream().content)
+        self.assertEqual(data, {'last_event_id': 2, 'events': []})
+
+    def test_server_sent_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            thread_test_step_2(self.article)
+        response = self.get_stream(sse=True, last_event_id=2)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('id: 3\ndata: {"type": "posted", "comment": 3, '
+                      '"id": 3}\n\n', content)
+        self.assertIn('id: 4\n', content)
+
+    def test_removed_comments_are_published(self):
+        comment = XtdComment.objects.get(pk=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            broker.publish_comment_event(comment, 'removed')
+        data = json.loads(self.get_stream(last_event_id=2).content)
+        self.assertEqual(data['events'],
+                         [{'type': 'removed', 'comment': 2, 'id': 3}])
+
+    def test_invalid_content_type_returns_400(self):
+        request = request_factory.get(reverse('comments-xtd-api-stream'),
+                                      {'content_type': 'tests.nothing',
+                                       'object_pk': 1})
+        self.assertEqual(comment_stream(request).status_code, 400)
+
+
+class CommentStreamDisabledTestCase(TestCase):
+    def test_stream_is_not_found(self):
+        request = request_factory.get(reverse('comments-xtd-api-stream'),
+                                      {'content_type': 'tests.article',
+                                       'object_pk': 1})
+        with self.assertRaises(Http404):
+            comment_stream(request)
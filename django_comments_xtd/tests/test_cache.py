@@ -0,0 +1,99 @@
+from datetime import datetime
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.cache import caches
+from django.template import Context, Template
+from django.test import TestCase
+
+from django_comments_xtd import cache, views
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1, thread_test_step_2
+)
+from django_comments_xtd.tests.utils import request_factory
+
+
+@patch.multiple('django_comments_xtd.conf.settings',
+                COMMENTS_XTD_CACHE_ALIAS='default')
+class CacheTestCase(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        cache.reset_metrics()
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        self.article_ct = ContentType.objects.get_for_model(self.article)
+        thread_test_step_1(self.article)
+
+    def get_count(self):
+        return cache.get_or_set(
+            'count', self.article_ct.pk, self.article.pk, 1,
+            XtdComment.objects.filter(object_pk=self.article.pk).count)
+
+    def render_tree(self, user):
+        t = ("{% load comments_xtd %}"
+             "{% get_xtdcomment_tree for object as tree with_feedback %}"
+             "{% for item in tree %}{{ item.comment.pk }}:"
+             "{{ item.likedit_users|length }};{% endfor %}")
+        return Template(t).render(Context({'object': self.article,
+                                           'user': user}))
+
+    def test_get_or_set_computes_once(self):
+        self.assertEqual(self.get_count(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_count(), 2)
+        self.assertEqual(cache.get_metrics(),
+                         {'count': {'hits': 1, 'misses': 1}})
+
+    def test_invalidate_bumps_version(self):
+        version = cache.get_version(self.article_ct.pk, self.article.pk, 1)
+        cache.invalidate(self.article_ct.pk, self.article.pk, 1)
+        self.assertEqual(
+            cache.get_version(self.article_ct.pk, self.article.pk, 1),
+            version + 1)
+
+    def test_posting_a_comment_invalidates(self):
+        self.assertEqual(self.get_count(), 2)
+        thread_test_step_2(self.article)
+        self.assertEqual(self.get_count(), 4)
+
+    def test_removing_a_comment_invalidates(self):
+        self.assertEqual(self.render_tree(AnonymousUser()), "1:0;2:0;")
+        comment = XtdComment.objects.get(pk=2)
+        comment.is_public = False
+        comment.save()
+        self.assertEqual(self.render_tree(AnonymousUser()), "1:0;")
+
+    def test_feedback_invalidates(self):
+        user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        self.assertEqual(self.render_tree(user), "1:0;2:0;")
+        with self.assertNumQueries(0):
+            self.render_tree(user)
+        request = request_factory.post('/')
+        request.user = user
+        views.perform_like(request, XtdComment.objects.get(pk=1))
+        self.assertEqual(self.render_tree(user), "1:1;2:0;")
+        self.assertEqual(cache.get_metrics(),
+                         {'tree': {'hits': 1, 'misses': 2}})
+
+    def test_other_objects_are_not_invalidated(self):
+        article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        self.assertEqual(self.get_count(), 2)
+        XtdComment.objects.create(
+            content_type=self.article_ct, object_pk=article.pk,
+            content_object=article, site=Site.objects.get(pk=1),
+            comment="c1", submit_date=datetime.now())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_count(), 2)
+
+
+class CacheDisabledTestCase(TestCase):
+    def test_get_or_set_without_cache(self):
+        cache.reset_metrics()
+        self.assertIsNone(cache.get_cache())
+        self.assertEqual(cache.get_or_set('count', 1, 1, 1, lambda: 3), 3)
+        self.assertEqual(cache.get_metrics(), {})
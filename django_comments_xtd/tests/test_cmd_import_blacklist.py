@@ -0,0 +1,92 @@
+import gzip
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from django_comments_xtd import blacklist
+from django_comments_xtd.models import BlackListedDomain
+
+
+class ImportBlacklistCmdTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        # Reload the index in the thread of the test, that sees its rows.
+        patcher = patch.object(blacklist, '_run_in_background',
+                               lambda function, *args: function(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for domain in ["keep.com", "gone.com", "Keep.com"]:
+            BlackListedDomain.objects.create(domain=domain)
+        blacklist.invalidate()
+
+    def write_list(self, content, name="blacklist.txt"):
+        path = os.path.join(self.tmpdir, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt') as stream:
+            stream.write(content)
+        return path
+
+    def call(self, *args):
+        out = StringIO()
+        call_command('import_blacklist', *args, stdout=out)
+        return out.getvalue()
+
+    def domains(self):
+        return sorted(BlackListedDomain.objects
+                      .values_list('domain', flat=True))
+
+    def test_synchronizes_the_table_with_the_list(self):
+        path = self.write_list("# Spam domains\n"
+                               "keep.com\n"
+                               "NEW.com.\n"
+                               "*.wild.net  # all of it\n"
+                               "\n"
+                               "new.com\n"
+                               "not a domain\n")
+        out = self.call(path)
+        self.assertIn("Skipped 1 invalid domain(s).", out)
+        self.assertIn("Added 2 domain(s) and removed 2 domain(s).", out)
+        self.assertEqual(self.domains(), ["keep.com", "new.com", "wild.net"])
+
+    def test_gzip_csv_list(self):
+        path = self.write_list("domain,added\nkeep.com,2022-10-01\n"
+                               "new.com,2022-10-02\n", name="list.csv.gz")
+        self.call(path)
+        self.assertEqual(self.domains(), ["keep.com", "new.com"])
+
+    def test_keep_existing(self):
+        path = self.write_list("new.com\n")
+        out = self.call(path, '--keep-existing')
+        self.assertIn("Added 1 domain(s) and removed 1 domain(s).", out)
+        self.assertEqual(self.domains(), ["gone.com", "keep.com", "new.com"])
+
+    def test_dry_run(self):
+        path = self.write_list("keep.com\nnew.com\n")
+        out = self.call(path, '--dry-run')
+        self.assertIn("Would add 1 domain(s) and remove 2 domain(s).", out)
+        self.assertEqual(self.domains(), ["Keep.com", "gone.com", "keep.com"])
+
+    def test_applies_changes_in_batches(self):
+        path = self.write_list("".join("spam%d.com\n" % index
+                                       for index in range(5)))
+        # Read the table, a savepoint, two DELETEs (3 rows), three INSERTs
+        # (5 rows) and the release of the savepoint.
+        with self.assertNumQueries(1 + 1 + 2 + 3 + 1):
+            self.call(path, '--batch-size=2')
+
+    def test_reloads_the_index(self):
+        self.assertTrue(blacklist.is_blacklisted("gone.com"))
+        self.call(self.write_list("new.com\n"))
+        self.assertFalse(blacklist.is_blacklisted("gone.com"))
+        self.assertTrue(blacklist.is_blacklisted("mail.new.com"))
+
+    def test_missing_file(self):
+        with self.assertRaises(CommandError):
+            self.call(os.path.join(self.tmpdir, "missing.txt"))
@@ -0,0 +1,50 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1, thread_test_step_2, thread_test_step_3,
+    thread_test_step_4
+)
+
+
+class InitializeCommentPathsCmdTest(TestCase):
+    def setUp(self):
+        self.article_1 = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        self.paths = dict(XtdComment.objects.values_list('pk', 'path'))
+
+    def test_calling_command_computes_paths(self):
+        XtdComment.norel_objects.update(path=None)
+        out = StringIO()
+        call_command('initialize_comment_paths', '--threads-per-batch=1',
+                     stdout=out)
+        self.assertIn("Updated 7 XtdComment object(s).", out.getvalue())
+        self.assertEqual(dict(XtdComment.objects.values_list('pk', 'path')),
+                         self.paths)
+
+    def test_comments_with_missing_parent_have_no_path(self):
+        XtdComment.norel_objects.update(path=None)
+        XtdComment.norel_objects.filter(pk=7).update(parent_id=100)
+        call_command('initialize_comment_paths', stdout=StringIO())
+        self.assertIsNone(XtdComment.objects.get(pk=7).path)
+        self.assertEqual(XtdComment.objects.get(pk=4).path,
+                         self.paths[4])
+
+    def test_command_skips_failed_database(self):
+        out = StringIO()
+        method_ref = ('django_comments_xtd.management.commands'
+                      '.initialize_comment_paths.Command.initialize_paths')
+        with patch(method_ref) as mock_initialize_paths:
+            mock_initialize_paths.side_effect = ConnectionDoesNotExist
+            call_command('initialize_comment_paths', stdout=out)
+        self.assertIn("DB connection 'default' does not exist.", out.getvalue())
@@ -0,0 +1,51 @@
+from datetime import datetime
+from io import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase
+
+from django_comments_xtd.models import XtdComment, get_content_hash
+from django_comments_xtd.tests.models import Article
+
+
+class InitializeContentHashesCmdTest(TestCase):
+    def setUp(self):
+        article = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        for index in range(5):
+            XtdComment.objects.create(
+                content_type=ContentType.objects.get_for_model(article),
+                object_pk=article.pk, site_id=1, user_name="Bob",
+                user_email="bob@example.com", comment="Comment %d" % index,
+                submit_date=datetime(2022, 10, 26, 12, 30, index))
+        XtdComment.norel_objects.update(content_hash=None)
+
+    def test_calling_command_sets_the_hashes(self):
+        out = StringIO()
+        call_command('initialize_content_hashes', '--batch-size=2',
+                     stdout=out)
+        self.assertIn("Updated 5 XtdComment object(s).", out.getvalue())
+        for comment in XtdComment.objects.all():
+            self.assertEqual(comment.content_hash, get_content_hash(comment))
+
+    def test_duplicated_comments_are_left_without_hash(self):
+        XtdComment.norel_objects.filter(pk__in=[2, 4])\
+            .update(comment="Comment 0",
+                    submit_date=datetime(2022, 10, 26, 12, 30, 0))
+        XtdComment.norel_objects.filter(pk=4).update(
+            content_hash=get_content_hash(XtdComment.objects.get(pk=4)))
+        out = StringIO()
+        call_command('initialize_content_hashes', stdout=out)
+        self.assertIn("Updated 2 XtdComment object(s).", out.getvalue())
+        hashes = dict(XtdComment.norel_objects.values_list('pk',
+                                                           'content_hash'))
+        self.assertIsNone(hashes[1])
+        self.assertIsNone(hashes[2])
+        self.assertIsNotNone(hashes[4])
+
+    def test_command_is_idempotent(self):
+        call_command('initialize_content_hashes', stdout=StringIO())
+        out = StringIO()
+        call_command('initialize_content_hashes', stdout=out)
+        self.assertIn("Updated 0 XtdComment object(s).", out.getvalue())
@@ -0,0 +1,67 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.connection import ConnectionDoesNotExist
+
+from django_comments.models import CommentFlag
+
+from django_comments_xtd.models import (
+    XtdComment, LIKEDIT_FLAG, DISLIKEDIT_FLAG
+)
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1, thread_test_step_2
+)
+
+
+class InitializeFeedbackCountsCmdTest(TestCase):
+    def setUp(self):
+        self.article_1 = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        alice = User.objects.create_user("alice", "alice@example.com")
+        bob = User.objects.create_user("bob", "bob@example.com")
+        for user, pk, flag in [(alice, 1, LIKEDIT_FLAG),
+                               (bob, 1, LIKEDIT_FLAG),
+                               (bob, 3, DISLIKEDIT_FLAG),
+                               (bob, 3, CommentFlag.SUGGEST_REMOVAL),
+                               (bob, 4, CommentFlag.MODERATOR_APPROVAL)]:
+            CommentFlag.objects.create(user=user, flag=flag,
+                                       comment=XtdComment.objects.get(pk=pk))
+
+    def check_feedback_counts(self):
+        counts = {
+            pk: (likes, dislikes, flags)
+            for pk, likes, dislikes, flags in XtdComment.objects.values_list(
+                'pk', 'likedit_count', 'dislikedit_count', 'flagged_count')
+        }
+        self.assertEqual(counts, {1: (2, 0, 0), 2: (0, 0, 0),
+                                  3: (0, 1, 1), 4: (0, 0, 0)})
+
+    def test_calling_command_computes_feedback_counts(self):
+        XtdComment.norel_objects.update(likedit_count=5, flagged_count=1)
+        out = StringIO()
+        call_command('initialize_feedback_counts', stdout=out)
+        self.assertIn("Updated 4 XtdComment object(s).", out.getvalue())
+        self.check_feedback_counts()
+
+    def test_command_is_idempotent(self):
+        out = StringIO()
+        call_command('initialize_feedback_counts', stdout=out)
+        call_command('initialize_feedback_counts', stdout=out)
+        self.check_feedback_counts()
+
+    def test_command_skips_failed_database(self):
+        out = StringIO()
+        method_ref = ('django_comments_xtd.management.commands'
+                      '.initialize_feedback_counts.Command'
+                      '.initialize_feedback_counts')
+        with patch(method_ref) as mock_initialize_feedback_counts:
+            mock_initialize_feedback_counts.side_effect = \
+                ConnectionDoesNotExist
+            call_command('initialize_feedback_counts', stdout=out)
+        self.assertIn("DB connection 'default' does not exist.", out.getvalue())
@@ -1,3 +1,6 @@
+import json
+import os
+import tempfile
 from io import StringIO
 from unittest.mock import patch
 
@@ -61,6 +64,49 @@ class InitializeNesteCountCmdTest(TestCase):
         self.assertIn("Updated 9 XtdComment object(s).", out.getvalue())
         self.check_nested_count()
 
+    def test_command_processes_threads_in_batches(self):
+        XtdComment.norel_objects.update(nested_count=0)
+        out = StringIO()
+        call_command('initialize_nested_count', '--threads-per-batch=1',
+                     verbosity=2, stdout=out)
+        self.assertIn("Processed 5 comment(s) up to thread 1, ",
+                      out.getvalue())
+        self.assertIn("Processed 8 comment(s) up to thread 2, ",
+                      out.getvalue())
+        self.assertIn("Updated 9 XtdComment object(s).", out.getvalue())
+        self.check_nested_count()
+
+    def test_command_writes_only_changed_comments(self):
+        XtdComment.norel_objects.filter(pk=3).update(nested_count=0)
+        # Batches, lock the roots, read the rows, and a single UPDATE,
+        # plus the savepoint.
+        with self.assertNumQueries(6):
+            call_command('initialize_nested_count', stdout=StringIO())
+        self.check_nested_count()
+
+    def test_command_skips_threads_until_since(self):
+        XtdComment.norel_objects.update(nested_count=0)
+        out = StringIO()
+        call_command('initialize_nested_count', '--since=1', stdout=out)
+        self.assertIn("Updated 4 XtdComment object(s).", out.getvalue())
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 0)
+        self.assertEqual(XtdComment.objects.get(pk=2).nested_count, 2)
+
+    def test_command_resumes_from_checkpoint(self):
+        fd, checkpoint = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, checkpoint)
+        with open(checkpoint, 'w') as checkpoint_file:
+            json.dump({'default': 2}, checkpoint_file)
+        XtdComment.norel_objects.update(nested_count=0)
+        out = StringIO()
+        call_command('initialize_nested_count', '--checkpoint', checkpoint,
+                     '--threads-per-batch=1', stdout=out)
+        self.assertIn("Updated 1 XtdComment object(s).", out.getvalue())
+        self.assertEqual(XtdComment.objects.get(pk=2).nested_count, 0)
+        with open(checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file), {'default': 9})
+
     def test_command_skips_failed_database(self):
         out = StringIO()
         method_ref = ('django_comments_xtd.management.commands'
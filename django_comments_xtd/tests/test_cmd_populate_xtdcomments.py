@@ -0,0 +1,95 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.management import call_command
+from django.db.models.query import QuerySet
+from django.test import TestCase
+
+from django_comments.models import Comment
+
+from django_comments_xtd.models import XtdComment
+from django_comments_xtd.tests.models import Article
+
+
+class PopulateXtdCommentsCmdTest(TestCase):
+    def setUp(self):
+        article = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        for index in range(5):
+            Comment.objects.create(
+                content_type=ContentType.objects.get_for_model(article),
+                object_pk=article.pk, site=Site.objects.get_current(),
+                comment="Comment %d" % index)
+        self.pks = list(Comment.objects.order_by('pk')
+                        .values_list('pk', flat=True))
+
+    def test_calling_command_adds_comments_as_thread_roots(self):
+        out = StringIO()
+        call_command('populate_xtdcomments', '--batch-size=2', stdout=out)
+        self.assertIn("Added 5 XtdComment object(s).", out.getvalue())
+        comments = XtdComment.objects.order_by('pk')
+        self.assertEqual([c.pk for c in comments], self.pks)
+        for comment in comments:
+            self.assertEqual(comment.thread_id, comment.pk)
+            self.assertEqual(comment.parent_id, comment.pk)
+            self.assertEqual((comment.level, comment.order), (0, 1))
+            self.assertEqual(comment.nested_count, 0)
+            self.assertEqual(comment.path, '')
+            self.assertFalse(comment.followup)
+
+    def test_inserts_a_batch_per_query(self):
+        # The bounds of the ids, and a savepoint and INSERT per batch.
+        with self.assertNumQueries(2 + 3 * 3):
+            call_command('populate_xtdcomments', '--batch-size=2',
+                         stdout=StringIO())
+
+    def test_table_must_be_empty(self):
+        call_command('populate_xtdcomments', stdout=StringIO())
+        out = StringIO()
+        call_command('populate_xtdcomments', stdout=out)
+        self.assertIn("Table 'django_comments_xtd_xtdcomment' must be empty.",
+                      out.getvalue())
+
+    def test_failed_range_is_reported(self):
+        call_command('populate_xtdcomments', stdout=StringIO())
+        # The last comment is added by someone else after the table is
+        # found empty.
+        XtdComment.norel_objects.filter(pk__in=self.pks[:4])\
+                                .order_by()._raw_delete('default')
+        out = StringIO()
+        with patch.object(QuerySet, 'exists', return_value=False):
+            call_command('populate_xtdcomments', '--batch-size=2', stdout=out)
+        output = out.getvalue()
+        self.assertIn("Added 2 comment(s) up to id %d" % self.pks[1], output)
+        self.assertIn("Added 4 comment(s) up to id %d" % self.pks[3], output)
+        self.assertIn("Could not add the comments with ids from %d to %d "
+                      "to table 'django_comments_xtd_xtdcomment'" %
+                      (self.pks[4], self.pks[4]), output)
+        self.assertIn("--skip-existing", output)
+        self.assertIn("Added 4 XtdComment object(s).", output)
+        self.assertEqual(XtdComment.objects.count(), 5)
+
+    def test_skip_existing(self):
+        call_command('populate_xtdcomments', stdout=StringIO())
+        comment = Comment.objects.get(pk=self.pks[0])
+        for index in range(2):
+            comment.pk = None
+            comment.save()
+        out = StringIO()
+        call_command('populate_xtdcomments', '--skip-existing', stdout=out)
+        self.assertIn("Added 2 XtdComment object(s).", out.getvalue())
+        self.assertEqual(XtdComment.objects.count(), 7)
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('populate_xtdcomments', '--dry-run', stdout=out)
+        self.assertIn("Would add 5 XtdComment object(s).", out.getvalue())
+        self.assertEqual(XtdComment.objects.count(), 0)
+
+    def test_command_skips_failed_database(self):
+        out = StringIO()
+        call_command('populate_xtdcomments', 'missing', stdout=out)
+        self.assertIn("DB connection 'missing' does not exist.",
+                      out.getvalue())
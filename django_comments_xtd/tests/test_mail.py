@@ -0,0 +1,165 @@
+import threading
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+
+from django_comments_xtd import mail as xtd_mail
+from django_comments_xtd.utils import send_mail
+
+
+class CountingEmailBackend(EmailBackend):
+    """
+    Locmem email backend that counts the connections opened, records the
+    number of messages of every call, fails the first `failures` calls and
+    every call with a message whose subject is in `failing`, and makes
+    worker threads wait for the `gate` event before opening a connection,
+    setting `waiting` meanwhile.
+    """
+    connections = 0
+    calls = []
+    failures = 0
+    failing = set()
+    gate = threading.Event()
+    waiting = threading.Event()
+
+    def open(self):
+        if threading.current_thread() is not threading.main_thread():
+            CountingEmailBackend.waiting.set()
+            CountingEmailBackend.gate.wait(5)
+        CountingEmailBackend.connections += 1
+
+    def send_messages(self, messages):
+        CountingEmailBackend.calls.append(len(messages))
+        if CountingEmailBackend.failures:
+            CountingEmailBackend.failures -= 1
+            raise ConnectionError("Connection lost.")
+        if any(m.subject in CountingEmailBackend.failing for m in messages):
+            raise ValueError("Invalid message.")
+        return super().send_messages(messages)
+
+
+def make_messages(count):
+    return [EmailMessage("Subject %d" % index, "Body", "from@example.com",
+                         ["to%d@example.com" % index])
+            for index in range(count)]
+
+
+@override_settings(
+    EMAIL_BACKEND="django_comments_xtd.tests.test_mail.CountingEmailBackend")
+class MailBackendTestCase(TestCase):
+    def setUp(self):
+        CountingEmailBackend.connections = 0
+        CountingEmailBackend.calls = []
+        CountingEmailBackend.failures = 0
+        CountingEmailBackend.failing = set()
+        CountingEmailBackend.gate.set()
+        CountingEmailBackend.waiting.clear()
+
+    def test_sync_backend_uses_one_connection(self):
+        xtd_mail.SyncMailBackend().send_messages(make_messages(3))
+        self.assertEqual([m.subject for m in mail.outbox],
+                         ["Subject 0", "Subject 1", "Subject 2"])
+        self.assertEqual(CountingEmailBackend.connections, 1)
+        self.assertEqual(CountingEmailBackend.calls, [3])
+
+    def test_deliver_retries_failed_messages(self):
+        CountingEmailBackend.failures = 2
+        backend = xtd_mail.SyncMailBackend(retries=2, backoff=0)
+        backend.send_messages(make_messages(2))
+        self.assertEqual([m.subject for m in mail.outbox],
+                         ["Subject 0", "Subject 1"])
+        # The batch, then 2 attempts of the first message and the second.
+        self.assertEqual(CountingEmailBackend.calls, [2, 1, 1, 1])
+
+    def test_failing_message_does_not_block_the_others(self):
+        CountingEmailBackend.failing = {"Subject 1"}
+        backend = xtd_mail.SyncMailBackend(retries=1, backoff=0)
+        with self.assertRaises(ValueError):
+            backend.send_messages(make_messages(3))
+        self.assertEqual([m.subject for m in mail.outbox],
+                         ["Subject 0", "Subject 2"])
+        self.assertEqual(CountingEmailBackend.calls, [3, 1, 1, 1, 1])
+
+    def test_deliver_gives_up_after_retries(self):
+        CountingEmailBackend.failures = 2
+        backend = xtd_mail.SyncMailBackend(retries=1, backoff=0)
+        with self.assertRaises(ConnectionError):
+            backend.send_messages(make_messages(1))
+        CountingEmailBackend.failures = 2
+        backend.send_messages(make_messages(1), fail_silently=True)
+        self.assertEqual(mail.outbox, [])
+
+    def test_threaded_backend_delivers_in_batches(self):
+        CountingEmailBackend.gate.clear()
+        backend = xtd_mail.ThreadedMailBackend(workers=1, batch_size=10)
+        messages = make_messages(5)
+        backend.send_messages(messages[:1])
+        CountingEmailBackend.waiting.wait(5)
+        backend.send_messages(messages[1:])
+        CountingEmailBackend.gate.set()
+        backend.join()
+        self.assertEqual(len(mail.outbox), 5)
+        # The worker took the first message alone, and the rest in a batch.
+        self.assertEqual(CountingEmailBackend.connections, 2)
+
+    def test_threaded_backend_applies_fail_silently_per_message(self):
+        CountingEmailBackend.gate.clear()
+        CountingEmailBackend.failing = {"Subject 0", "Subject 1"}
+        backend = xtd_mail.ThreadedMailBackend(workers=1, retries=0)
+        messages = make_messages(4)
+        backend.send_messages(messages[3:])
+        CountingEmailBackend.waiting.wait(5)
+        with self.assertLogs('django_comments_xtd.mail', 'ERROR') as logs:
+            backend.send_messages(messages[:1], fail_silently=True)
+            backend.send_messages(messages[1:3])
+            CountingEmailBackend.gate.set()
+            backend.join()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("'Subject 1'", logs.records[0].getMessage())
+        self.assertEqual(sorted(m.subject for m in mail.outbox),
+                         ["Subject 2", "Subject 3"])
+
+    def test_threaded_backend_applies_back_pressure(self):
+        CountingEmailBackend.gate.clear()
+        backend = xtd_mail.ThreadedMailBackend(workers=1, queue_size=1,
+                                               block_timeout=0.01)
+        backend.send_messages(make_messages(1))
+        CountingEmailBackend.waiting.wait(5)
+        backend.send_messages(make_messages(3))
+        # The queue holds one message, the others are sent by the caller.
+        self.assertEqual(len(mail.outbox), 2)
+        CountingEmailBackend.gate.set()
+        backend.join()
+        self.assertEqual(len(mail.outbox), 4)
+
+
+class GetMailBackendTestCase(TestCase):
+    def setUp(self):
+        xtd_mail._backends.clear()
+        self.addCleanup(xtd_mail._backends.clear)
+
+    def test_threaded_emails_setting_picks_the_backend(self):
+        with patch.multiple('django_comments_xtd.conf.settings',
+                            COMMENTS_XTD_THREADED_EMAILS=False):
+            self.assertIsInstance(xtd_mail.get_mail_backend(),
+                                  xtd_mail.SyncMailBackend)
+        with patch.multiple('django_comments_xtd.conf.settings',
+                            COMMENTS_XTD_THREADED_EMAILS=True):
+            self.assertIsInstance(xtd_mail.get_mail_backend(),
+                                  xtd_mail.ThreadedMailBackend)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_MAIL_BACKEND=(
+                        "django_comments_xtd.mail.SyncMailBackend"),
+                    COMMENTS_XTD_MAIL_BACKEND_OPTIONS={"retries": 2})
+    def test_send_mail_uses_the_backend(self):
+        backend = xtd_mail.get_mail_backend()
+        self.assertEqual(backend.retries, 2)
+        send_mail("Subject", "Body", "from@example.com", ["to@example.com"],
+                  html="<p>Body</p>")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].alternatives,
+                         [("<p>Body</p>", "text/html")])
@@ -1,14 +1,34 @@
+from collections import defaultdict
+from io import StringIO
+import random
+import threading
+import time
 from unittest.mock import patch
 from datetime import datetime, timedelta
 
-from django.db.models.signals import pre_save
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.db import (IntegrityError, OperationalError, connection,
+                       transaction)
+from django.db.models.signals import post_save, pre_save
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
-from django.test import TestCase as DjangoTestCase
+from django.test import TestCase as DjangoTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_comments.models import CommentFlag
 
 from django_comments_xtd import get_model
+from django_comments_xtd.signals import (comment_was_removed,
+                                         comments_were_moderated)
 from django_comments_xtd.models import (XtdComment,
                                         MaxThreadLevelExceededException,
+                                        LIKEDIT_FLAG, DISLIKEDIT_FLAG,
+                                        get_comment_counts,
+                                        get_content_hash,
+                                        get_feedback_counts,
+                                        moderate_comments,
+                                        publish_or_unpublish_nested_comments,
                                         publish_or_unpublish_on_pre_save)
 from django_comments_xtd.tests.models import Article, Diary, MyComment
 
@@ -269,6 +289,26 @@ class BaseThreadStep1TestCase(ArticleBaseTestCase):
         self.assertTrue(self.c2.level == 0 and self.c2.order == 1)
         self.assertEqual(self.c2.nested_count, 0)
 
+    def test_root_comment_is_inserted_with_its_thread(self):
+        saved = []
+
+        def receiver(sender, instance, created, **kwargs):
+            saved.append((created, instance.thread_id, instance.parent_id))
+
+        post_save.connect(receiver, sender=XtdComment)
+        self.addCleanup(post_save.disconnect, receiver, sender=XtdComment)
+        # The two INSERTs, within a savepoint.
+        with self.assertNumQueries(4):
+            comment = XtdComment.objects.create(
+                content_type=ContentType.objects.get_for_model(Article),
+                object_pk=self.article_1.pk, site_id=1, comment="c3",
+                submit_date=datetime.now())
+        self.assertEqual(saved, [(True, comment.pk, comment.pk)])
+        self.assertEqual(
+            XtdComment.norel_objects.filter(pk=comment.pk)
+            .values_list('thread_id', 'parent_id').get(),
+            (comment.pk, comment.pk))
+
 
 class ThreadStep2TestCase(ArticleBaseTestCase):
     def setUp(self):
@@ -637,6 +677,162 @@ class PublishOrUnpublishNestedCommentsOneTestCase(ArticleBaseTestCase):
         self.assertFalse(cm4.is_removed)
 
 
+class PublishOrUnpublishQueriesTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super(PublishOrUnpublishQueriesTestCase, self).setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        # Thread 1: c1 -> (c3, c4), plus 20 replies to c3 and c4.
+        for index in range(20):
+            XtdComment.objects.create(
+                content_type=ContentType.objects.get_for_model(Article),
+                object_pk=self.article_1.pk, site_id=1,
+                comment="reply %d" % index, submit_date=datetime.now(),
+                parent_id=3 + index % 2)
+
+    def test_saving_without_visibility_changes(self):
+        comment = XtdComment.objects.get(pk=1)
+        comment.comment = "c1 edited"
+        # Only the updates of the comment.
+        with self.assertNumQueries(2):
+            comment.save()
+        comment.save()
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 22)
+        self.assertEqual(XtdComment.objects.filter(is_public=True).count(),
+                         24)
+
+    def test_unpublishing_a_thread_takes_a_fixed_number_of_queries(self):
+        comment = XtdComment.objects.get(pk=3)
+        comment.is_public = False
+        # Nested comments, ancestors and the updates of the comment.
+        with self.assertNumQueries(4):
+            comment.save()
+        self.assertEqual(XtdComment.objects.filter(is_public=False).count(),
+                         11)
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 12)
+        comment.is_public = True
+        comment.save()
+        self.assertEqual(XtdComment.objects.filter(is_public=False).count(),
+                         0)
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 22)
+
+    def test_unpublishing_a_thread_without_paths(self):
+        XtdComment.norel_objects.update(path=None)
+        comment = XtdComment.objects.get(pk=4)
+        comment.is_removed = True
+        # The ids of the ancestors are read before updating them.
+        with self.assertNumQueries(5):
+            comment.save()
+        self.assertEqual(XtdComment.objects.filter(is_public=False).count(),
+                         10)
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 12)
+        self.assertEqual(XtdComment.objects.get(pk=2).nested_count, 0)
+
+    def test_visibility_of_instances_not_loaded_from_db(self):
+        comment = XtdComment.objects.get(pk=4)
+        comment._was_public = None
+        comment.is_public = False
+        # The visibility in the DB is read first.
+        with self.assertNumQueries(5):
+            comment.save()
+        self.assertEqual(XtdComment.objects.filter(is_public=False).count(),
+                         11)
+
+
+class ModerateCommentsTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super(ModerateCommentsTestCase, self).setUp()
+        # Thread 1: c1 -> (c3, c4 -> c7), thread 2: c2 -> c5 -> c6.
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+
+    def get_state(self):
+        return list(XtdComment.objects.order_by('thread_id', 'order')
+                    .values_list('pk', 'is_public', 'is_removed',
+                                 'nested_count', 'pinned_at'))
+
+    def assert_same_as_one_by_one(self, pks, action, **fields):
+        with transaction.atomic():
+            moderate_comments(pks, action)
+            state = self.get_state()
+            transaction.set_rollback(True)
+        for pk in XtdComment.objects.filter(pk__in=pks)\
+                                    .order_by('thread_id', 'order')\
+                                    .values_list('pk', flat=True):
+            comment = XtdComment.objects.get(pk=pk)
+            for field, value in fields.items():
+                setattr(comment, field, value)
+            comment.save()
+        self.assertEqual(state, self.get_state())
+
+    def test_remove_nested_comments(self):
+        self.assert_same_as_one_by_one([1, 4, 5], 'remove', is_removed=True)
+        self.assertEqual(XtdComment.objects.get(pk=2).nested_count, 1)
+
+    def test_unpublish_and_publish_again(self):
+        self.assert_same_as_one_by_one([4, 2], 'unpublish', is_public=False)
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 2)
+        self.assert_same_as_one_by_one([4, 2], 'publish', is_public=True)
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 3)
+
+    def test_pin(self):
+        pks = [1, 2]
+        moderate_comments(pks, 'pin')
+        self.assertEqual(
+            XtdComment.objects.filter(pinned_at__isnull=False).count(), 2)
+        moderate_comments(pks, 'unpin')
+        self.assertFalse(
+            XtdComment.objects.filter(pinned_at__isnull=False).exists())
+
+    def test_query_count_does_not_depend_on_number_of_comments(self):
+        # Savepoint, comments, lock, threads, is_public, nested_count,
+        # updated_at, comments for the signals and release.
+        with self.assertNumQueries(9):
+            moderate_comments([3, 4, 5], 'unpublish')
+        self.assertEqual(
+            list(XtdComment.objects.filter(is_public=True)
+                 .order_by('pk').values_list('pk', 'nested_count')),
+            [(1, 2), (2, 1)])
+
+    def test_signal_per_comment(self):
+        removed = []
+
+        def receiver(sender, comment, **kwargs):
+            removed.append(comment.pk)
+
+        comment_was_removed.connect(receiver)
+        self.addCleanup(comment_was_removed.disconnect, receiver)
+        with self.captureOnCommitCallbacks(execute=True):
+            moderate_comments([4, 1, 1], 'remove')
+            # Signals are sent once the transaction is committed.
+            self.assertEqual(removed, [])
+        self.assertEqual(removed, [1, 4])
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_BULK_MODERATION_SIGNAL=True)
+    def test_batched_signal(self):
+        calls = []
+
+        def receiver(sender, action, comments, **kwargs):
+            calls.append((action, [comment.pk for comment in comments]))
+
+        comments_were_moderated.connect(receiver)
+        self.addCleanup(comments_were_moderated.disconnect, receiver)
+        with self.captureOnCommitCallbacks(execute=True):
+            moderate_comments([4, 1], 'remove')
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [('remove', [1, 4])])
+
+    def test_only_comments_of_the_site(self):
+        site2 = Site.objects.create(domain='site2.com', name='site2.com')
+        XtdComment.norel_objects.filter(pk=4).update(site=site2)
+        moderated = moderate_comments([1, 4], 'remove', site_id=1)
+        self.assertEqual([comment.pk for comment in moderated], [1])
+        self.assertFalse(XtdComment.objects.get(pk=4).is_removed)
+
+
 _model = "django_comments_xtd.tests.models.MyComment"
 
 
@@ -691,3 +887,407 @@ class PublishOrUnpublishNestedCommentsTwoTestCase(ArticleBaseTestCase):
         cm4 = MyComment.objects.get(pk=4)
         self.assertFalse(cm4.is_public)
         self.assertFalse(cm4.is_removed)
+
+
+class TreeFromQuerysetTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super(TreeFromQuerysetTestCase, self).setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+        thread_test_step_5(self.article_1)
+        thread_test_step_6(self.article_1)
+        self.user = AnonymousUser()
+
+    def as_pks(self, dic_list):
+        return [(item['comment'].pk, self.as_pks(item['children']))
+                for item in dic_list]
+
+    def test_tree_from_queryset(self):
+        tree = XtdComment.tree_from_queryset(XtdComment.objects.all(),
+                                             user=self.user)
+        self.assertEqual(self.as_pks(tree), [
+            (1, [(3, [(8, [(11, [])])]),
+                 (4, [(7, [(10, [])])])]),
+            (2, [(5, [(6, [])])]),
+            (9, [])
+        ])
+
+    def test_tree_from_queryset_in_any_order(self):
+        qs = XtdComment.objects.order_by('-submit_date', '-pk')
+        tree = XtdComment.tree_from_queryset(qs, user=self.user)
+        self.assertEqual(self.as_pks(tree), [
+            (9, []),
+            (2, [(5, [(6, [])])]),
+            (1, [(4, [(7, [(10, [])])]),
+                 (3, [(8, [(11, [])])])]),
+        ])
+
+    def test_tree_from_queryset_leaves_out_orphan_replies(self):
+        qs = XtdComment.objects.exclude(pk=4)
+        tree = XtdComment.tree_from_queryset(qs, user=self.user)
+        self.assertEqual(self.as_pks(tree), [
+            (1, [(3, [(8, [(11, [])])])]),
+            (2, [(5, [(6, [])])]),
+            (9, [])
+        ])
+
+    def test_tree_from_queryset_with_deep_thread(self):
+        # A single thread 500 levels deep is built without recursion.
+        article_ct = ContentType.objects.get(app_label="tests", model="article")
+        comments = []
+        for pk in range(1000, 1500):
+            comments.append(XtdComment(
+                id=pk, comment_ptr_id=pk, content_type=article_ct,
+                object_pk=self.article_2.pk, thread_id=1000,
+                parent_id=max(pk - 1, 1000),
+                level=pk - 1000, order=pk - 999))
+        tree = XtdComment.tree_from_queryset(comments, user=self.user)
+        self.assertEqual(len(tree), 1)
+        depth, node = 1, tree[0]
+        while node['children']:
+            self.assertEqual(len(node['children']), 1)
+            depth, node = depth + 1, node['children'][0]
+        self.assertEqual(depth, 500)
+
+    def test_tree_from_queryset_with_max_replies(self):
+        tree = XtdComment.tree_from_queryset(XtdComment.objects.all(),
+                                             user=self.user, max_replies=2)
+        self.assertEqual(self.as_pks(tree), [
+            (1, [(3, [(8, [])])]),
+            (2, [(5, [(6, [])])]),
+            (9, [])
+        ])
+        remaining = {}
+        stack = list(tree)
+        while stack:
+            node = stack.pop()
+            remaining[node['comment'].pk] = node['remaining_count']
+            stack.extend(node['children'])
+        self.assertEqual(remaining, {1: 4, 3: 1, 8: 1, 2: 0, 5: 0, 6: 0, 9: 0})
+
+    def test_get_descendants(self):
+        def descendants(pk):
+            comment = XtdComment.objects.get(pk=pk)
+            with self.assertNumQueries(1):
+                return [cm.pk for cm in comment.get_descendants()]
+        self.assertEqual(descendants(1), [3, 8, 11, 4, 7, 10])
+        self.assertEqual(descendants(4), [7, 10])
+        self.assertEqual(descendants(2), [5, 6])
+        self.assertEqual(descendants(9), [])
+
+    def test_get_descendants_without_path(self):
+        XtdComment.norel_objects.update(path=None)
+        comment = XtdComment.objects.get(pk=1)
+        self.assertEqual([cm.pk for cm in comment.get_descendants()],
+                         [3, 8, 11, 4, 7, 10])
+
+
+class CommentPathTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super(CommentPathTestCase, self).setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+
+    def test_path_is_set_on_insert(self):
+        # Thread 1: c1 -> (c3, c4 -> c7), thread 2: c2 -> c5 -> c6.
+        paths = dict(XtdComment.objects.values_list('pk', 'path'))
+        self.assertEqual(paths[1], '')
+        self.assertEqual(paths[4], '0000000001')
+        self.assertEqual(paths[7], '00000000010000000004')
+        self.assertEqual(XtdComment.objects.get(pk=6).get_ancestor_ids(),
+                         [2, 5])
+
+    def test_reply_to_comment_without_path(self):
+        XtdComment.norel_objects.filter(thread_id=1).update(path=None)
+        XtdComment.objects.create(
+            content_type=ContentType.objects.get_for_model(Article),
+            object_pk=self.article_1.pk, site_id=1, comment="reply to c4",
+            submit_date=datetime.now(), parent_id=4)
+        self.assertIsNone(XtdComment.objects.get(pk=8).path)
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 4)
+        self.assertEqual(XtdComment.objects.get(pk=4).nested_count, 2)
+
+    def test_unpublishing_updates_the_subtree_in_one_query(self):
+        comment = XtdComment.objects.get(pk=4)
+        # One update for the subtree and one for the ancestors.
+        with self.assertNumQueries(2):
+            publish_or_unpublish_nested_comments(comment, are_public=False)
+        self.assertFalse(XtdComment.objects.get(pk=7).is_public)
+        self.assertTrue(XtdComment.objects.get(pk=3).is_public)
+        self.assertEqual(XtdComment.objects.get(pk=1).nested_count, 2)
+        self.assertEqual(XtdComment.objects.get(pk=2).nested_count, 2)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_MAX_THREAD_LEVEL=40)
+    def test_thread_deeper_than_the_path(self):
+        # Paths of replies beyond level 25 don't fit in the field.
+        article_ct = ContentType.objects.get_for_model(Article)
+        root = parent = XtdComment.objects.create(
+            content_type=article_ct, object_pk=self.article_2.pk, site_id=1,
+            comment="root", submit_date=datetime.now())
+        for level in range(1, 30):
+            parent = XtdComment.objects.create(
+                content_type=article_ct, object_pk=self.article_2.pk,
+                site_id=1, comment="level %d" % level,
+                submit_date=datetime.now(), parent_id=parent.pk)
+        self.assertIsNone(parent.path)
+        root.refresh_from_db()
+        self.assertEqual(root.nested_count, 29)
+        self.assertEqual(root.get_descendants().count(), 29)
+        root.is_public = False
+        root.save()
+        self.assertFalse(XtdComment.objects.filter(
+            thread_id=root.pk, is_public=True).exists())
+
+
+class ContentHashTestCase(ArticleBaseTestCase):
+    def create_comment(self, **kwargs):
+        fields = dict(
+            content_type=ContentType.objects.get_for_model(Article),
+            object_pk=self.article_1.pk, site_id=1, comment="Comment",
+            user_name="Bob", user_email="bob@example.com", followup=True,
+            submit_date=datetime(2022, 10, 26, 12, 30, 15, 123456))
+        fields.update(kwargs)
+        return XtdComment.objects.create(**fields)
+
+    def test_content_hash_is_set_on_insert(self):
+        comment = self.create_comment()
+        self.assertEqual(comment.content_hash, get_content_hash(comment))
+        other = self.create_comment(followup=False)
+        self.assertNotEqual(other.content_hash, comment.content_hash)
+
+    def test_content_hash_covers_the_target_and_the_comment(self):
+        # The same user may post, at once, other comments or to other objects.
+        site2 = Site.objects.create(domain='site2.com', name='site2.com')
+        comment = self.create_comment()
+        others = [self.create_comment(comment="Another comment"),
+                  self.create_comment(object_pk=self.article_2.pk),
+                  self.create_comment(site_id=site2.pk)]
+        hashes = {comment.content_hash} | {c.content_hash for c in others}
+        self.assertEqual(len(hashes), 4)
+
+    def test_content_hash_is_unique(self):
+        self.create_comment()
+        with self.assertRaises(IntegrityError):
+            self.create_comment()
+
+
+class FeedbackCountsTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super(FeedbackCountsTestCase, self).setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        self.alice = User.objects.create_user("alice", "alice@example.com")
+        self.bob = User.objects.create_user("bob", "bob@example.com")
+        for user, pk, flag in [(self.alice, 1, LIKEDIT_FLAG),
+                               (self.bob, 1, LIKEDIT_FLAG),
+                               (self.bob, 3, DISLIKEDIT_FLAG),
+                               (self.bob, 3, CommentFlag.SUGGEST_REMOVAL)]:
+            CommentFlag.objects.create(user=user, flag=flag,
+                                       comment=XtdComment.objects.get(pk=pk))
+        call_command('initialize_feedback_counts', stdout=StringIO())
+
+    def test_get_feedback_counts(self):
+        with self.assertNumQueries(2):
+            counts = get_feedback_counts(XtdComment.objects.all(), self.bob)
+        self.assertEqual(counts[1], {
+            'likedit_count': 2, 'dislikedit_count': 0, 'flagged_count': 0,
+            'likedit': True, 'dislikedit': False, 'user_flagged': False})
+        self.assertEqual(counts[3], {
+            'likedit_count': 0, 'dislikedit_count': 1, 'flagged_count': 1,
+            'likedit': False, 'dislikedit': True, 'user_flagged': True})
+        self.assertEqual(counts[2]['likedit_count'], 0)
+
+    def test_get_feedback_counts_for_anonymous_user(self):
+        with self.assertNumQueries(1):
+            counts = get_feedback_counts([1, 2, 3, 4], AnonymousUser())
+        self.assertEqual(counts[1]['likedit_count'], 2)
+        self.assertFalse(counts[1]['likedit'])
+
+    def test_tree_from_queryset_counts_only(self):
+        qs = XtdComment.objects.all()
+        # 2 queries for the user permissions, 1 for the user's own flags
+        # and 1 for the comments, regardless of the amount of flags.
+        with self.assertNumQueries(4):
+            tree = XtdComment.tree_from_queryset(qs, with_feedback=True,
+                                                 with_flagging=True,
+                                                 user=self.alice,
+                                                 counts_only=True)
+        c1, c3 = tree[0], tree[0]['children'][0]
+        self.assertEqual(c1['likedit_count'], 2)
+        self.assertTrue(c1['likedit'])
+        self.assertNotIn('likedit_users', c1)
+        self.assertEqual(c3['dislikedit_count'], 1)
+        self.assertFalse(c3['user_flagged'])
+        # Only moderators get the flagged_count.
+        self.assertNotIn('flagged_count', c3)
+
+
+class CommentCountsTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super(CommentCountsTestCase, self).setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_1(self.article_2)
+        comment = XtdComment.objects.get(pk=5)
+        comment.is_public = False
+        comment.save()
+        self.diary = Diary.objects.create(body="About Today...")
+
+    def test_get_comment_counts(self):
+        article_ct = ContentType.objects.get_for_model(Article)
+        diary_ct = ContentType.objects.get_for_model(Diary)
+        with self.assertNumQueries(1):
+            counts = get_comment_counts([self.article_1, self.article_2,
+                                         (diary_ct, self.diary.pk),
+                                         ("tests.article", 99)],
+                                        site_id=1)
+        self.assertEqual(counts, {(article_ct.pk, str(self.article_1.pk)): 4,
+                                  (article_ct.pk, str(self.article_2.pk)): 1,
+                                  (diary_ct.pk, str(self.diary.pk)): 0,
+                                  (article_ct.pk, "99"): 0})
+
+    def test_get_comment_counts_of_no_objects(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_comment_counts([]), {})
+
+    def test_with_comment_counts(self):
+        with self.assertNumQueries(1):
+            counts = [(article.pk, article.comment_count)
+                      for article in Article.objects.with_comment_counts(1)]
+        self.assertEqual(sorted(counts), [(self.article_1.pk, 4),
+                                          (self.article_2.pk, 1)])
+
+
+def assert_thread_is_consistent(test_case, thread_id):
+    """
+    Check the order, level, nested_count and path of the comments of a
+    thread against the tree made by their parent_id.
+    """
+    comments = list(XtdComment.norel_objects.filter(thread_id=thread_id)
+                    .order_by('order'))
+    test_case.assertEqual([cm.order for cm in comments],
+                          list(range(1, len(comments) + 1)))
+    children = defaultdict(list)
+    for cm in comments[1:]:
+        children[cm.parent_id].append(cm)
+    preorder = []
+
+    def walk(comment, level, path):
+        preorder.append(comment.pk)
+        test_case.assertEqual(comment.level, level)
+        test_case.assertEqual(comment.path, path)
+        nested_count = 0
+        for child in children[comment.pk]:
+            nested_count += 1 + walk(child, level + 1,
+                                     '%s%010d' % (path, comment.pk))
+        test_case.assertEqual(comment.nested_count, nested_count)
+        return nested_count
+
+    walk(comments[0], 0, '')
+    test_case.assertEqual(preorder, [cm.pk for cm in comments])
+
+
+class ReplyQueriesTestCase(ArticleBaseTestCase):
+    def setUp(self):
+        super(ReplyQueriesTestCase, self).setUp()
+        thread_test_step_1(self.article_1)
+        thread_test_step_2(self.article_1)
+        thread_test_step_3(self.article_1)
+        thread_test_step_4(self.article_1)
+
+    def test_reply_takes_a_fixed_number_of_queries(self):
+        # Savepoint, thread, lock, parent, orders, ancestors, 2 inserts,
+        # release of the savepoint, and the shift of the orders of the
+        # comments after the reply unless it goes at the end of the thread,
+        # whatever the level of the parent.
+        for parent_id, queries in [(1, 9), (3, 10), (6, 9)]:
+            with self.assertNumQueries(queries):
+                XtdComment.objects.create(
+                    content_type=ContentType.objects.get_for_model(Article),
+                    object_pk=self.article_1.pk, site_id=1,
+                    comment="reply to %d" % parent_id,
+                    submit_date=datetime.now(), parent_id=parent_id)
+        assert_thread_is_consistent(self, 1)
+        assert_thread_is_consistent(self, 2)
+
+    def test_updates_do_not_select_from_the_updated_table(self):
+        # MySQL rejects an UPDATE with a subquery on the same table.
+        XtdComment.norel_objects.update(path=None)
+        nested_counts = dict(XtdComment.norel_objects.filter(pk__in=[1, 4, 7])
+                             .values_list('pk', 'nested_count'))
+        with CaptureQueriesContext(connection) as ctx:
+            XtdComment.objects.create(
+                content_type=ContentType.objects.get_for_model(Article),
+                object_pk=self.article_1.pk, site_id=1, comment="reply",
+                submit_date=datetime.now(), parent_id=7)
+        updates = [query['sql'] for query in ctx.captured_queries
+                   if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)  # Lock and ancestors.
+        for sql in updates:
+            self.assertNotIn('SELECT', sql)
+        self.assertEqual(
+            dict(XtdComment.norel_objects.filter(pk__in=[1, 4, 7])
+                 .values_list('pk', 'nested_count')),
+            {pk: count + 1 for pk, count in nested_counts.items()})
+
+
+class ConcurrentRepliesTestCase(TransactionTestCase):
+    """
+    Post replies to the comments of one thread from many threads at once,
+    and check the thread data afterwards. It runs with any database that
+    supports concurrent connections, ie: SQLite or PostgreSQL.
+    """
+    threads = 4
+    replies_per_thread = 10
+
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        self.article_ct = ContentType.objects.get_for_model(Article)
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+        thread_test_step_3(self.article)
+        thread_test_step_4(self.article)
+
+    def post_replies(self, seed, errors):
+        rnd = random.Random(seed)
+        try:
+            for index in range(self.replies_per_thread):
+                # Comments 1, 3 and 4 are in the thread 1, up to level 1.
+                parent_id = rnd.choice([1, 3, 4])
+                for attempt in range(100):
+                    try:
+                        XtdComment.objects.create(
+                            content_type=self.article_ct,
+                            object_pk=self.article.pk, site_id=1,
+                            comment="reply %d-%d" % (seed, index),
+                            submit_date=datetime.now(), parent_id=parent_id)
+                        break
+                    except OperationalError:  # Database locked, retry.
+                        time.sleep(rnd.random() / 100)
+                else:
+                    errors.append("Reply %d-%d not posted" % (seed, index))
+        except Exception as exc:
+            errors.append(repr(exc))
+        finally:
+            connection.close()
+
+    def test_concurrent_replies_to_one_thread(self):
+        errors = []
+        workers = [threading.Thread(target=self.post_replies,
+                                    args=(seed, errors))
+                   for seed in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            XtdComment.norel_objects.filter(thread_id=1).count(),
+            4 + self.threads * self.replies_per_thread)
+        assert_thread_is_consistent(self, 1)
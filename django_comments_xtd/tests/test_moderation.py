@@ -2,19 +2,27 @@ from __future__ import unicode_literals
 
 import re
 
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from datetime import datetime, timedelta
 
 from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase, RequestFactory
 from django.urls import reverse
 
 from django_comments.models import CommentFlag
 
 from django_comments_xtd import django_comments, views
-from django_comments_xtd.models import LIKEDIT_FLAG, DISLIKEDIT_FLAG
-from django_comments_xtd.tests.models import Diary
+from django_comments_xtd.models import (LIKEDIT_FLAG, DISLIKEDIT_FLAG,
+                                        XtdComment)
+from django_comments_xtd.moderation import (
+    moderator, review_comment, ThreadedReviewRunner, XtdCommentModerator
+)
+from django_comments_xtd.signals import (comment_was_removed,
+                                         comment_was_updated)
+from django_comments_xtd.tests.models import Article, Diary
 from django_comments_xtd.tests.test_views import (confirm_comment_url,
+                                                  post_article_comment,
                                                   post_diary_comment)
 
 
@@ -356,3 +364,104 @@ class FlaggingLikedItAndDislikedIt(TestCase):
                                            user=self.user,
                                            flag=DISLIKEDIT_FLAG)
         self.assertTrue(flags.count() == 1)
+
+
+class ReviewModerator(XtdCommentModerator):
+    review_comments = True
+    outcome = 'publish'
+
+    def review(self, comment, content_object):
+        ReviewModerator.reviewed.append(comment.pk)
+        return ReviewModerator.outcome
+
+
+@patch.multiple('django_comments_xtd.conf.settings',
+                COMMENTS_XTD_REVIEW_RUNNER=(
+                    "django_comments_xtd.moderation.SyncReviewRunner"))
+class ModeratorReviewsComment(TestCase):
+    def setUp(self):
+        patcher = patch('django_comments_xtd.views.send_mail')
+        self.mailer = patcher.start()
+        self.addCleanup(patcher.stop)
+        moderator.register(Article, ReviewModerator)
+        self.addCleanup(moderator.unregister, Article)
+        ReviewModerator.outcome = 'publish'
+        ReviewModerator.reviewed = []
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        self.form = django_comments.get_form()(self.article)
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+
+    def post_valid_data(self, auth_user=None, followup=False):
+        data = {"name": "Bob", "email": "bob@example.com",
+                "followup": followup, "reply_to": 0, "level": 1, "order": 1,
+                "comment": "Es war einmal eine kleine..."}
+        data.update(self.form.initial)
+        with self.captureOnCommitCallbacks(execute=True):
+            post_article_comment(data, self.article, auth_user=auth_user)
+        return XtdComment.objects.filter(user_email="bob@example.com").first()
+
+    def test_comment_is_published_after_review(self):
+        handler = Mock()
+        comment_was_updated.connect(handler)
+        self.addCleanup(comment_was_updated.disconnect, handler)
+        comment = self.post_valid_data(self.user)
+        self.assertEqual(ReviewModerator.reviewed, [comment.pk])
+        self.assertTrue(comment.is_public)
+        self.assertEqual(handler.call_count, 1)
+
+    def test_followers_are_notified_after_review(self):
+        Comment = django_comments.get_model()
+        Comment.objects.create(
+            content_type=ContentType.objects.get_for_model(self.article),
+            object_pk=self.article.pk, site_id=1, user_name="Alice",
+            user_email="alice@example.com", followup=True,
+            comment="Once upon a time...")
+        ReviewModerator.outcome = None
+        self.post_valid_data(self.user)
+        self.assertEqual(self.mailer.call_count, 0)
+        ReviewModerator.outcome = 'publish'
+        review_comment(XtdComment.objects.get(user_email="bob@example.com").pk)
+        self.assertEqual(self.mailer.call_count, 1)
+        self.assertEqual(self.mailer.call_args[0][3], ["alice@example.com"])
+
+    def test_comment_is_removed_after_review(self):
+        handler = Mock()
+        comment_was_removed.connect(handler)
+        self.addCleanup(comment_was_removed.disconnect, handler)
+        ReviewModerator.outcome = 'remove'
+        comment = self.post_valid_data(self.user)
+        self.assertFalse(comment.is_public)
+        self.assertTrue(comment.is_removed)
+        self.assertEqual(handler.call_count, 1)
+
+    def test_comment_is_left_to_moderators(self):
+        ReviewModerator.outcome = None
+        comment = self.post_valid_data(self.user)
+        self.assertEqual(ReviewModerator.reviewed, [comment.pk])
+        self.assertFalse(comment.is_public)
+        self.assertFalse(comment.is_removed)
+
+    def test_comment_is_reviewed_on_confirmation(self):
+        self.post_valid_data()
+        self.assertEqual(ReviewModerator.reviewed, [])
+        key = str(re.search(r'http://.+/confirm/(?P<key>\S+)/',
+                            self.mailer.call_args[0][1]).group("key"))
+        with self.captureOnCommitCallbacks(execute=True):
+            confirm_comment_url(key)
+        comment = XtdComment.objects.get()
+        self.assertEqual(ReviewModerator.reviewed, [comment.pk])
+        self.assertTrue(comment.is_public)
+
+    def test_comment_held_by_moderate_is_not_reviewed(self):
+        with patch.object(ReviewModerator, 'moderate', return_value=True):
+            comment = self.post_valid_data(self.user)
+        self.assertEqual(ReviewModerator.reviewed, [])
+        self.assertFalse(comment.is_public)
+
+    def test_threaded_review_runner(self):
+        runner = ThreadedReviewRunner(workers=1)
+        with patch('django_comments_xtd.moderation.review_comment') as review:
+            runner.submit(7)
+            runner.executor.shutdown(wait=True)
+        review.assert_called_once_with(7)
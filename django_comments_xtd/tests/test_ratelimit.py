@@ -0,0 +1,143 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import force_authenticate
+
+from django_comments_xtd import django_comments, ratelimit
+from django_comments_xtd.api.views import ToggleFeedbackFlag
+from django_comments_xtd.tests.models import Article
+from django_comments_xtd.tests.utils import post_comment, request_factory
+
+
+class TokenBucketTestCase(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate("5/min"), (5, 60))
+        self.assertEqual(ratelimit.parse_rate("100/day"), (100, 86400))
+
+    def check_backend(self, backend):
+        with patch.object(ratelimit.time, 'time', return_value=1000.0):
+            self.assertEqual(backend.consume("key", 2, 60), 0)
+            self.assertEqual(backend.consume("key", 2, 60), 0)
+            self.assertEqual(backend.consume("key", 2, 60), 30)
+            self.assertEqual(backend.consume("other", 2, 60), 0)
+        # A token is given back every 30 seconds.
+        with patch.object(ratelimit.time, 'time', return_value=1020.0):
+            self.assertAlmostEqual(backend.consume("key", 2, 60), 10)
+        with patch.object(ratelimit.time, 'time', return_value=1030.0):
+            self.assertEqual(backend.consume("key", 2, 60), 0)
+            self.assertEqual(backend.consume("key", 2, 60), 30)
+
+    def check_limited_requests_take_no_tokens(self, backend):
+        user, ip_1, ip_2 = ("user", 2, 60), ("ip-1", 1, 60), ("ip-2", 1, 60)
+        with patch.object(ratelimit.time, 'time', return_value=1000.0):
+            self.assertEqual(backend.consume_all([user, ip_1]), 0)
+            # The ip denies it, the user keeps its last token.
+            self.assertEqual(backend.consume_all([user, ip_1]), 60)
+            self.assertEqual(backend.consume_all([user, ip_2]), 0)
+            self.assertEqual(backend.consume_all([user, ("ip-3", 1, 60)]),
+                             30)
+            self.assertEqual(backend.consume(*ip_2), 60)
+
+    def test_locmem_backend(self):
+        self.check_backend(ratelimit.LocMemRateLimitBackend())
+        self.check_limited_requests_take_no_tokens(
+            ratelimit.LocMemRateLimitBackend())
+
+    def test_cache_backend(self):
+        self.check_backend(ratelimit.CacheRateLimitBackend())
+        caches['default'].clear()
+        self.check_limited_requests_take_no_tokens(
+            ratelimit.CacheRateLimitBackend())
+
+
+class RateLimitedEndpointsTestCase(TestCase):
+    def setUp(self):
+        for patcher in [
+            patch('django_comments_xtd.views.send_mail'),
+            patch.multiple('django_comments_xtd.conf.settings',
+                           COMMENTS_XTD_RATE_LIMIT_BACKEND=(
+                               "django_comments_xtd.ratelimit."
+                               "LocMemRateLimitBackend")),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        ratelimit.get_backend().clear()
+        ratelimit.reset_metrics()
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        self.form = django_comments.get_form()(self.article)
+
+    def post_comment(self, **data):
+        data.update({"name": "Bob", "email": "bob@example.com",
+                     "followup": True, "reply_to": 0, "level": 1,
+                     "order": 1, "comment": "Es war einmal eine kleine...",
+                     "honeypot": ""})
+        data.update(self.form.initial)
+        return post_comment(data)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_RATE_LIMITS={"comment": {"ip": "1/min"}})
+    def test_comments_are_limited_before_any_query(self):
+        self.assertEqual(self.post_comment().status_code, 204)
+        with self.assertNumQueries(0):
+            response = self.post_comment()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], "60")
+        self.assertEqual(ratelimit.get_metrics(),
+                         {'comment': {'allowed': 1, 'limited': 1}})
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_RATE_LIMITS={
+                        "comment": {"object": "1/min"}})
+    def test_comments_are_limited_per_object(self):
+        other = Article.objects.create(
+            title="November", slug="november", body="What I did...")
+        self.assertEqual(self.post_comment().status_code, 204)
+        self.form = django_comments.get_form()(other)
+        self.assertEqual(self.post_comment().status_code, 204)
+        self.assertEqual(self.post_comment().status_code, 429)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_RATE_LIMITS={"feedback": {"user": "1/hour"}})
+    def test_feedback_is_limited_per_user(self):
+        bob = User.objects.create_user("bob", "bob@example.com", "pwd")
+        alice = User.objects.create_user("alice", "alice@example.com", "pwd")
+        view = ToggleFeedbackFlag.as_view()
+
+        def send_feedback(user):
+            request = request_factory.post(
+                reverse('comments-xtd-api-feedback'),
+                {"comment": 1, "flag": "like"})
+            force_authenticate(request, user=user)
+            return view(request)
+
+        # The comment doesn't exist, but the request is not limited.
+        self.assertEqual(send_feedback(bob).status_code, 400)
+        response = send_feedback(bob)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], "3600")
+        self.assertEqual(send_feedback(alice).status_code, 400)
+
+    @patch.multiple('django_comments_xtd.conf.settings',
+                    COMMENTS_XTD_RATE_LIMITS={
+                        "comment": {"ip": "2/min", "object": "1/min"}})
+    def test_limited_comments_take_no_tokens(self):
+        other = Article.objects.create(
+            title="November", slug="november", body="What I did...")
+        self.assertEqual(self.post_comment().status_code, 204)
+        # Limited by the object, the ip keeps a token for another object.
+        self.assertEqual(self.post_comment().status_code, 429)
+        self.assertEqual(self.post_comment().status_code, 429)
+        self.form = django_comments.get_form()(other)
+        self.assertEqual(self.post_comment().status_code, 204)
+
+    def test_no_limits_by_default(self):
+        for _ in range(3):
+            self.assertEqual(self.post_comment().status_code, 204)
+        self.assertEqual(ratelimit.get_metrics(), {})
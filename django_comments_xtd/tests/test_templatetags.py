@@ -1,7 +1,8 @@
-from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import AnonymousUser, User
 from django.template import Context, Template
-from django.test import TestCase as DjangoTestCase
+from django.test import RequestFactory, TestCase as DjangoTestCase
 
+from django_comments_xtd import views
 from django_comments_xtd.models import XtdComment
 from django_comments_xtd.tests.models import Article, Diary
 from django_comments_xtd.tests.test_models import (
@@ -33,6 +34,20 @@ class GetXtdCommentCountTestCase(DjangoTestCase):
              "{{ varname }}")
         self.assertEqual(Template(t).render(Context()), '3')
 
+    def test_get_xtdcomment_counts_for_object_list(self):
+        thread_test_step_1(self.article_1)
+        add_comment_to_diary_entry(self.day_in_diary)
+        t = ("{% load comments_xtd %}"
+             "{% get_xtdcomment_counts for object_list as counts %}"
+             "{% for object in object_list %}"
+             "{{ counts|xtdcomment_count:object }};"
+             "{% endfor %}")
+        object_list = [self.article_1, self.article_2, self.day_in_diary]
+        # One query for the current site and one for the counts.
+        with self.assertNumQueries(2):
+            output = Template(t).render(Context({'object_list': object_list}))
+        self.assertEqual(output, '2;0;1;')
+
 
 class LastXtdCommentsTestCase(DjangoTestCase):
     def setUp(self):
@@ -162,3 +177,36 @@ class XtdCommentsTestCase(DjangoTestCase):
         # all the nested comments.
         c1.save()
         self._assert_all_comments_are_published()
+
+
+class GetXtdCommentTreeCountsOnlyTestCase(DjangoTestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+        self.user = User.objects.create_user("bob", "bob@example.com")
+        request = RequestFactory().post('/')
+        request.user = self.user
+        views.perform_like(request, XtdComment.objects.get(pk=3))
+
+    def test_get_xtdcomment_tree_with_feedback_counts_only(self):
+        t = ("{% load comments_xtd %}"
+             "{% get_xtdcomment_tree for object as tree"
+             "   with_feedback counts_only %}"
+             "{% for item in tree.0.children %}"
+             "{{ item.comment.pk }}:{{ item.likedit_count }}:{{ item.likedit }}"
+             "{{ item.likedit_users|length }};"
+             "{% endfor %}")
+        output = Template(t).render(Context({'object': self.article,
+                                             'user': self.user}))
+        self.assertEqual(output, "3:1:True0;4:0:False0;")
+
+    def test_render_xtdcomment_tree_counts_only(self):
+        t = ("{% load comments_xtd %}"
+             "{% render_xtdcomment_tree for object allow_feedback"
+             "   show_feedback counts_only %}")
+        output = Template(t).render(Context({'object': self.article,
+                                             'user': self.user}))
+        self.assertEqual(output.count('<a id='), 4)
+        self.assertEqual(output.count('cfb-counter'), 1)
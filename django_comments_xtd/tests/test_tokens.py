@@ -0,0 +1,83 @@
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from django_comments_xtd import signed, tokens
+from django_comments_xtd.conf import settings
+from django_comments_xtd.models import TmpXtdComment
+from django_comments_xtd.tests.models import Article
+
+
+class TokensTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="September", slug="september", body="During September...")
+        self.comment = TmpXtdComment({
+            'content_type': ContentType.objects.get_for_model(self.article),
+            'object_pk': str(self.article.pk),
+            'content_object': self.article,
+            'site_id': 1,
+            'user_name': "Bob",
+            'user_email': "bob@example.com",
+            'user_url': "",
+            'comment': "Es war einmal eine kleine...",
+            'submit_date': datetime(2022, 10, 26, 12, 30, 15, 123456),
+            'ip_address': "127.0.0.1",
+            'is_public': True,
+            'is_removed': False,
+            'thread_id': 0, 'parent_id': 0, 'level': 0, 'order': 1,
+            'followup': True,
+            'user': None,
+        })
+
+    def test_confirmation_key_round_trip(self):
+        key = tokens.get_confirmation_key(self.comment)
+        self.assertFalse(tokens.is_legacy_key(key))
+        with self.assertNumQueries(0):
+            comment = tokens.load_confirmation_key(key)
+        self.assertIsInstance(comment, TmpXtdComment)
+        self.assertNotIn('content_object', comment)
+        with self.assertNumQueries(1):
+            self.assertEqual(comment.content_object, self.article)
+        self.assertEqual(comment, self.comment)
+
+    def test_confirmation_key_stores_the_user_id(self):
+        user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        self.comment['user'] = user
+        comment = tokens.load_confirmation_key(
+            tokens.get_confirmation_key(self.comment))
+        self.assertEqual(comment['user_id'], user.pk)
+        self.assertNotIn('user', comment)
+
+    def test_legacy_confirmation_key(self):
+        key = signed.dumps(self.comment, compress=True,
+                           extra_key=settings.COMMENTS_XTD_SALT)
+        key = key.decode('utf-8')
+        self.assertTrue(tokens.is_legacy_key(key))
+        with self.assertNumQueries(0):
+            comment = tokens.load_confirmation_key(key)
+        self.assertEqual(comment.content_object, self.article)
+        self.assertEqual(comment, self.comment)
+
+    def test_confirmation_key_is_shorter_than_legacy_key(self):
+        key = tokens.get_confirmation_key(self.comment)
+        legacy_key = signed.dumps(self.comment, compress=True,
+                                  extra_key=settings.COMMENTS_XTD_SALT)
+        self.assertLess(len(key), len(legacy_key))
+
+    def test_bad_keys(self):
+        key = tokens.get_confirmation_key(self.comment)
+        for bad_key in [key[:-1], "x" + key, "no-signature"]:
+            with self.assertRaises(tokens.BadKey):
+                tokens.load_confirmation_key(bad_key)
+
+    def test_keys_are_bound_to_their_purpose(self):
+        key = tokens.get_mute_key(1, 1, 1)
+        with self.assertRaises(tokens.BadKey):
+            tokens.load_confirmation_key(key)
+
+    def test_mute_key(self):
+        key = tokens.get_mute_key(5, 17, 42)
+        self.assertEqual(tokens.load_mute_key(key), (5, "17", 42))
@@ -9,21 +9,29 @@ from datetime import datetime
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.contrib.auth.models import AnonymousUser, User, Permission
-from django.http import HttpRequest
+from django.core import mail
+from django.http import Http404, HttpRequest
 from django.test import TestCase, RequestFactory
 from django.urls import reverse
+from django.utils import timezone
 from django_comments.models import CommentFlag
 
 from django_comments.views import comments
 
-from django_comments_xtd import django_comments, signals, signed, views
+from django_comments_xtd import (
+    django_comments, signals, signed, tokens, views
+)
 from django_comments_xtd.conf import settings
 from django_comments_xtd.models import (
     XtdComment, LIKEDIT_FLAG, DISLIKEDIT_FLAG, TmpXtdComment
 )
 from django_comments_xtd.tests.models import Article, Diary
+from django_comments_xtd.utils import send_mail
+from django_comments_xtd.tests.test_models import (
+    thread_test_step_1, thread_test_step_2
+)
 from django_comments_xtd.views import (
-    on_comment_will_be_posted, on_comment_was_posted
+    on_comment_will_be_posted, on_comment_was_posted, XtdCommentListView
 )
 
 request_factory = RequestFactory()
@@ -452,6 +460,34 @@ class XtdCommentListViewTestCase(TestCase):
         self.assertNotContains(response, 'This comment has been removed.')
 
 
+class XtdCommentListViewByThreadTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="October", slug="october", body="What I did on October...")
+        thread_test_step_1(self.article)
+        thread_test_step_2(self.article)
+        self.view = XtdCommentListView.as_view(
+            content_types=["tests.article"], paginate_by=1,
+            paginate_by_thread=True)
+
+    def get_page(self, cursor=None):
+        request = request_factory.get(
+            '/comments/', {'cursor': cursor} if cursor else {})
+        return self.view(request).context_data
+
+    def test_pages_contain_whole_threads(self):
+        context = self.get_page()
+        self.assertEqual([cm.id for cm in context['object_list']], [1, 3, 4])
+        self.assertEqual(context['next_cursor'], 1)
+        context = self.get_page(cursor=1)
+        self.assertEqual([cm.id for cm in context['object_list']], [2])
+        self.assertIsNone(context['next_cursor'])
+
+    def test_invalid_cursor_raises_404(self):
+        with self.assertRaises(Http404):
+            self.get_page(cursor='x')
+
+
 class OnCommentWasPostedTestCase(TestCase):
     def setUp(self):
         patcher = patch('django_comments_xtd.views.send_mail')
@@ -470,6 +506,7 @@ class OnCommentWasPostedTestCase(TestCase):
         self.assertEqual(response.status_code, response_code)
         if response.status_code == 302:
             self.assertTrue(response.url.startswith('/comments/posted/?c='))
+        return response
 
     def test_post_as_authenticated_user(self):
         self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
@@ -478,6 +515,20 @@ class OnCommentWasPostedTestCase(TestCase):
         # no confirmation email sent as user is authenticated
         self.assertTrue(self.mock_mailer.call_count == 0)
 
+    def test_posts_at_once_create_one_comment(self):
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        # Both posts get the same submit_date, and so the same content_hash.
+        with patch('django_comments.forms.timezone.now',
+                   return_value=timezone.now()):
+            self.post_valid_data(auth_user=self.user)
+            comment = XtdComment.objects.get()
+            # The comment is created by another request after the lookup.
+            with patch('django_comments_xtd.views._get_comment_if_exists',
+                       side_effect=[None, comment]):
+                response = self.post_valid_data(auth_user=self.user)
+        self.assertEqual(response.url, '/comments/posted/?c=%d' % comment.pk)
+        self.assertEqual(XtdComment.objects.count(), 1)
+
     def test_confirmation_email_is_sent(self):
         self.assertTrue(self.mock_mailer.call_count == 0)
         self.post_valid_data()
@@ -535,6 +586,23 @@ class ConfirmCommentTestCase(TestCase):
         confirm_comment_url(self.key)
         self.assertEqual(response.status_code, 302)
 
+    def test_confirmations_at_once_create_one_comment(self):
+        confirm_comment_url(self.key)
+        # The comment is created by another request after the lookup.
+        with patch('django_comments_xtd.views._get_comment_if_exists',
+                   side_effect=[None, XtdComment.objects.get()]):
+            response = confirm_comment_url(self.key, follow=False)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(XtdComment.objects.count(), 1)
+
+    def test_comments_without_hash_are_not_created_again(self):
+        # Comments posted before the content_hash field existed.
+        confirm_comment_url(self.key)
+        XtdComment.norel_objects.update(content_hash=None)
+        response = confirm_comment_url(self.key, follow=False)
+        comment = XtdComment.objects.get()
+        self.assertEqual(response.url, comment.get_absolute_url())
+
     def test_signal_receiver_may_discard_the_comment(self):
         # test that receivers of signal confirmation_received may return False
         # and thus rendering a template_discarded output
@@ -553,7 +621,7 @@ class ConfirmCommentTestCase(TestCase):
         # and redirects to the article detail page
         Site.objects.get_current().domain = "testserver"  # django bug #7743
         response = confirm_comment_url(self.key, follow=False)
-        data = signed.loads(self.key, extra_key=settings.COMMENTS_XTD_SALT)
+        data = tokens.load_confirmation_key(self.key)
         comment = XtdComment.objects.get(
             content_type=data["content_type"],
             user_name=data["user_name"],
@@ -562,6 +630,16 @@ class ConfirmCommentTestCase(TestCase):
         self.assertTrue(comment is not None)
         self.assertEqual(response.url, comment.get_absolute_url())
 
+    def test_confirm_queries(self):
+        # The key is loaded without queries, and the content object is not
+        # loaded. Check the comment does not exist, create it (savepoint
+        # and two INSERTs) and look for followers.
+        with self.assertNumQueries(6):
+            confirm_comment_url(self.key, follow=False)
+        # Once confirmed, only check that the comment exists.
+        with self.assertNumQueries(1):
+            confirm_comment_url(self.key, follow=False)
+
     def test_notify_comment_followers(self):
         # send a couple of comments to the article with followup=True and check
         # that when the second comment is confirmed a followup notification
@@ -802,6 +880,110 @@ class MuteFollowUpTestCase(TestCase):
         self.assertTrue(self.mock_mailer.call_count == 4)
 
 
+class NotifyCommentFollowersTestCase(TestCase):
+    def setUp(self):
+        patcher = patch.multiple(
+            'django_comments_xtd.conf.settings',
+            COMMENTS_XTD_MAIL_BACKEND=(
+                "django_comments_xtd.mail.SyncMailBackend"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Other test cases leave views.send_mail patched.
+        patcher = patch('django_comments_xtd.views.send_mail', send_mail)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.article = Article.objects.create(
+            title="September", slug="september", body="John's September")
+        self.ctype = ContentType.objects.get_for_model(self.article)
+        for name, email, followup in [
+            ("Bob", "bob@example.com", True),
+            ("O'Brien", "obrien@example.com", True),
+            ("Bob", "bob@example.com", True),
+            ("Carol", "carol@example.com", False),
+        ]:
+            self.comment = XtdComment.objects.create(
+                content_type=self.ctype, object_pk=self.article.pk,
+                content_object=self.article, site=Site.objects.get_current(),
+                name=name, email=email, followup=followup,
+                comment="Nice September.")
+        self.comment = XtdComment.objects.create(
+            content_type=self.ctype, object_pk=self.article.pk,
+            content_object=self.article, site=Site.objects.get_current(),
+            name="Alice", email="alice@example.com", followup=True,
+            comment="Let us see.")
+
+    def test_one_message_per_follower(self):
+        views.notify_comment_followers(self.comment)
+        self.assertEqual([m.to for m in mail.outbox],
+                         [["bob@example.com"], ["obrien@example.com"]])
+        bob_text, obrien_text = [m.body for m in mail.outbox]
+        self.assertTrue(bob_text.startswith("\nBob,"))
+        self.assertTrue(obrien_text.startswith("\nO&#x27;Brien,"))
+        self.assertIn("Let us see.", obrien_text)
+        html = mail.outbox[1].alternatives[0][0]
+        self.assertTrue(html.startswith("<p>O&#x27;Brien,</p>"))
+        bob_key = re.search(r'/mute/(?P<key>\S+)/', bob_text).group("key")
+        obrien_key = re.search(r'/mute/(?P<key>\S+)/',
+                               obrien_text).group("key")
+        self.assertNotEqual(bob_key, obrien_key)
+        self.assertIn('/mute/%s/' % obrien_key, html)
+
+    def test_queries_do_not_depend_on_followers(self):
+        comment = XtdComment.norel_objects.get(pk=self.comment.pk)
+        # The followers, the content object and the site.
+        with self.assertNumQueries(3):
+            views.notify_comment_followers(comment)
+
+    def test_mute_key_mutes_the_follower(self):
+        bob = XtdComment.objects.filter(user_email="bob@example.com")[0]
+        key = tokens.get_mute_key(self.ctype.pk, self.article.pk, bob.pk)
+        request = request_factory.get(reverse("comments-xtd-mute",
+                                              kwargs={'key': key}))
+        request.user = AnonymousUser()
+        response = views.mute(request, key)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(XtdComment.objects.filter(
+            user_email="bob@example.com", followup=True).exists())
+        with self.assertRaises(Http404):
+            views.mute(request, key)
+
+    def test_mute_queries(self):
+        bob = XtdComment.objects.filter(user_email="bob@example.com")[0]
+        key = tokens.get_mute_key(self.ctype.pk, self.article.pk, bob.pk)
+        request = request_factory.get(reverse("comments-xtd-mute",
+                                              kwargs={'key': key}))
+        request.user = AnonymousUser()
+        # The comment sent with the signal, found by the email address of
+        # the comment in the key, the UPDATE and the content object.
+        with self.assertNumQueries(3):
+            views.mute(request, key)
+
+    def test_mute_queries_with_the_whole_comment(self):
+        comment = XtdComment.objects.filter(user_email="obrien@example.com")[0]
+        key = signed.dumps(comment, compress=True,
+                           extra_key=settings.COMMENTS_XTD_SALT)
+        key = key.decode('utf-8')
+        request = request_factory.get(reverse("comments-xtd-mute",
+                                              kwargs={'key': key}))
+        request.user = AnonymousUser()
+        # The comment exists, the UPDATE and the content object.
+        with self.assertNumQueries(3):
+            views.mute(request, key)
+
+    def test_mute_key_with_the_whole_comment(self):
+        comment = XtdComment.objects.filter(user_email="obrien@example.com")[0]
+        key = signed.dumps(comment, compress=True,
+                           extra_key=settings.COMMENTS_XTD_SALT)
+        key = key.decode('utf-8')
+        request = request_factory.get(reverse("comments-xtd-mute",
+                                              kwargs={'key': key}))
+        request.user = AnonymousUser()
+        response = views.mute(request, key)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(XtdComment.objects.filter(
+            user_email="obrien@example.com", followup=True).exists())
+
+
 class HTMLDisabledMailTestCase(TestCase):
     def setUp(self):
         # Create an article and send a comment. Test method will check headers
@@ -835,3 +1017,43 @@ class HTMLDisabledMailTestCase(TestCase):
         self.assertTrue(response.url.startswith('/comments/posted/?c='))
         self.assertTrue(self.mock_mailer.call_count == 1)
         self.assertTrue(self.mock_mailer.call_args[1]['html'] is not None)
+
+
+class FeedbackCountersTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("bob", "bob@example.com", "pwd")
+        self.diary = Diary.objects.create(body="What I did on September...")
+        self.comment = XtdComment.objects.create(
+            content_object=self.diary,
+            site=Site.objects.get(pk=1),
+            comment="comment 1 to diary",
+        )
+        self.request = request_factory.post("/")
+        self.request.user = self.user
+
+    def get_counters(self):
+        return XtdComment.objects.values_list(
+            'likedit_count', 'dislikedit_count', 'flagged_count'
+        ).get(pk=self.comment.pk)
+
+    def test_perform_like_and_dislike_update_counters(self):
+        self.assertTrue(views.perform_like(self.request, self.comment))
+        self.assertEqual(self.get_counters(), (1, 0, 0))
+        # Disliking withdraws the like.
+        self.assertTrue(views.perform_dislike(self.request, self.comment))
+        self.assertEqual(self.get_counters(), (0, 1, 0))
+        # Disliking again withdraws the dislike.
+        self.assertFalse(views.perform_dislike(self.request, self.comment))
+        self.assertEqual(self.get_counters(), (0, 0, 0))
+
+    def test_perform_flag_updates_counter_once(self):
+        self.assertTrue(views.perform_flag(self.request, self.comment))
+        self.assertFalse(views.perform_flag(self.request, self.comment))
+        self.assertEqual(self.get_counters(), (0, 0, 1))
+
+    def test_saving_a_comment_does_not_overwrite_counters(self):
+        views.perform_like(self.request, self.comment)
+        # self.comment still holds likedit_count == 0.
+        self.comment.comment = "edited comment"
+        self.comment.save()
+        self.assertEqual(self.get_counters(), (1, 0, 0))
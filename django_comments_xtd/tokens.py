@@ -0,0 +1,113 @@
+"""
+Signed keys of the confirmation and mute URLs.
+
+Keys are made with django.core.signing: a URL-safe base64 JSON payload,
+zlib compressed when it saves space, the time it was made, and an
+HMAC-SHA256 signature, separated by ':'. The payload holds only the values
+needed to act on the key:
+
+ * Confirmation keys, the fields of the comment to create. The content type
+   is given by its natural key, ie: "blog.post", and the user by its id.
+ * Mute keys, the content type id, the object_pk and the id of a comment
+   of the follower, to find its email address, which is not disclosed in
+   the URL, with an index lookup.
+
+Keys made before, with django_comments_xtd.signed, pickle whole comments.
+They are still accepted by load_confirmation_key and load_mute_key, and
+are told apart as they don't contain ':'.
+"""
+import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import signing
+from django.db import models
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_str
+
+from django_comments_xtd import signed
+from django_comments_xtd.conf import settings
+
+
+# Exceptions raised when a key is not valid.
+BadKey = (ValueError, signing.BadSignature, signed.BadSignature)
+
+
+def _salt(purpose):
+    return "django_comments_xtd.%s.%s" % (
+        purpose, force_str(settings.COMMENTS_XTD_SALT))
+
+
+def is_legacy_key(key):
+    return ':' not in key
+
+
+# Fields of the comments in confirmation keys are named by their position
+# in this tuple, other fields keep their name.
+CONFIRMATION_FIELDS = (
+    'content_type', 'object_pk', 'site_id', 'user_name', 'user_email',
+    'user_url', 'comment', 'submit_date', 'ip_address', 'is_public',
+    'is_removed', 'thread_id', 'parent_id', 'level', 'order', 'followup',
+    'type', 'user_id', 'in_review',
+)
+_aliases = {name: str(index) for index, name in enumerate(CONFIRMATION_FIELDS)}
+_names = {alias: name for name, alias in _aliases.items()}
+
+
+def get_confirmation_key(comment):
+    """Key of the URL to confirm the comment, a TmpXtdComment."""
+    payload = {}
+    dates = []
+    for name, value in comment.items():
+        if name == 'content_object':
+            continue
+        if name == 'content_type':
+            value = "%s.%s" % value.natural_key()
+        elif isinstance(value, models.Model):
+            name, value = "%s_id" % name, value.pk
+        elif isinstance(value, datetime.datetime):
+            dates.append(name)
+            value = value.isoformat()
+        payload[_aliases.get(name, name)] = value
+    if dates:
+        payload['_dates'] = dates
+    return signing.dumps(payload, salt=_salt('confirm'), compress=True)
+
+
+def load_confirmation_key(key):
+    """
+    Return the TmpXtdComment of a confirmation key. Raises one of BadKey
+    when the key is not valid.
+    """
+    from django_comments_xtd.models import TmpXtdComment
+
+    if is_legacy_key(key):
+        return signed.loads(key, extra_key=settings.COMMENTS_XTD_SALT)
+    payload = signing.loads(key, salt=_salt('confirm'))
+    dates = payload.pop('_dates', [])
+    payload = {_names.get(name, name): value
+               for name, value in payload.items()}
+    for name in dates:
+        payload[name] = parse_datetime(payload[name])
+    ctype = ContentType.objects.get_by_natural_key(
+        *payload.pop('content_type').split('.'))
+    return TmpXtdComment(payload, content_type=ctype)
+
+
+def get_mute_key(content_type_id, object_pk, comment_id):
+    """
+    Key of the URL to mute the follow-up notifications of the comments
+    posted to the object with the email address of the comment comment_id.
+    """
+    return signing.dumps([content_type_id, str(object_pk), comment_id],
+                         salt=_salt('mute'))
+
+
+def load_mute_key(key):
+    """
+    Return the (content_type_id, object_pk, comment_id) of a mute key, or
+    the comment pickled in a legacy key. Raises one of BadKey when the key
+    is not valid.
+    """
+    if is_legacy_key(key):
+        return signed.loads(key, extra_key=settings.COMMENTS_XTD_SALT)
+    return tuple(signing.loads(key, salt=_salt('mute')))
@@ -1,17 +1,9 @@
-# Idea borrowed from Selwin Ong post:
-# http://ui.co.id/blog/asynchronous-send_mail-in-django
-
 from copy import copy
 import hashlib
 
 from django.utils import timezone, formats
 from django.utils.translation import activate, get_language
 
-try:
-    import Queue as queue  # python2
-except ImportError:
-    import queue as queue  # python3
-import threading
 try:
     from urllib.parse import urlencode
 except ImportError:
@@ -23,44 +15,19 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.utils.crypto import salted_hmac
 
 from django_comments_xtd.conf import settings
+from django_comments_xtd.mail import get_mail_backend
 
 
-mail_sent_queue = queue.Queue()
-
-
-class EmailThread(threading.Thread):
-    def __init__(self, subject, body, from_email, recipient_list,
-                 fail_silently, html):
-        self.subject = subject
-        self.body = body
-        self.recipient_list = recipient_list
-        self.from_email = from_email
-        self.fail_silently = fail_silently
-        self.html = html
-        threading.Thread.__init__(self)
-
-    def run(self):
-        _send_mail(self.subject, self.body, self.from_email,
-                   self.recipient_list, self.fail_silently, self.html)
-        mail_sent_queue.put(True)
-
-
-def _send_mail(subject, body, from_email, recipient_list,
-               fail_silently=False, html=None):
+def send_mail(subject, body, from_email, recipient_list,
+              fail_silently=False, html=None):
+    """
+    Send the email through the mail backend in use, see
+    django_comments_xtd.mail.
+    """
     msg = EmailMultiAlternatives(subject, body, from_email, recipient_list)
     if html:
         msg.attach_alternative(html, "text/html")
-    msg.send(fail_silently)
-
-
-def send_mail(subject, body, from_email, recipient_list,
-              fail_silently=False, html=None):
-    if settings.COMMENTS_XTD_THREADED_EMAILS:
-        EmailThread(subject, body, from_email, recipient_list,
-                    fail_silently, html).start()
-    else:
-        _send_mail(subject, body, from_email, recipient_list,
-                   fail_silently, html)
+    get_mail_backend().send_messages([msg], fail_silently)
 
 
 def get_app_model_options(comment=None, content_type=None):
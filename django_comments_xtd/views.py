@@ -1,18 +1,21 @@
 from __future__ import unicode_literals
-import six
+import itertools
 
 from django.apps import apps
-from django.db.utils import NotSupportedError
+from django.db.models import Max, Q, Subquery
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import redirect_to_login
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.shortcuts import get_current_site
 from django.core import signing
+from django.db import IntegrityError
+from django.db.transaction import atomic
 from django.http import Http404, HttpResponseForbidden, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect, render, resolve_url
 from django.template import loader
 from django.urls import reverse
+from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.csrf import csrf_protect
 from django.views.defaults import bad_request
@@ -20,19 +23,27 @@ from django.views.generic import ListView
 
 
 from django_comments.models import CommentFlag
-from django_comments.views.moderation import perform_flag
+from django_comments.signals import comment_was_flagged
 from django_comments.views.utils import next_redirect, confirmation_view
 
 from django_comments_xtd import (
     comment_was_posted, comment_will_be_posted,
     get_form, get_model as get_comment_model,
-    signals, signed
+    signals
 )
 from django_comments_xtd.conf import settings
+from django_comments_xtd.mail import get_mail_backend
+from django_comments_xtd.moderation import submit_for_review
 from django_comments_xtd.models import (
     TmpXtdComment,
     MaxThreadLevelExceededException,
-    LIKEDIT_FLAG, DISLIKEDIT_FLAG
+    get_content_hash,
+    LIKEDIT_FLAG, DISLIKEDIT_FLAG,
+    get_thread_page, update_feedback_counters
+)
+from django_comments_xtd.tokens import (
+    BadKey, get_confirmation_key, get_mute_key,
+    load_confirmation_key, load_mute_key
 )
 from django_comments_xtd.utils import (
     get_current_site_id, send_mail, get_app_model_options
@@ -59,7 +70,7 @@ def send_email_confirmation_request(
     """Send email requesting comment confirmation"""
     subject = _("comment confirmation request")
     confirmation_url = reverse("comments-xtd-confirm",
-                               args=[key.decode('utf-8')])
+                               args=[force_str(key)])
     message_context = {'comment': comment,
                        'confirmation_url': confirmation_url,
                        'contact': settings.COMMENTS_XTD_CONTACT_EMAIL,
@@ -80,26 +91,49 @@ def send_email_confirmation_request(
 
 def _get_comment_if_exists(comment):
     """
-    True if exists a XtdComment with same user_name, user_email and submit_date.
+    Return the XtdComment with same content_hash, or None. It's an index
+    lookup on the content_hash. Comments posted before the field existed
+    have no hash until initialize_content_hashes runs, and are matched on
+    their user_name, user_email, followup and submit_date instead.
     """
     return XtdComment.objects.filter(
-        user_name=comment.user_name,
-        user_email=comment.user_email,
-        followup=comment.followup,
-        submit_date=comment.submit_date
-    ).first()
+        Q(content_hash=get_content_hash(comment)) |
+        Q(content_hash__isnull=True, user_name=comment.user_name,
+          user_email=comment.user_email, followup=comment.followup,
+          submit_date=comment.submit_date)).first()
 
 
 def _create_comment(tmp_comment):
     """
-    Creates a XtdComment from a TmpXtdComment.
+    Creates a XtdComment from a TmpXtdComment. Comments held in review by
+    the moderator are submitted for review.
     """
-    comment = XtdComment(**tmp_comment)
+    comment = XtdComment(**{name: value for name, value in tmp_comment.items()
+                            if name != 'in_review'})
     # comment.is_public = True
     comment.save()
+    if tmp_comment.get('in_review'):
+        submit_for_review(comment)
     return comment
 
 
+def _create_comment_once(tmp_comment):
+    """
+    Creates a XtdComment from a TmpXtdComment and returns it with True.
+    When the comment is posted or confirmed twice at once, the unique
+    content_hash makes the INSERT of the second request fail, then the
+    comment created by the first one is returned with False. XtdComment.save
+    inserts in a savepoint, the failed INSERT doesn't break the transaction.
+    """
+    try:
+        return _create_comment(tmp_comment), True
+    except IntegrityError:
+        comment = _get_comment_if_exists(tmp_comment)
+        if comment is None:
+            raise
+        return comment, False
+
+
 def on_comment_will_be_posted(sender, comment, request, **kwargs):
     """
     Check whether there are conditions to reject the post.
@@ -147,16 +181,18 @@ def on_comment_was_posted(sender, comment, request, **kwargs):
 
     if not settings.COMMENTS_XTD_CONFIRM_EMAIL or user_is_authenticated:
         if _get_comment_if_exists(comment) is None:
-            new_comment = _create_comment(comment)
+            new_comment, created = _create_comment_once(comment)
             comment.xtd_comment = new_comment
+            if not created:
+                # Posted twice at once, the other request created it.
+                return
             signals.confirmation_received.send(sender=TmpXtdComment,
                                                comment=comment,
                                                request=request)
             if comment.is_public:
                 notify_comment_followers(new_comment)
     else:
-        key = signed.dumps(comment, compress=True,
-                           extra_key=settings.COMMENTS_XTD_SALT)
+        key = get_confirmation_key(comment)
         site = get_current_site(request)
         send_email_confirmation_request(comment, key, site)
 
@@ -213,9 +249,8 @@ def sent(request, using=None):
 def confirm(request, key,
             template_discarded="django_comments_xtd/discarded.html"):
     try:
-        tmp_comment = signed.loads(str(key),
-                                   extra_key=settings.COMMENTS_XTD_SALT)
-    except (ValueError, signed.BadSignature) as exc:
+        tmp_comment = load_confirmation_key(str(key))
+    except BadKey as exc:
         return bad_request(request, exc)
 
     # The comment does exist if the URL was already confirmed,
@@ -237,7 +272,10 @@ def confirm(request, key,
                 {'comment': tmp_comment}
             )
 
-    comment = _create_comment(tmp_comment)
+    comment, created = _create_comment_once(tmp_comment)
+    if not created:
+        # Confirmed twice at once, the other request created the comment.
+        return redirect(comment)
     if comment.is_public is False:
         return render(request, get_moderated_tmpl(comment),
                       {'comment': comment})
@@ -247,54 +285,46 @@ def confirm(request, key,
 
 
 def notify_comment_followers(comment):
-    followers = {}
-    kwargs = {'content_type': comment.content_type,
-              'object_pk': comment.object_pk,
-              'is_public': True,
-              'followup': True}
-    previous_comments = XtdComment.objects\
-                                  .filter(**kwargs)\
-                                  .exclude(user_email=comment.user_email)
-
-    def feed_followers(gen):
-        for instance in gen:
-            followers[instance.user_email] = (
-                instance.user_name,
-                signed.dumps(instance, compress=True,
-                             extra_key=settings.COMMENTS_XTD_SALT))
-
-    try:
-        gen = previous_comments.distinct('user_email').order_by('user_email')
-        feed_followers(gen)
-    except NotSupportedError:
-        feed_followers(previous_comments)
-
-    for instance in previous_comments:
-        followers[instance.user_email] = (
-            instance.user_name,
-            signed.dumps(instance, compress=True,
-                         extra_key=settings.COMMENTS_XTD_SALT))
+    followers = XtdComment.norel_objects\
+        .filter(content_type_id=comment.content_type_id,
+                object_pk=comment.object_pk,
+                is_public=True,
+                followup=True)\
+        .exclude(user_email=comment.user_email)\
+        .values('user_email')\
+        .annotate(user_name=Max('user_name'), comment_id=Max('pk'))\
+        .order_by('user_email')\
+        .iterator()
+    # The content object, the site and the templates are only loaded
+    # when there are followers to notify.
+    first_follower = next(followers, None)
+    if first_follower is None:
+        return
 
     subject = _("new comment posted")
+    message_context = {'comment': comment,
+                       'content_object': comment.content_object,
+                       'site': comment.site}
     text_message_template = loader.get_template(
         "django_comments_xtd/email_followup_comment.txt")
-    html_message_template = loader.get_template(
-        "django_comments_xtd/email_followup_comment.html")
-
-    for email, (name, key) in six.iteritems(followers):
-        mute_url = reverse('comments-xtd-mute', args=[key.decode('utf-8')])
-        message_context = {'user_name': name,
-                           'comment': comment,
-                           'content_object': comment.content_object,
-                           'mute_url': mute_url,
-                           'site': comment.site}
-        text_message = text_message_template.render(message_context)
-        if settings.COMMENTS_XTD_SEND_HTML_EMAIL:
-            html_message = html_message_template.render(message_context)
-        else:
-            html_message = None
-        send_mail(subject, text_message, settings.COMMENTS_XTD_FROM_EMAIL,
-                  [email, ], html=html_message)
+    if settings.COMMENTS_XTD_SEND_HTML_EMAIL:
+        html_message_template = loader.get_template(
+            "django_comments_xtd/email_followup_comment.html")
+
+    with get_mail_backend().batch():
+        for follower in itertools.chain([first_follower], followers):
+            key = get_mute_key(comment.content_type_id, comment.object_pk,
+                               follower['comment_id'])
+            context = dict(message_context,
+                           user_name=follower['user_name'],
+                           mute_url=reverse('comments-xtd-mute', args=[key]))
+            text_message = text_message_template.render(context)
+            if settings.COMMENTS_XTD_SEND_HTML_EMAIL:
+                html_message = html_message_template.render(context)
+            else:
+                html_message = None
+            send_mail(subject, text_message, settings.COMMENTS_XTD_FROM_EMAIL,
+                      [follower['user_email'], ], html=html_message)
 
 
 def reply(request, cid):
@@ -340,39 +370,52 @@ def reply(request, cid):
 
 def mute(request, key):
     try:
-        tmp_comment = signed.loads(str(key),
-                                   extra_key=settings.COMMENTS_XTD_SALT)
-    except (ValueError, signed.BadSignature) as exc:
+        data = load_mute_key(str(key))
+    except BadKey as exc:
         return bad_request(request, exc)
 
-    # Can't mute a comment that doesn't have the followup attribute
-    # set to True, or a comment that doesn't exist.
-    if not tmp_comment.followup or _get_comment_if_exists(tmp_comment) is None:
-        raise Http404
+    if isinstance(data, tuple):  # Key made by get_mute_key.
+        content_type_id, object_pk, comment_id = data
+        user_email = XtdComment.norel_objects.filter(pk=comment_id)\
+                                             .values('user_email')[:1]
+        # Can't mute the comments of someone who doesn't follow them.
+        comment = XtdComment.norel_objects.filter(
+            content_type_id=content_type_id,
+            object_pk=object_pk,
+            user_email=Subquery(user_email),
+            is_public=True,
+            followup=True
+        ).first()
+        if comment is None:
+            raise Http404
+    else:  # Keys made by django_comments_xtd.signed, with the comment.
+        comment = data
+        # Can't mute a comment that doesn't have the followup attribute
+        # set to True, or a comment that doesn't exist.
+        if not comment.followup or _get_comment_if_exists(comment) is None:
+            raise Http404
+    content_type = ContentType.objects.get_for_id(comment.content_type_id)
 
     # Send signal that the comment thread has been muted
     signals.comment_thread_muted.send(sender=XtdComment,
-                                      comment=tmp_comment,
+                                      comment=comment,
                                       request=request)
 
     XtdComment.norel_objects.filter(
-        content_type=tmp_comment.content_type,
-        object_pk=tmp_comment.object_pk,
-        user_email=tmp_comment.user_email,
+        content_type=content_type,
+        object_pk=comment.object_pk,
+        user_email=comment.user_email,
         is_public=True,
         followup=True
     ).update(followup=False)
 
-    model = apps.get_model(tmp_comment.content_type.app_label,
-                           tmp_comment.content_type.model)
-    target = model._default_manager.get(pk=tmp_comment.object_pk)
+    model = apps.get_model(content_type.app_label, content_type.model)
+    target = model._default_manager.get(pk=comment.object_pk)
 
     template_arg = [
         "django_comments_xtd/%s/%s/muted.html" % (
-            tmp_comment.content_type.app_label,
-            tmp_comment.content_type.model),
-        "django_comments_xtd/%s/muted.html" % (
-            tmp_comment.content_type.app_label,),
+            content_type.app_label, content_type.model),
+        "django_comments_xtd/%s/muted.html" % (content_type.app_label,),
         "django_comments_xtd/muted.html"
     ]
     return render(request, template_arg, {"content_object": target})
@@ -440,12 +483,11 @@ def like(request, comment_id, next_url=None, **kwargs):
                              c=comment.pk)
     # Render a form on GET
     else:
-        flag_qs = comment.flags.prefetch_related('user')\
-            .filter(flag=LIKEDIT_FLAG)
-        users_likedit = [item.user for item in flag_qs]
+        already_liked_it = comment.flags.filter(flag=LIKEDIT_FLAG,
+                                                user=request.user).exists()
         return render(request, 'django_comments_xtd/like.html',
                       {'comment': comment,
-                       'already_liked_it': request.user in users_likedit,
+                       'already_liked_it': already_liked_it,
                        'next': next_url})
 
 
@@ -477,41 +519,69 @@ def dislike(request, comment_id, next_url=None, **kwargs):
                              c=comment.pk)
     # Render a form on GET
     else:
-        flag_qs = comment.flags.prefetch_related('user')\
-            .filter(flag=DISLIKEDIT_FLAG)
-        users_dislikedit = [item.user for item in flag_qs]
+        already_disliked_it = comment.flags.filter(
+            flag=DISLIKEDIT_FLAG, user=request.user).exists()
         return render(request, 'django_comments_xtd/dislike.html',
                       {'comment': comment,
-                       'already_disliked_it': request.user in users_dislikedit,
+                       'already_disliked_it': already_disliked_it,
                        'next': next_url})
 
 
+def perform_flag(request, comment):
+    """
+    Actually set the 'removal suggestion' flag on a comment from a request.
+
+    Same as django_comments.views.moderation.perform_flag, but it also
+    updates the comment's flagged_count counter.
+    """
+    with atomic():
+        flag, created = CommentFlag.objects.get_or_create(
+            comment=comment,
+            user=request.user,
+            flag=CommentFlag.SUGGEST_REMOVAL
+        )
+        if created:
+            update_feedback_counters(comment, flagged_count=1)
+    comment_was_flagged.send(
+        sender=comment.__class__,
+        comment=comment,
+        flag=flag,
+        created=created,
+        request=request,
+    )
+    return created
+
+
+def _toggle_feedback_flag(request, comment, flag, opposite_flag):
+    counters = {LIKEDIT_FLAG: 'likedit_count',
+                DISLIKEDIT_FLAG: 'dislikedit_count'}
+    with atomic():
+        flag_obj, created = CommentFlag.objects.get_or_create(
+            comment=comment, user=request.user, flag=flag)
+        if created:
+            deleted, _ = CommentFlag.objects.filter(
+                comment=comment, user=request.user, flag=opposite_flag
+            ).delete()
+            update_feedback_counters(comment, **{
+                counters[flag]: 1,
+                counters[opposite_flag]: -deleted
+            })
+        else:
+            flag_obj.delete()
+            update_feedback_counters(comment, **{counters[flag]: -1})
+    return created
+
+
 def perform_like(request, comment):
     """Actually set the 'Likedit' flag on a comment from a request."""
-    flag, created = CommentFlag.objects.get_or_create(comment=comment,
-                                                      user=request.user,
-                                                      flag=LIKEDIT_FLAG)
-    if created:
-        CommentFlag.objects.filter(comment=comment,
-                                   user=request.user,
-                                   flag=DISLIKEDIT_FLAG).delete()
-    else:
-        flag.delete()
-    return created
+    return _toggle_feedback_flag(request, comment,
+                                 LIKEDIT_FLAG, DISLIKEDIT_FLAG)
 
 
 def perform_dislike(request, comment):
     """Actually set the 'Dislikedit' flag on a comment from a request."""
-    flag, created = CommentFlag.objects.get_or_create(comment=comment,
-                                                      user=request.user,
-                                                      flag=DISLIKEDIT_FLAG)
-    if created:
-        CommentFlag.objects.filter(comment=comment,
-                                   user=request.user,
-                                   flag=LIKEDIT_FLAG).delete()
-    else:
-        flag.delete()
-    return created
+    return _toggle_feedback_flag(request, comment,
+                                 DISLIKEDIT_FLAG, LIKEDIT_FLAG)
 
 
 like_done = confirmation_view(
@@ -528,6 +598,9 @@ dislike_done = confirmation_view(
 class XtdCommentListView(ListView):
     page_range = 5
     content_types = None  # List of "app_name.model_name" strings.
+    # Page by thread instead of by comment, paginate_by is then the number
+    # of threads per page, and pages are reached with the ?cursor parameter.
+    paginate_by_thread = False
     template_name = "django_comments_xtd/comment_list.html"
 
     def get_content_types(self):
@@ -552,9 +625,24 @@ class XtdCommentListView(ListView):
             .filter(is_removed=False)\
             .order_by('submit_date')
 
+    def paginate_queryset(self, queryset, page_size):
+        if not self.paginate_by_thread:
+            return super(XtdCommentListView, self).paginate_queryset(
+                queryset, page_size)
+        cursor = self.request.GET.get('cursor')
+        try:
+            after = int(cursor) if cursor else None
+        except ValueError:
+            raise Http404(_("Invalid cursor"))
+        comments, self.next_cursor = get_thread_page(queryset, page_size,
+                                                     after)
+        return (None, None, comments, self.next_cursor is not None)
+
     def get_context_data(self, **kwargs):
         context = super(XtdCommentListView, self).get_context_data(**kwargs)
-        if 'paginator' in context:
+        if self.paginate_by_thread:
+            context['next_cursor'] = getattr(self, 'next_cursor', None)
+        elif context.get('paginator'):
             index = context['page_obj'].number - 1
             prange = [n for n in context['paginator'].page_range]
             if len(prange) > self.page_range: